@@ -1,32 +1,55 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from ..core.security import create_access_token, get_password_hash, verify_password
-from ..core.database import get_mysql_db
-from ..models.schemas import UserCreate, UserInDB, Token
+from starlette.concurrency import run_in_threadpool
+from ..core.security import create_access_token, get_current_user, get_password_hash, verify_password
+from ..core.database import get_mysql_connection
+from ..models.schemas import UserCreate, Token
 
 router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# Each helper checks a connection out only around its query, so logins
+# waiting on the password-hash pool don't hold MySQL connections.
+def _email_registered(email):
+    with get_mysql_connection() as db:
+        cursor = db.cursor(dictionary=True)
+        cursor.execute("SELECT * FROM users WHERE email = %s", (email,))
+        found = cursor.fetchone() is not None
+        cursor.close()
+    return found
+
+def _insert_user(email, hashed_password):
+    with get_mysql_connection() as db:
+        cursor = db.cursor(dictionary=True)
+        cursor.execute(
+            "INSERT INTO users (email, hashed_password) VALUES (%s, %s)",
+            (email, hashed_password)
+        )
+        db.commit()
+        cursor.close()
+
+def _find_user(email):
+    with get_mysql_connection() as db:
+        cursor = db.cursor(dictionary=True)
+        cursor.execute("SELECT * FROM users WHERE email = %s", (email,))
+        user = cursor.fetchone()
+        cursor.close()
+    return user
+
+# async so password hashing is awaited instead of holding a request thread;
+# the queries still run on the threadpool
 @router.post("/register", response_model=Token)
 async def register(user: UserCreate):
-    db = get_mysql_db()
-    cursor = db.cursor(dictionary=True)
-    
     # Check if user exists
-    cursor.execute("SELECT * FROM users WHERE email = %s", (user.email,))
-    if cursor.fetchone():
+    if await run_in_threadpool(_email_registered, user.email):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
         )
     
     # Create new user
-    hashed_password = get_password_hash(user.password)
-    cursor.execute(
-        "INSERT INTO users (email, hashed_password) VALUES (%s, %s)",
-        (user.email, hashed_password)
-    )
-    db.commit()
+    hashed_password = await get_password_hash(user.password)
+    await run_in_threadpool(_insert_user, user.email, hashed_password)
     
     # Create access token
     access_token = create_access_token(data={"sub": user.email})
@@ -34,13 +57,9 @@ async def register(user: UserCreate):
 
 @router.post("/token", response_model=Token)
 async def login(form_data: OAuth2PasswordRequestForm = Depends()):
-    db = get_mysql_db()
-    cursor = db.cursor(dictionary=True)
-    
-    cursor.execute("SELECT * FROM users WHERE email = %s", (form_data.username,))
-    user = cursor.fetchone()
+    user = await run_in_threadpool(_find_user, form_data.username)
     
-    if not user or not verify_password(form_data.password, user["hashed_password"]):
+    if not user or not await verify_password(form_data.password, user["hashed_password"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -0,0 +1,39 @@
+from datetime import datetime
+from typing import List
+from fastapi import APIRouter, HTTPException, Query
+from ..core.config import settings
+from ..models.schemas import PerformanceSample, performance_metrics_schema
+from ..services import performance_metrics
+
+router = APIRouter()
+
+METRIC_TYPES = performance_metrics_schema["properties"]["metric_type"]["enum"]
+
+@router.post("/performance-metrics")
+def ingest_performance_metrics(samples: List[PerformanceSample]):
+    if len(samples) > settings.METRICS_MAX_BATCH:
+        raise HTTPException(status_code=413, detail=f"At most {settings.METRICS_MAX_BATCH} samples per request")
+    stored = performance_metrics.ingest([sample.dict() for sample in samples])
+    return {"status": "success", "stored": stored}
+
+@router.get("/performance-metrics/{metric_type}")
+def query_performance_metrics(
+    metric_type: str,
+    start: datetime,
+    end: datetime,
+    step: int = Query(60, ge=1, description="bin width in seconds"),
+    percentiles: List[float] = Query([0.5, 0.95, 0.99])
+):
+    if metric_type not in METRIC_TYPES:
+        raise HTTPException(status_code=404, detail="Unknown metric type")
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+    if (end - start).total_seconds() / step > settings.METRICS_MAX_POINTS:
+        raise HTTPException(status_code=400, detail=f"Window too large for step; at most {settings.METRICS_MAX_POINTS} points")
+    if any(not 0 < p < 1 for p in percentiles):
+        raise HTTPException(status_code=400, detail="percentiles must be between 0 and 1")
+    return {
+        "metric_type": metric_type,
+        "step": step,
+        "points": performance_metrics.query(metric_type, start, end, step, percentiles),
+    }
@@ -0,0 +1,28 @@
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Query
+from ..services import search
+
+router = APIRouter()
+
+def _index():
+    index = search.current_index()
+    if index is None:
+        raise HTTPException(status_code=503, detail="Search index is still loading")
+    return index
+
+@router.get("/search")
+def search_catalog(
+    q: str = Query(..., min_length=1, max_length=100),
+    genre: Optional[str] = None,
+    release_year: Optional[int] = None,
+    limit: int = Query(20, ge=1, le=100)
+):
+    """시리즈/콘텐츠 제목 검색 (한국어·영어 n-gram 색인, 장르/연도 패싯)"""
+    return search.search(q, genre, release_year, limit, index=_index())
+
+@router.get("/search/autocomplete")
+def autocomplete(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(10, ge=1, le=20)
+):
+    return {"query": q, "suggestions": search.autocomplete(q, limit, index=_index())}
@@ -1,26 +1,54 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import Optional
+from bson import ObjectId
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from ..core import sharding
 from ..core.database import get_mongodb_db, get_redis_client
+from ..core.pagination import decode_cursor, page
 from ..core.security import get_current_user
-from ..models.schemas import Series, Episode, ViewingProgress
+from ..services import catalog
+from ..models.schemas import Series, SeriesPage, Episode, ViewingProgress
 
 router = APIRouter()
 
-@router.get("/series", response_model=list[Series])
-async def get_series(skip: int = 0, limit: int = 10):
+def _series_position(doc):
+    if isinstance(doc["_id"], ObjectId):
+        return {"oid": str(doc["_id"])}
+    return {"id": doc["_id"]}
+
+@router.get("/series", response_model=SeriesPage)
+def get_series(
+    after: Optional[str] = Query(None, alias="cursor"),
+    limit: int = Query(10, ge=1, le=100),
+    genre: Optional[str] = None,
+    release_year: Optional[int] = None
+):
     db = get_mongodb_db()
-    series_list = list(db.series.find({}).skip(skip).limit(limit))
-    return series_list
+    query = {}
+    if after:
+        position = decode_cursor(after)
+        oid, series_id = position.get("oid"), position.get("id")
+        if isinstance(oid, str) and ObjectId.is_valid(oid):
+            query["_id"] = {"$gt": ObjectId(oid)}
+        elif oid is None and isinstance(series_id, int) and not isinstance(series_id, bool):
+            query["_id"] = {"$gt": series_id}
+        else:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    if genre is not None:
+        query["genre"] = genre
+    if release_year is not None:
+        query["release_year"] = release_year
+    series_list = list(db.series.find(query).sort("_id", 1).limit(limit + 1))
+    return page(series_list, limit, key=_series_position)
 
 @router.get("/series/{series_id}", response_model=Series)
-async def get_series_by_id(series_id: str):
-    db = get_mongodb_db()
-    series = db.series.find_one({"_id": series_id})
+def get_series_by_id(series_id: str):
+    series = catalog.series_document(series_id)
     if not series:
         raise HTTPException(status_code=404, detail="Series not found")
     return series
 
 @router.get("/series/{series_id}/episodes", response_model=list[Episode])
-async def get_episodes(series_id: str):
+def get_episodes(series_id: str):
     db = get_mongodb_db()
     episodes = list(db.episodes.find({"series_id": series_id}))
     if not episodes:
@@ -28,25 +56,25 @@ async def get_episodes(series_id: str):
     return episodes
 
 @router.post("/series/{series_id}/progress")
-async def update_viewing_progress(
+def update_viewing_progress(
     series_id: str,
     episode_id: str,
     progress: ViewingProgress,
     current_user = Depends(get_current_user)
 ):
-    db = get_mongodb_db()
     redis = get_redis_client()
     
-    # Update viewing progress in MongoDB
-    result = db.viewing_progress.update_one(
-        {
-            "user_id": current_user["id"],
-            "series_id": series_id,
-            "episode_id": episode_id
-        },
-        {"$set": {"progress": progress.dict()}},
-        upsert=True
-    )
+    # Update viewing progress in MongoDB, on the user's shard (both shards while it moves)
+    for shard in sharding.write_shards(current_user["id"]):
+        sharding.mongo_db(shard).viewing_progress.update_one(
+            {
+                "user_id": current_user["id"],
+                "series_id": series_id,
+                "episode_id": episode_id
+            },
+            {"$set": {"progress": progress.dict()}},
+            upsert=True
+        )
     
     # Cache recent viewing progress in Redis
     redis.setex(
@@ -1,17 +1,18 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from datetime import datetime, timedelta
-from ..core.database import get_mysql_db
+from ..core.database import get_mysql_connection, get_mysql_db, mark_written, user_scope
 from ..core.security import get_current_user
 from ..models.schemas import Subscription, SubscriptionCreate
+from ..services.entitlements import invalidate_entitlement
 
 router = APIRouter()
 
 @router.post("/subscriptions", response_model=Subscription)
-async def create_subscription(
+def create_subscription(
     subscription: SubscriptionCreate,
-    current_user = Depends(get_current_user)
+    current_user = Depends(get_current_user),
+    db = Depends(get_mysql_db)
 ):
-    db = get_mysql_db()
     cursor = db.cursor(dictionary=True)
     
     # Check if user already has an active subscription
@@ -38,6 +39,8 @@ async def create_subscription(
         (current_user["id"], subscription.plan_id, start_date, end_date)
     )
     db.commit()
+    mark_written(user_scope(current_user["id"]))
+    invalidate_entitlement(current_user["id"])
     
     subscription_id = cursor.lastrowid
     return {
@@ -50,20 +53,22 @@ async def create_subscription(
     }
 
 @router.get("/subscriptions/current", response_model=Subscription)
-async def get_current_subscription(current_user = Depends(get_current_user)):
-    db = get_mysql_db()
-    cursor = db.cursor(dictionary=True)
-    
-    cursor.execute(
-        """
-        SELECT * FROM subscriptions 
-        WHERE user_id = %s AND end_date > NOW()
-        ORDER BY end_date DESC LIMIT 1
-        """,
-        (current_user["id"],)
-    )
-    
-    subscription = cursor.fetchone()
+def get_current_subscription(current_user = Depends(get_current_user)):
+    # Read-only: may be served by a replica, unless this user just wrote
+    with get_mysql_connection(read_only=True, scope=user_scope(current_user["id"])) as db:
+        cursor = db.cursor(dictionary=True)
+        
+        cursor.execute(
+            """
+            SELECT * FROM subscriptions 
+            WHERE user_id = %s AND end_date > NOW()
+            ORDER BY end_date DESC LIMIT 1
+            """,
+            (current_user["id"],)
+        )
+        
+        subscription = cursor.fetchone()
+        cursor.close()
     if not subscription:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -73,8 +78,7 @@ async def get_current_subscription(current_user = Depends(get_current_user)):
     return subscription
 
 @router.delete("/subscriptions/current")
-async def cancel_subscription(current_user = Depends(get_current_user)):
-    db = get_mysql_db()
+def cancel_subscription(current_user = Depends(get_current_user), db = Depends(get_mysql_db)):
     cursor = db.cursor()
     
     cursor.execute(
@@ -86,6 +90,8 @@ async def cancel_subscription(current_user = Depends(get_current_user)):
         (current_user["id"],)
     )
     db.commit()
+    mark_written(user_scope(current_user["id"]))
+    invalidate_entitlement(current_user["id"])
     
     if cursor.rowcount == 0:
         raise HTTPException(
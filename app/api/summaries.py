@@ -0,0 +1,35 @@
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Query
+from ..core.pagination import decode_cursor, page
+from ..services import summaries
+
+router = APIRouter()
+
+@router.get("/analytics/content-popularity")
+def list_content_popularity(
+    after: Optional[str] = Query(None, alias="cursor"),
+    limit: int = Query(20, ge=1, le=100)
+):
+    position = None
+    if after:
+        position = decode_cursor(after, {"unique_viewers": int, "content_id": int})
+    rows = summaries.content_popularity(limit, position)
+    return page(rows, limit, key=lambda row: {"unique_viewers": row["unique_viewers"], "content_id": row["content_id"]})
+
+@router.get("/analytics/content-popularity/{content_id}")
+def get_content_popularity(content_id: int):
+    row = summaries.content_popularity_for(content_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail="Content not found")
+    return row
+
+@router.get("/analytics/user-engagement/{user_id}")
+def get_user_engagement(user_id: int):
+    row = summaries.user_engagement(user_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return row
+
+@router.get("/analytics/subscription-metrics")
+def get_subscription_metrics():
+    return summaries.subscription_metrics()
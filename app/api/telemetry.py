@@ -0,0 +1,21 @@
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import JSONResponse
+from ..core.security import get_current_user
+from ..services import telemetry
+
+router = APIRouter()
+
+@router.post("/telemetry/{collection}")
+async def ingest_telemetry(collection: str, request: Request, current_user: dict = Depends(get_current_user)):
+    if collection not in telemetry.COLLECTIONS:
+        raise HTTPException(status_code=404, detail="Unknown telemetry collection")
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type in telemetry.NDJSON_TYPES:
+        items = telemetry.ndjson_items(request.stream())
+    elif content_type in telemetry.MSGPACK_TYPES:
+        items = telemetry.msgpack_items(request.stream())
+    else:
+        raise HTTPException(status_code=415, detail="Send application/x-ndjson or application/msgpack")
+
+    result = await telemetry.ingest(collection, items, current_user["id"])
+    return JSONResponse(status_code=400 if result.aborted else 200, content=result.as_dict())
@@ -1,23 +1,534 @@
+import itertools
+import queue
+import threading
+import time
+import weakref
+from anyio import to_thread
 import mysql.connector
 from pymongo import MongoClient
 import redis
+from . import metrics, profiling
+from .cache import LRUCache
 from .config import settings
 
-def get_mysql_connection():
+CATALOG_SCOPE = "catalog"
+WRITTEN_KEY = "mysql:written:{}"
+
+
+class PoolTimeoutError(Exception):
+    """No MySQL connection became free within the configured timeout."""
+
+
+class TimedCursor:
+    """Cursor proxy that records each statement in the backend metrics."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def _timed(self, method, statement, params, *args):
+        started = time.perf_counter()
+        try:
+            return method(statement, params, *args)
+        finally:
+            elapsed = time.perf_counter() - started
+            operation = metrics.mysql_operation(statement)
+            metrics.observe_backend("mysql", operation, elapsed)
+            profile = profiling.active.get()
+            if profile is not None:
+                profile.add("mysql", operation, statement, started, elapsed, params)
+
+    def execute(self, operation, params=None, multi=False):
+        return self._timed(self._cursor.execute, operation, params, multi)
+
+    def executemany(self, operation, seq_params):
+        return self._timed(self._cursor.executemany, operation, seq_params)
+
+    def callproc(self, procname, args=()):
+        return self._timed(self._cursor.callproc, procname, args)
+
+
+class PooledConnection:
+    """Proxy around a raw MySQL connection; close() hands it back to the pool.
+
+    Use it as a context manager (``with get_mysql_connection() as conn:``) so
+    the slot comes back even when a query raises. As a last resort, a proxy
+    that is garbage-collected without being closed releases its slot then.
+    """
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+        self._release = weakref.finalize(self, pool.release, raw)
+        self._release.atexit = False
+
+    def __getattr__(self, name):
+        if self._raw is None:
+            raise mysql.connector.errors.OperationalError("Connection already returned to the pool")
+        return getattr(self._raw, name)
+
+    def cursor(self, *args, **kwargs):
+        if self._raw is None:
+            raise mysql.connector.errors.OperationalError("Connection already returned to the pool")
+        return TimedCursor(self._raw.cursor(*args, **kwargs))
+
+    def close(self):
+        # The finalizer runs at most once, whether from here or on collection
+        self._raw = None
+        self._release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class MySQLPool:
+    """Bounded MySQL connection pool with checkout-wait metrics.
+
+    Connections idle for longer than ``ping_interval`` are pinged before being
+    handed out, and connections older than ``recycle`` are reopened, so stale
+    sockets dropped by the server (wait_timeout) never reach a handler.
+    """
+
+    def __init__(self, size, timeout, recycle, ping_interval, **connect_args):
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_interval = ping_interval
+        self._connect_args = connect_args
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._closed = False
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.stale_replaced = 0
+
+    def _connect(self):
+        raw = mysql.connector.connect(**self._connect_args)
+        raw._pool_created_at = raw._pool_returned_at = time.monotonic()
+        with self._lock:
+            self._opened += 1
+        return raw
+
+    def _discard(self, raw):
+        with self._lock:
+            self._opened -= 1
+        try:
+            raw.close()
+        except mysql.connector.Error:
+            pass
+
+    def _checked(self, raw):
+        now = time.monotonic()
+        if now - raw._pool_created_at > self.recycle:
+            self._discard(raw)
+            self.stale_replaced += 1
+            return self._connect()
+        if now - raw._pool_returned_at > self.ping_interval:
+            try:
+                raw.ping(reconnect=False)
+            except mysql.connector.Error:
+                self._discard(raw)
+                self.stale_replaced += 1
+                return self._connect()
+        return raw
+
+    def acquire(self):
+        if self._closed:
+            raise mysql.connector.errors.PoolError("MySQL pool is closed")
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            self.timeouts += 1
+            raise PoolTimeoutError(f"No MySQL connection available after {self.timeout}s")
+        waited = time.monotonic() - started
+        metrics.MYSQL_POOL_WAIT.observe(waited)
+        with self._lock:
+            self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        try:
+            try:
+                raw = self._checked(self._idle.get_nowait())
+            except queue.Empty:
+                raw = self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+        return PooledConnection(self, raw)
+
+    def release(self, raw):
+        try:
+            if self._closed or not raw.is_connected():
+                self._discard(raw)
+                return
+            if raw.in_transaction:
+                raw.rollback()
+            raw._pool_returned_at = time.monotonic()
+            self._idle.put(raw)
+        except mysql.connector.Error:
+            self._discard(raw)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "open": self._opened,
+            "idle": self._idle.qsize(),
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "wait_seconds_total": round(self.wait_seconds_total, 6),
+            "wait_seconds_max": round(self.wait_seconds_max, 6),
+            "stale_replaced": self.stale_replaced,
+        }
+
+
+class Replica:
+    """A read replica's pool and its replication lag, re-measured at most every
+    ``MYSQL_REPLICA_LAG_CHECK_INTERVAL`` seconds by whichever thread notices."""
+
+    def __init__(self, address, pool):
+        self.address = address
+        self.pool = pool
+        self.lag = None
+        self.checked_at = float("-inf")
+        self._checking = threading.Lock()
+        self.reads = 0
+
+    def _measure(self):
+        conn = self.pool.acquire()
+        try:
+            cursor = conn.cursor(dictionary=True)
+            try:
+                cursor.execute("SHOW REPLICA STATUS")
+            except mysql.connector.Error:  # MySQL < 8.0.22
+                cursor.execute("SHOW SLAVE STATUS")
+            status = cursor.fetchone() or {}
+            cursor.close()
+        finally:
+            conn.close()
+        # NULL while the replication threads are stopped
+        return status.get("Seconds_Behind_Source", status.get("Seconds_Behind_Master"))
+
+    def current_lag(self):
+        """Seconds behind the primary; infinite when unknown or unreachable."""
+        if time.monotonic() - self.checked_at >= settings.MYSQL_REPLICA_LAG_CHECK_INTERVAL \
+                and self._checking.acquire(blocking=False):
+            try:
+                self.lag = self._measure()
+            except (mysql.connector.Error, PoolTimeoutError):
+                self.lag = None
+            finally:
+                self.checked_at = time.monotonic()
+                self._checking.release()
+        return float("inf") if self.lag is None else float(self.lag)
+
+    def stats(self):
+        return {**self.pool.stats(), "lag": self.lag, "reads": self.reads}
+
+
+_mysql_pool = None
+_replicas = []
+_mongo_client = None
+_redis_pool = None
+_init_lock = threading.Lock()
+_next_replica = itertools.count()
+_recent_writes = LRUCache(maxsize=10000, ttl=settings.MYSQL_READ_YOUR_WRITES_SECONDS)
+_routing = {"replica_reads": 0, "sticky_reads": 0, "fallback_reads": 0}
+_routing_lock = threading.Lock()
+
+
+def create_mysql_pool(host, port, size):
+    return MySQLPool(
+        size=size,
+        timeout=settings.MYSQL_POOL_TIMEOUT,
+        recycle=settings.MYSQL_POOL_RECYCLE,
+        ping_interval=settings.MYSQL_POOL_PING_INTERVAL,
+        host=host,
+        port=port,
+        user=settings.MYSQL_USER,
+        password=settings.MYSQL_PASSWORD,
+        database=settings.MYSQL_DATABASE
+    )
+
+
+def create_mongo_client(uri):
+    return MongoClient(
+        uri,
+        maxPoolSize=settings.MONGO_MAX_POOL_SIZE,
+        minPoolSize=settings.MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=settings.MONGO_MAX_IDLE_TIME_MS,
+        waitQueueTimeoutMS=settings.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        event_listeners=[metrics.MongoCommandTimer(), metrics.MongoPoolCounter(), profiling.MongoCommandProfiler()]
+    )
+
+
+def init_pools():
+    """Create the process-wide MySQL pool, Mongo client and Redis pool."""
+    global _mysql_pool, _mongo_client, _redis_pool
+    with _init_lock:
+        if _mysql_pool is None:
+            _mysql_pool = create_mysql_pool(settings.MYSQL_HOST, settings.MYSQL_PORT, settings.MYSQL_POOL_SIZE)
+            for address in settings.MYSQL_REPLICA_HOSTS:
+                host, _, port = address.partition(":")
+                pool = create_mysql_pool(host, int(port or settings.MYSQL_PORT), settings.MYSQL_REPLICA_POOL_SIZE)
+                _replicas.append(Replica(address, pool))
+        if _mongo_client is None:
+            _mongo_client = create_mongo_client(settings.MONGO_URI)
+        if _redis_pool is None:
+            _redis_pool = redis.BlockingConnectionPool(
+                host=settings.REDIS_HOST,
+                port=settings.REDIS_PORT,
+                decode_responses=True,
+                max_connections=settings.REDIS_MAX_CONNECTIONS,
+                timeout=settings.REDIS_POOL_TIMEOUT,
+                health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL
+            )
+
+
+def configure_worker_threads():
+    """Bound the threadpool FastAPI runs sync handlers and dependencies in.
+
+    The MySQL, Mongo and Redis drivers are blocking, so every route that talks
+    to a backend is declared with ``def``; FastAPI then runs it on this pool
+    instead of the event loop. Must be called from the running event loop.
+    """
+    to_thread.current_default_thread_limiter().total_tokens = settings.WORKER_THREADS
+
+
+def close_pools():
+    global _mysql_pool, _mongo_client, _redis_pool
+    with _init_lock:
+        if _mysql_pool is not None:
+            _mysql_pool.close()
+            _mysql_pool = None
+        for replica in _replicas:
+            replica.pool.close()
+        _replicas.clear()
+        if _mongo_client is not None:
+            _mongo_client.close()
+            _mongo_client = None
+        if _redis_pool is not None:
+            _redis_pool.disconnect()
+            _redis_pool = None
+
+
+def pool_stats():
+    stats = {}
+    if _mysql_pool is not None:
+        stats["mysql"] = _mysql_pool.stats()
+    if _replicas:
+        stats["mysql_replicas"] = {replica.address: replica.stats() for replica in _replicas}
+        with _routing_lock:
+            stats["mysql_routing"] = dict(_routing)
+    if _redis_pool is not None:
+        stats["redis"] = {
+            "max_connections": _redis_pool.max_connections,
+            "open": len(_redis_pool._connections),
+        }
+    if _mongo_client is not None:
+        stats["mongodb"] = {"max_pool_size": settings.MONGO_MAX_POOL_SIZE}
+    return stats
+
+
+def check_health():
+    """Ping every backend through its pool; returns {"mysql": True, ...}."""
+    health = {}
+    try:
+        conn = get_mysql_connection()
+        try:
+            conn.ping(reconnect=False)
+        finally:
+            conn.close()
+        health["mysql"] = True
+    except Exception:
+        health["mysql"] = False
+    for replica in _replicas:
+        health[f"mysql_replica:{replica.address}"] = replica.current_lag() <= settings.MYSQL_REPLICA_MAX_LAG
+    try:
+        get_mongo_client().admin.command("ping")
+        health["mongodb"] = True
+    except Exception:
+        health["mongodb"] = False
+    try:
+        health["redis"] = bool(get_redis().ping())
+    except Exception:
+        health["redis"] = False
+    return health
+
+
+def user_scope(user_id):
+    return f"user:{user_id}"
+
+
+def mark_written(scope):
+    """Record a committed write to ``scope`` (e.g. ``user_scope(id)``, ``CATALOG_SCOPE``).
+
+    Reads in that scope go to the primary until the replicas have caught up
+    with the write, for at most ``MYSQL_READ_YOUR_WRITES_SECONDS``. Kept in
+    Redis so every worker sees it, and locally so this worker skips Redis.
+    """
+    if not _replicas:
+        return
+    now = time.time()
+    _recent_writes.set(scope, now)
+    try:
+        get_redis().set(WRITTEN_KEY.format(scope), now, ex=settings.MYSQL_READ_YOUR_WRITES_SECONDS)
+    except redis.RedisError:
+        pass  # other workers may read this scope from a replica until it catches up
+
+
+def _written_at(scope):
+    written = _recent_writes.get(scope)
+    if written is not None:
+        return written
+    try:
+        written = get_redis().get(WRITTEN_KEY.format(scope))
+    except redis.RedisError:
+        return time.time()  # can't tell; assume a fresh write
+    return float(written) if written is not None else None
+
+
+def _pick_replica(scope):
+    since_write = float("inf")
+    if scope is not None:
+        written = _written_at(scope)
+        if written is not None:
+            since_write = time.time() - written
+    start = next(_next_replica)
+    fresh_enough = False
+    for i in range(len(_replicas)):
+        replica = _replicas[(start + i) % len(_replicas)]
+        lag = replica.current_lag()
+        if lag > settings.MYSQL_REPLICA_MAX_LAG:
+            continue
+        fresh_enough = True
+        # Lag is reported in whole seconds, hence the extra second
+        if lag + 1 < since_write:
+            return replica
+    _count_read("sticky_reads" if fresh_enough else "fallback_reads")
+    return None
+
+
+def _count_read(kind, replica=None):
+    with _routing_lock:
+        _routing[kind] += 1
+        if replica is not None:
+            replica.reads += 1
+
+
+def get_mysql_connection(read_only=False, scope=None):
+    """Check a connection out of the shared pool; close() returns it.
+
+    With ``read_only`` the connection may come from a read replica
+    (``MYSQL_REPLICA_HOSTS``, round-robin). The primary is used instead when
+    no replica is within ``MYSQL_REPLICA_MAX_LAG``, when the replica pool is
+    exhausted, or when ``scope`` was written (``mark_written``) more recently
+    than the replica's lag, so a user reads their own writes.
+    """
+    if _mysql_pool is None:
+        init_pools()
+    if read_only and _replicas:
+        replica = _pick_replica(scope)
+        if replica is not None:
+            try:
+                conn = replica.pool.acquire()
+            except (PoolTimeoutError, mysql.connector.Error):
+                _count_read("fallback_reads")
+            else:
+                _count_read("replica_reads", replica)
+                return conn
+    return _mysql_pool.acquire()
+
+
+def connect_platform(host=None):
+    """Dedicated (unpooled) connection to the platform schema, for batch jobs."""
     return mysql.connector.connect(
-        host=settings.MYSQL_HOST,
+        host=host or settings.MYSQL_HOST,
         port=settings.MYSQL_PORT,
         user=settings.MYSQL_USER,
         password=settings.MYSQL_PASSWORD,
-        database=settings.MYSQL_DATABASE
+        database=settings.PLATFORM_MYSQL_DATABASE,
+        autocommit=False,
     )
 
+
 def get_mongo_client():
-    return MongoClient(settings.MONGO_URI)
+    if _mongo_client is None:
+        init_pools()
+    return _mongo_client
+
+
+class TimedPipeline(redis.client.Pipeline):
+    def execute(self, raise_on_error=True):
+        profile = profiling.active.get()
+        if profile is not None:
+            commands = " ".join(str(args[0]) for args, _ in self.command_stack)
+        started = time.perf_counter()
+        try:
+            return super().execute(raise_on_error)
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.observe_backend("redis", "pipeline", elapsed)
+            if profile is not None:
+                profile.add("redis", "pipeline", f"pipeline: {commands}", started, elapsed)
+
+
+class TimedRedis(redis.Redis):
+    """Redis client that records each command (and pipeline) in the backend metrics."""
+
+    def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            return super().execute_command(*args, **options)
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.observe_backend("redis", args[0], elapsed)
+            profile = profiling.active.get()
+            if profile is not None:
+                profile.add("redis", args[0], args[:2], started, elapsed)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return TimedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
 
 def get_redis():
-    return redis.Redis(
-        host=settings.REDIS_HOST,
-        port=settings.REDIS_PORT,
-        decode_responses=True
-    )
+    if _redis_pool is None:
+        init_pools()
+    return TimedRedis(connection_pool=_redis_pool)
+
+
+# FastAPI dependencies used by the routers in app/api
+def get_mysql_db():
+    conn = get_mysql_connection()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def get_mongodb_db():
+    return get_mongo_client()[settings.MONGO_DATABASE]
+
+
+def get_redis_client():
+    return get_redis()
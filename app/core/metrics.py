@@ -0,0 +1,253 @@
+"""Prometheus metrics for the API process, served at ``/metrics``.
+
+* HTTP: ``MetricsMiddleware`` (plain ASGI, so no per-request task or
+  response copy) times every request into
+  ``http_request_duration_seconds{route, method}`` and counts it by status.
+  ``route`` is the route's path template, or ``unmatched``, so the label
+  set stays bounded. ``http_requests_in_flight`` counts requests in progress.
+* Backends: ``backend_operation_duration_seconds{backend, operation}``. It is
+  fed by the wrappers in ``database.py``: MySQL cursor ``execute`` calls
+  labelled by statement verb, Redis commands and pipelines, and Mongo
+  commands via a pymongo command listener.
+  ``mysql_pool_wait_seconds`` is the time spent waiting for a pooled
+  connection.
+* Caches, pools and thread use are read from the existing ``stats()``
+  functions at scrape time by ``StatsCollector``. They cost nothing per
+  request.
+
+Label children are created once per label combination and kept in plain
+dicts, so the hot path is a dict lookup plus ``observe``/``inc``.
+
+Every uvicorn worker has its own registry; scrape each worker, or run one
+worker per container as the Dockerfile does.
+"""
+import time
+from anyio import to_thread
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BACKEND_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0, 5.0)
+MYSQL_VERBS = {"SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE", "CALL", "WITH", "SET", "SHOW", "EXPLAIN"}
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template",
+    ["route", "method"], buckets=LATENCY_BUCKETS,
+)
+REQUESTS = Counter("http_requests_total", "HTTP requests by route template and status", ["route", "method", "status"])
+IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests currently being handled")
+BACKEND_SECONDS = Histogram(
+    "backend_operation_duration_seconds", "Time spent in MySQL/Redis/Mongo calls",
+    ["backend", "operation"], buckets=BACKEND_BUCKETS,
+)
+MYSQL_POOL_WAIT = Histogram("mysql_pool_wait_seconds", "Time spent waiting for a pooled MySQL connection",
+                            buckets=BACKEND_BUCKETS)
+MONGO_CONNECTIONS = Gauge("mongo_pool_connections", "Mongo driver connections", ["state"])
+
+_request_children = {}
+_status_children = {}
+_backend_children = {}
+_route_paths = {}
+_mongo_open = MONGO_CONNECTIONS.labels("open")
+_mongo_in_use = MONGO_CONNECTIONS.labels("in_use")
+
+
+def observe_backend(backend, operation, seconds):
+    child = _backend_children.get((backend, operation))
+    if child is None:
+        child = _backend_children[(backend, operation)] = BACKEND_SECONDS.labels(backend, operation)
+    child.observe(seconds)
+
+
+def mysql_operation(statement):
+    """Label for a SQL statement: its leading verb, or ``other``."""
+    head = statement.lstrip(" \n\t(")[:10].split(None, 1)
+    verb = head[0].upper() if head else ""
+    return verb if verb in MYSQL_VERBS else "other"
+
+
+def route_path(scope):
+    """The path template of the route that handled ``scope``, or ``unmatched``."""
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return "unmatched"
+    path = _route_paths.get(endpoint)
+    if path is None:
+        for route in scope["app"].routes:
+            if getattr(route, "endpoint", None) is not None:
+                _route_paths[route.endpoint] = route.path
+        path = _route_paths.setdefault(endpoint, "unmatched")
+    return path
+
+
+def _observe_request(route, method, status, seconds):
+    key = (route, method)
+    child = _request_children.get(key)
+    if child is None:
+        child = _request_children[key] = REQUEST_SECONDS.labels(route, method)
+    child.observe(seconds)
+    key = (route, method, status)
+    counter = _status_children.get(key)
+    if counter is None:
+        counter = _status_children[key] = REQUESTS.labels(route, method, str(status))
+    counter.inc()
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            IN_FLIGHT.dec()
+            # The router filled in scope["endpoint"] on the way down
+            _observe_request(route_path(scope), scope["method"], status, time.perf_counter() - started)
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        observe_backend("mongodb", event.command_name, event.duration_micros / 1e6)
+
+    def failed(self, event):
+        observe_backend("mongodb", event.command_name, event.duration_micros / 1e6)
+
+
+class MongoPoolCounter(monitoring.ConnectionPoolListener):
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        _mongo_open.inc()
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        _mongo_open.dec()
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        pass
+
+    def connection_checked_out(self, event):
+        _mongo_in_use.inc()
+
+    def connection_checked_in(self, event):
+        _mongo_in_use.dec()
+
+
+def _cache_tiers(stats, path=()):
+    """Yield ``(name, stats)`` for every nested dict that has hits/misses."""
+    if "hits" in stats and "misses" in stats:
+        yield ".".join(path), stats
+        return
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            yield from _cache_tiers(value, path + (key,))
+
+
+class StatsCollector:
+    """Exports the in-process cache and pool stats on every scrape.
+
+    ``caches`` returns the same nested dict as ``/health``'s ``caches``;
+    ``pools`` returns ``database.pool_stats()``; ``password_hashing``
+    returns ``security.password_hash_stats()``.
+    """
+
+    def __init__(self, caches, pools, password_hashing):
+        self.caches = caches
+        self.pools = pools
+        self.password_hashing = password_hashing
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        hits = CounterMetricFamily("cache_hits", "Cache hits by cache and tier", labels=["cache"])
+        misses = CounterMetricFamily("cache_misses", "Cache misses by cache and tier", labels=["cache"])
+        ratio = GaugeMetricFamily("cache_hit_ratio", "Cache hit ratio since process start", labels=["cache"])
+        entries = GaugeMetricFamily("cache_entries", "Entries held by in-process caches", labels=["cache"])
+        for name, stats in _cache_tiers(self.caches()):
+            hits.add_metric([name], stats["hits"])
+            misses.add_metric([name], stats["misses"])
+            total = stats["hits"] + stats["misses"]
+            ratio.add_metric([name], stats["hits"] / total if total else 0.0)
+            if "size" in stats:
+                entries.add_metric([name], stats["size"])
+        yield from (hits, misses, ratio, entries)
+
+        pools = self.pools()
+        connections = GaugeMetricFamily("db_pool_connections", "Pool connections by state", labels=["backend", "state"])
+        mysql = pools.get("mysql")
+        if mysql:
+            connections.add_metric(["mysql", "max"], mysql["size"])
+            connections.add_metric(["mysql", "open"], mysql["open"])
+            connections.add_metric(["mysql", "in_use"], mysql["open"] - mysql["idle"])
+            yield CounterMetricFamily("mysql_pool_checkouts", "MySQL pool checkouts", value=mysql["checkouts"])
+            yield CounterMetricFamily("mysql_pool_timeouts", "MySQL pool checkout timeouts", value=mysql["timeouts"])
+        replicas = pools.get("mysql_replicas", {})
+        if replicas:
+            lag = GaugeMetricFamily("mysql_replica_lag_seconds", "Last measured replication lag", labels=["replica"])
+            for address, replica in replicas.items():
+                connections.add_metric(["mysql_replica:" + address, "open"], replica["open"])
+                connections.add_metric(["mysql_replica:" + address, "in_use"], replica["open"] - replica["idle"])
+                if replica["lag"] is not None:
+                    lag.add_metric([address], replica["lag"])
+            yield lag
+            routed = CounterMetricFamily("mysql_reads_routed", "Read-only checkouts by where they went",
+                                         labels=["target"])
+            for target, count in pools["mysql_routing"].items():
+                routed.add_metric([target.replace("_reads", "")], count)
+            yield routed
+        redis_pool = pools.get("redis")
+        if redis_pool:
+            connections.add_metric(["redis", "max"], redis_pool["max_connections"])
+            connections.add_metric(["redis", "open"], redis_pool["open"])
+        mongo = pools.get("mongodb")
+        if mongo:
+            connections.add_metric(["mongodb", "max"], mongo["max_pool_size"])
+        yield connections
+
+        hashing = self.password_hashing()
+        yield GaugeMetricFamily("password_hash_in_flight", "Password hash jobs admitted", value=hashing["in_flight"])
+        yield CounterMetricFamily("password_hash_rejected", "Password hash jobs rejected with 429",
+                                  value=hashing["rejected"])
+
+        try:
+            limiter = to_thread.current_default_thread_limiter()
+        except Exception:  # not scraped from the event loop
+            return
+        threads = GaugeMetricFamily("worker_threads", "Request threadpool for sync handlers", labels=["state"])
+        threads.add_metric(["max"], limiter.total_tokens)
+        threads.add_metric(["in_use"], limiter.borrowed_tokens)
+        yield threads
@@ -0,0 +1,97 @@
+"""One-time, idempotent MongoDB bootstrapping.
+
+Creates the analytics collections with their ``$jsonSchema`` validators and
+the indexes the API queries rely on. It runs once at startup (see
+``RUN_MIGRATIONS_ON_STARTUP``) or from the command line:
+
+    python -m app.core.migrations
+
+so request handlers never issue DDL.
+"""
+from pymongo import ASCENDING, DESCENDING
+from .config import settings
+from . import profiling, sharding
+from .database import get_mongo_client
+from ..services import performance_metrics
+from ..models.schemas import (
+    viewing_logs_schema,
+    user_behaviors_schema,
+    performance_metrics_schema,
+    error_logs_schema,
+)
+
+COLLECTIONS = {
+    "viewing_logs": viewing_logs_schema,
+    "user_behaviors": user_behaviors_schema,
+    "performance_metrics": performance_metrics_schema,
+    "error_logs": error_logs_schema,
+}
+
+INDEXES = {
+    "viewing_logs": [
+        [("user_id", ASCENDING), ("timestamp", DESCENDING)],
+        [("episode_id", ASCENDING), ("timestamp", DESCENDING)],
+    ],
+    "user_behaviors": [
+        [("user_id", ASCENDING), ("timestamp", DESCENDING)],
+        [("action_type", ASCENDING), ("timestamp", DESCENDING)],
+    ],
+    "performance_metrics": [
+        [("metric_type", ASCENDING), ("timestamp", DESCENDING)],
+    ],
+    "error_logs": [
+        [("timestamp", DESCENDING)],
+        [("severity", ASCENDING), ("timestamp", DESCENDING)],
+    ],
+    # Filtered keyset pagination on the catalog (see app/api/series.py)
+    "series": [
+        [("genre", ASCENDING), ("_id", ASCENDING)],
+        [("release_year", ASCENDING), ("_id", ASCENDING)],
+    ],
+}
+
+
+# What a viewing shard's Mongo holds (see app/core/sharding.py)
+SHARDED_COLLECTIONS = ["viewing_logs"]
+
+
+def _ensure_collections(db, names):
+    existing = set(db.list_collection_names())
+    for name in names:
+        validator = {"$jsonSchema": COLLECTIONS[name]}
+        if name in existing:
+            db.command("collMod", name, validator=validator)
+        else:
+            db.create_collection(name, validator=validator)
+
+
+def _ensure_indexes(db, names):
+    for name in names:
+        for keys in INDEXES[name]:
+            db[name].create_index(keys)
+
+
+def migrate_mongo(db=None):
+    """Create missing collections, refresh validators and ensure indexes."""
+    if db is None:
+        db = get_mongo_client()[settings.MONGO_DATABASE]
+
+    _ensure_collections(db, COLLECTIONS)
+    _ensure_indexes(db, INDEXES)
+
+    performance_metrics.ensure_collections(db)
+    profiling.ensure_collection(db)
+
+
+def migrate_viewing_shards():
+    """The sharded collections and their indexes on every non-main viewing shard."""
+    for shard in sharding.shard_names()[1:]:
+        db = sharding.mongo_db(shard)
+        _ensure_collections(db, SHARDED_COLLECTIONS)
+        _ensure_indexes(db, SHARDED_COLLECTIONS)
+
+
+if __name__ == "__main__":
+    migrate_mongo()
+    migrate_viewing_shards()
+    print("MongoDB collections and indexes are up to date")
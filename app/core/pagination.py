@@ -0,0 +1,45 @@
+"""Opaque keyset-pagination cursors.
+
+A cursor is the url-safe base64 of a small JSON object holding the sort key
+of the last item on the previous page (e.g. ``{"id": 42}``). Listings seek
+past it (``WHERE id > 42 ORDER BY id``) instead of using OFFSET/skip, so deep
+pages cost the same as the first one and rows inserted concurrently never
+shift or repeat items between pages.
+"""
+import base64
+import binascii
+import json
+from fastapi import HTTPException
+
+
+def encode_cursor(position: dict) -> str:
+    raw = json.dumps(position, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, fields: dict = None) -> dict:
+    """Decode ``cursor``; with ``fields`` ({name: type}), each must be present with that type.
+
+    A cursor comes from the client, so anything malformed is a 400.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        position = json.loads(raw)
+    except (binascii.Error, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(position, dict):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    for name, kind in (fields or {}).items():
+        value = position.get(name)
+        # bool is an int subclass, but never a valid key
+        if not isinstance(value, kind) or isinstance(value, bool):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    return position
+
+
+def page(items: list, limit: int, key):
+    """Trim a ``limit + 1`` fetch to one page and build the next cursor."""
+    if len(items) > limit:
+        items = items[:limit]
+        return {"items": items, "next_cursor": encode_cursor(key(items[-1]))}
+    return {"items": items, "next_cursor": None}
@@ -0,0 +1,310 @@
+"""Opt-in per-request profiling of MySQL, Redis and Mongo calls.
+
+With ``PROFILING_ENABLED`` set, ``ProfilingMiddleware`` gives every request a
+``Profile`` through a context variable. The cursor, Redis and Mongo wrappers
+in ``database.py`` append each call to it: the backend, the operation, the
+raw statement (or command), its start offset and duration. Context variables
+follow the request into the threadpool that runs sync handlers and
+dependencies, so this covers everything a handler does. When profiling is
+disabled the middleware is not installed and each wrapper pays one
+``ContextVar.get``.
+
+When the request finishes, the profile is reported if
+
+* the request took longer than ``PROFILING_SLOW_REQUEST_MS``,
+* one of its MySQL statements took longer than ``PROFILING_SLOW_QUERY_MS``, or
+* it was sampled (``PROFILING_SAMPLE_RATE``).
+
+Everything else is dropped without further work. Reports go to a bounded
+queue, and a background thread turns them into a breakdown: per-backend
+call counts and time, statement fingerprints (literals and ``IN``/``VALUES``
+lists collapsed) and fingerprints repeated within the request, which
+usually mean an N+1 loop. That thread logs slow requests and statements,
+runs ``EXPLAIN`` for slow ``SELECT`` statements when ``PROFILING_EXPLAIN``
+is set (each fingerprint at most once an hour), and writes the reports to
+the ``PROFILING_COLLECTION`` Mongo collection with one ``insert_many`` per
+batch. If the queue is full, reports are dropped and counted rather than
+slowing requests down.
+"""
+import json
+import logging
+import queue
+import random
+import re
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime
+from pymongo import ASCENDING, DESCENDING, monitoring
+from . import database, metrics
+from .cache import LRUCache
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+active = ContextVar("request_profile", default=None)
+
+EXPLAINABLE = {"SELECT", "WITH"}
+
+_SQL_LITERALS = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"|%\(\w+\)s|%s|\b\d+(?:\.\d+)?\b")
+_SQL_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SQL_ROWS = re.compile(r"\(\?\+\)(?:\s*,\s*\(\?\+\))+")
+_SPACES = re.compile(r"\s+")
+_DIGITS = re.compile(r"\d+")
+
+_reports = queue.Queue(maxsize=settings.PROFILING_QUEUE_SIZE)
+_explained = LRUCache(maxsize=1000, ttl=3600)
+_thread = None
+_stop = threading.Event()
+_dropped_reports = 0
+
+
+class Profile:
+    """The backend calls made while serving one request."""
+
+    __slots__ = ("started", "calls", "dropped", "mongo_collections")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.calls = []
+        self.dropped = 0
+        self.mongo_collections = {}
+
+    def add(self, backend, operation, statement, started, seconds, params=None):
+        if len(self.calls) >= settings.PROFILING_MAX_CALLS:
+            self.dropped += 1
+            return
+        self.calls.append((backend, operation, statement, started - self.started, seconds, params))
+
+
+def fingerprint_sql(statement):
+    """``statement`` with literals and placeholders replaced by ``?``."""
+    text = _SPACES.sub(" ", _SQL_LITERALS.sub("?", statement)).strip()
+    return _SQL_ROWS.sub("(?+), ...", _SQL_LISTS.sub("(?+)", text))
+
+
+def fingerprint(backend, statement):
+    if backend == "mysql":
+        return fingerprint_sql(statement)
+    if backend == "redis" and isinstance(statement, tuple):
+        # (command, first key): ids in the key collapse to ?
+        return " ".join(_DIGITS.sub("?", str(part)) for part in statement)
+    return str(statement)
+
+
+class MongoCommandProfiler(monitoring.CommandListener):
+    """Adds Mongo commands to the active profile; events fire in the calling thread."""
+
+    def started(self, event):
+        profile = active.get()
+        if profile is not None:
+            collection = event.command.get(event.command_name)
+            profile.mongo_collections[event.request_id] = collection if isinstance(collection, str) else ""
+
+    def _finished(self, event):
+        profile = active.get()
+        if profile is not None:
+            seconds = event.duration_micros / 1e6
+            collection = profile.mongo_collections.pop(event.request_id, "")
+            statement = f"{event.command_name} {collection}".strip()
+            profile.add("mongodb", event.command_name, statement, time.perf_counter() - seconds, seconds)
+
+    succeeded = _finished
+    failed = _finished
+
+
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        profile = Profile()
+        token = active.set(profile)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            active.reset(token)
+            _finish(profile, scope, status, time.perf_counter() - profile.started)
+
+
+def _finish(profile, scope, status, seconds):
+    slow = seconds * 1000 >= settings.PROFILING_SLOW_REQUEST_MS
+    slow_query = settings.PROFILING_SLOW_QUERY_MS / 1000
+    slow_statements = any(call[0] == "mysql" and call[4] >= slow_query for call in profile.calls)
+    sampled = random.random() < settings.PROFILING_SAMPLE_RATE
+    if not (slow or slow_statements or sampled):
+        return
+    request = {
+        "method": scope["method"],
+        "route": metrics.route_path(scope),
+        "path": scope["path"],
+        "status": status,
+        "duration_ms": round(seconds * 1000, 3),
+        "slow": slow,
+        "sampled": sampled,
+    }
+    global _dropped_reports
+    try:
+        _reports.put_nowait((request, profile))
+    except queue.Full:
+        _dropped_reports += 1
+
+
+def _explain(statement, params):
+    conn = database.get_mysql_connection()
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("EXPLAIN " + statement, params)
+        plan = cursor.fetchall()
+        cursor.close()
+    finally:
+        conn.close()
+    return plan
+
+
+def build_report(request, profile):
+    """The stored/logged form of a profile: totals, repeats and each call."""
+    slow_query = settings.PROFILING_SLOW_QUERY_MS / 1000
+    backends = {}
+    repeats = Counter()
+    calls = []
+    explains = []
+    for backend, operation, statement, offset, seconds, params in profile.calls:
+        shape = fingerprint(backend, statement)
+        totals = backends.setdefault(backend, {"calls": 0, "ms": 0.0})
+        totals["calls"] += 1
+        totals["ms"] += seconds * 1000
+        repeats[(backend, shape)] += 1
+        call = {
+            "backend": backend,
+            "operation": operation,
+            "fingerprint": shape,
+            "offset_ms": round(offset * 1000, 3),
+            "ms": round(seconds * 1000, 3),
+        }
+        if backend == "mysql" and seconds >= slow_query:
+            call["slow"] = True
+            if settings.PROFILING_EXPLAIN and operation in EXPLAINABLE:
+                explains.append((shape, statement, params))
+        calls.append(call)
+    for totals in backends.values():
+        totals["ms"] = round(totals["ms"], 3)
+
+    report = dict(request)
+    report.update({
+        "timestamp": datetime.utcnow(),
+        "backends": backends,
+        "repeated": [
+            {"backend": backend, "fingerprint": shape, "count": count}
+            for (backend, shape), count in repeats.most_common() if count > 1
+        ],
+        "calls": calls,
+        "dropped_calls": profile.dropped,
+    })
+    if explains:
+        report["explain"] = []
+        for shape, statement, params in explains:
+            plan = _explained.get(shape)
+            if plan is None:
+                try:
+                    plan = _explain(statement, params)
+                except Exception:
+                    logger.warning("EXPLAIN failed for %s", shape, exc_info=True)
+                    continue
+                _explained.set(shape, plan)
+            report["explain"].append({"fingerprint": shape, "plan": plan})
+    return report
+
+
+def _log(report):
+    for call in report["calls"]:
+        if call.get("slow"):
+            logger.warning("Slow MySQL statement on %s %s (%.1f ms): %s",
+                           report["method"], report["route"], call["ms"], call["fingerprint"])
+    if report["slow"]:
+        breakdown = {key: report[key] for key in ("backends", "repeated", "calls", "explain") if key in report}
+        logger.warning("Slow request %s %s: %.1f ms, status %s\n%s", report["method"], report["route"],
+                       report["duration_ms"], report["status"], json.dumps(breakdown, indent=1, default=str))
+
+
+def _write(reports):
+    db = database.get_mongo_client()[settings.MONGO_DATABASE]
+    db[settings.PROFILING_COLLECTION].insert_many(reports, ordered=False)
+
+
+def _drain(block):
+    batch = []
+    try:
+        batch.append(_reports.get(timeout=1) if block else _reports.get_nowait())
+        while len(batch) < 100:
+            batch.append(_reports.get_nowait())
+    except queue.Empty:
+        pass
+    reports = []
+    for request, profile in batch:
+        try:
+            report = build_report(request, profile)
+            _log(report)
+            reports.append(report)
+        except Exception:
+            logger.exception("Could not build a request profile")
+    if reports:
+        try:
+            _write(reports)
+        except Exception:
+            logger.warning("Could not store %d request profiles", len(reports), exc_info=True)
+    return len(batch)
+
+
+def _run():
+    while not _stop.is_set():
+        _drain(block=True)
+
+
+def start_writer():
+    global _thread
+    if _thread is not None:
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_run, name="request-profiler", daemon=True)
+    _thread.start()
+
+
+def stop_writer():
+    """Stop the background thread and write out the queued reports."""
+    global _thread
+    if _thread is None:
+        return
+    _stop.set()
+    _thread.join()
+    _thread = None
+    while _drain(block=False):
+        pass
+
+
+def ensure_collection(db):
+    """Indexes for the profile collection, expiring after PROFILING_RETENTION_DAYS."""
+    collection = db[settings.PROFILING_COLLECTION]
+    collection.create_index("timestamp", expireAfterSeconds=settings.PROFILING_RETENTION_DAYS * 86400)
+    collection.create_index([("route", ASCENDING), ("duration_ms", DESCENDING)])
+
+
+def profiling_stats():
+    return {
+        "enabled": settings.PROFILING_ENABLED,
+        "queued": _reports.qsize(),
+        "dropped_reports": _dropped_reports,
+        "explained_statements": len(_explained),
+    }
@@ -1,20 +1,93 @@
+import asyncio
+import functools
+import json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
+import redis
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import HTTPException, Depends
 from fastapi.security import OAuth2PasswordBearer
+from .cache import LRUCache
 from .config import settings
-from .database import get_mysql_connection
+from .database import get_mysql_connection, get_redis
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hashes with any other bcrypt cost verify as usual and are flagged for rehash,
+# so changing PASSWORD_BCRYPT_ROUNDS migrates users as they log in.
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=settings.PASSWORD_BCRYPT_ROUNDS,
+    bcrypt__min_rounds=settings.PASSWORD_BCRYPT_ROUNDS,
+    bcrypt__max_rounds=settings.PASSWORD_BCRYPT_ROUNDS,
+)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+# Authenticated-user cache: per-process LRU in front of Redis in front of MySQL.
+# The local tier has a short TTL because invalidations only reach this process
+# and Redis; other workers pick up a changed row once their entry expires.
+USER_CACHE_KEY = "user:{}"
+_user_cache = LRUCache(maxsize=settings.USER_CACHE_SIZE, ttl=settings.USER_CACHE_TTL)
+_user_cache_counters = {"redis_hits": 0, "mysql_loads": 0, "token_claims": 0}
 
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+# bcrypt runs on its own pool (it releases the GIL, so threads use every core).
+# The helpers below are coroutines: the handlers that call them are async and
+# await the hash on the event loop, so a login burst holds no request threads
+# and cannot starve other endpoints. At most PASSWORD_HASH_WORKERS +
+# PASSWORD_HASH_QUEUE jobs are admitted; beyond that callers get 429 instead
+# of queueing.
+_hash_pool = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_hash_slots = None  # asyncio.Semaphore, created on the running loop
+_hash_counters = {"in_flight": 0, "completed": 0, "rejected": 0}
+
+async def _acquire_slot():
+    global _hash_slots
+    if _hash_slots is None:
+        _hash_slots = asyncio.Semaphore(settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_QUEUE)
+    if not _hash_slots.locked():
+        await _hash_slots.acquire()
+        return True
+    if settings.PASSWORD_HASH_WAIT <= 0:
+        return False
+    try:
+        await asyncio.wait_for(_hash_slots.acquire(), settings.PASSWORD_HASH_WAIT)
+    except asyncio.TimeoutError:
+        return False
+    return True
+
+async def _hash_job(fn, *args):
+    if not await _acquire_slot():
+        _hash_counters["rejected"] += 1
+        raise HTTPException(
+            status_code=429,
+            detail="Too many password checks in progress",
+            headers={"Retry-After": "1"},
+        )
+    _hash_counters["in_flight"] += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_pool, functools.partial(fn, *args))
+    finally:
+        _hash_slots.release()
+        _hash_counters["in_flight"] -= 1
+        _hash_counters["completed"] += 1
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await _hash_job(pwd_context.verify, plain_password, hashed_password)
+
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verify; on success also return a new hash if the stored one uses another cost."""
+    return await _hash_job(pwd_context.verify_and_update, plain_password, hashed_password)
+
+async def get_password_hash(password: str) -> str:
+    return await _hash_job(pwd_context.hash, password)
+
+def password_hash_stats() -> dict:
+    return {
+        "workers": settings.PASSWORD_HASH_WORKERS,
+        "queue": settings.PASSWORD_HASH_QUEUE,
+        **_hash_counters,
+    }
 
 def create_access_token(data: dict) -> str:
     to_encode = data.copy()
@@ -22,7 +95,66 @@ def create_access_token(data: dict) -> str:
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
 
-async def get_current_user(token: str = Depends(oauth2_scheme)) -> dict:
+def create_user_token(user: dict, plan_type: Optional[str] = None) -> str:
+    """Issue a token for a users row, embedding id/plan claims when enabled."""
+    data = {"sub": user["username"]}
+    if settings.TOKEN_EMBED_CLAIMS:
+        data.update({"uid": user["id"], "plan": plan_type})
+    return create_access_token(data)
+
+def _cacheable_user(row: dict) -> dict:
+    # password_hash never leaves the auth queries
+    return {
+        key: value.isoformat() if isinstance(value, datetime) else value
+        for key, value in row.items()
+        if key != "password_hash"
+    }
+
+def get_user_by_username(username: str) -> Optional[dict]:
+    user = _user_cache.get(username)
+    if user is not None:
+        return dict(user)
+
+    r = get_redis()
+    try:
+        cached = r.get(USER_CACHE_KEY.format(username))
+    except redis.RedisError:
+        cached = None
+    if cached is not None:
+        _user_cache_counters["redis_hits"] += 1
+        user = json.loads(cached)
+        _user_cache.set(username, user)
+        return dict(user)
+
+    _user_cache_counters["mysql_loads"] += 1
+    with get_mysql_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT * FROM users WHERE username = %s", (username,))
+        row = cursor.fetchone()
+        cursor.close()
+    if row is None:
+        return None
+
+    user = _cacheable_user(row)
+    try:
+        r.setex(USER_CACHE_KEY.format(username), settings.USER_CACHE_REDIS_TTL, json.dumps(user))
+    except redis.RedisError:
+        pass
+    _user_cache.set(username, user)
+    return dict(user)
+
+def invalidate_user(username: str) -> None:
+    """Drop a user from both cache tiers; call after any write to their users row."""
+    _user_cache.delete(username)
+    try:
+        get_redis().delete(USER_CACHE_KEY.format(username))
+    except redis.RedisError:
+        pass
+
+def user_cache_stats() -> dict:
+    return {"local": _user_cache.stats(), **_user_cache_counters}
+
+def get_current_user(token: str = Depends(oauth2_scheme)) -> dict:
     credentials_exception = HTTPException(
         status_code=401,
         detail="Could not validate credentials",
@@ -36,13 +168,11 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> dict:
     except JWTError:
         raise credentials_exception
 
-    conn = get_mysql_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM users WHERE username = %s", (username,))
-    user = cursor.fetchone()
-    cursor.close()
-    conn.close()
+    if settings.TOKEN_EMBED_CLAIMS and "uid" in payload:
+        _user_cache_counters["token_claims"] += 1
+        return {"id": payload["uid"], "username": username, "plan_type": payload.get("plan")}
 
+    user = get_user_by_username(username)
     if user is None:
         raise credentials_exception
     return user
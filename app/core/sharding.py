@@ -0,0 +1,538 @@
+"""Application-level sharding of per-user viewing data by ``user_id``.
+
+Sharded data: MySQL ``viewing_progress`` and the Mongo ``viewing_logs`` and
+``viewing_progress`` collections. Everything else, including the catalog,
+users and the analytics rollups, stays on the primary MySQL and Mongo. The
+primary is also a shard itself, named ``main``. The other shards are listed
+in ``VIEWING_SHARDS``, each with its own MySQL (schema
+``db/mysql/shard_schema.sql``) and Mongo. With no shards configured,
+everything goes to ``main`` without touching Redis.
+
+A user's shard comes from a ``ShardMap``:
+
+* a consistent-hash ring: every shard in ``ring`` gets
+  ``VIEWING_SHARD_VNODES`` points, placed by the MD5 of ``"{shard}#{n}"``,
+  and a user belongs to the first point at or after the MD5 of their id.
+  Adding a shard to the ring only takes users from the points next to its
+  own.
+* explicit ``moved`` ranges ``(first, last, shard)``. They override the ring,
+  and the newest range wins. This is what ``move`` below writes.
+
+The map lives in Redis (``viewing_shards:map``) and workers reload it at
+most every ``VIEWING_SHARD_MAP_POLL`` seconds. If the key is missing, the
+ring is ``VIEWING_SHARD_RING``. A worker that can't reach Redis keeps its
+last map.
+
+Online resharding (``python -m app.core.sharding move FIRST LAST SHARD`` or
+``ring SHARD...``) runs in three phases. The tool waits after each one until
+every worker has reloaded the map:
+
+1. copying: the new map is published as ``pending``. Reads still use the
+   current map, but writes go to both owners (``write_shards``). The tool
+   copies the affected users' rows from their old shard to the new one.
+   Copies never overwrite newer data: MySQL upserts only move
+   ``last_watched`` forward, log documents keep their ``_id`` (duplicates are
+   skipped), and Mongo progress is only inserted where it is missing.
+2. cutover: the new map becomes current and the old one becomes pending.
+   Reads switch over, and writes still reach the old shard for workers
+   that haven't reloaded yet.
+3. cleanup: ``pending`` is cleared and the copied rows are deleted from
+   their old shards.
+
+One run holds a Redis lock at a time. If a run is interrupted,
+``resume`` continues from the phase saved with the map. Scatter-gather
+readers (``shard_names`` + ``owned_rows``) skip rows on a shard that does
+not own the user, so rows left behind by a move are never counted twice.
+"""
+import bisect
+import hashlib
+import json
+import logging
+import sys
+import threading
+import time
+import uuid
+from operator import itemgetter
+import redis
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from . import database
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+MAIN = "main"
+MAP_KEY = "viewing_shards:map"
+LOCK_KEY = "viewing_shards:lock"
+LOCK_TTL = 300
+
+UPSERT_PROGRESS = """
+    INSERT INTO viewing_progress (user_id, episode_id, progress, completed, last_watched, created_at, updated_at)
+    VALUES {rows}
+    ON DUPLICATE KEY UPDATE
+        progress = IF(VALUES(last_watched) > last_watched, VALUES(progress), progress),
+        completed = IF(VALUES(last_watched) > last_watched, VALUES(completed), completed),
+        last_watched = GREATEST(last_watched, VALUES(last_watched))
+"""
+SCAN_PROGRESS = """
+    SELECT user_id, episode_id, progress, completed, last_watched, created_at, updated_at
+    FROM viewing_progress
+    WHERE (user_id, episode_id) > (%s, %s) AND user_id <= %s
+    ORDER BY user_id, episode_id
+    LIMIT %s
+"""
+
+_state = {"version": None, "current": None, "pending": None, "fetched_at": 0.0}
+_state_lock = threading.Lock()
+_mysql_pools = {}
+_mongo_clients = {}
+_pool_lock = threading.Lock()
+
+
+def _token(key):
+    return int(hashlib.md5(key.encode()).hexdigest()[:16], 16)
+
+
+class ShardMap:
+    """Which shard owns a user: explicit ``moved`` ranges, then the hash ring."""
+
+    def __init__(self, ring, moved=(), vnodes=None):
+        self.ring = list(ring)
+        self.moved = [tuple(entry) for entry in moved]
+        vnodes = vnodes or settings.VIEWING_SHARD_VNODES
+        points = sorted((_token(f"{shard}#{n}"), shard) for shard in self.ring for n in range(vnodes))
+        self._tokens = [token for token, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def owner(self, user_id):
+        for first, last, shard in self.moved:
+            if first <= user_id <= last:
+                return shard
+        index = bisect.bisect_left(self._tokens, _token(str(user_id)))
+        return self._shards[index % len(self._shards)]
+
+    def shards(self):
+        return set(self.ring) | {shard for _, _, shard in self.moved}
+
+    def to_dict(self):
+        return {"ring": self.ring, "moved": [list(entry) for entry in self.moved]}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["ring"], data.get("moved", ()))
+
+
+def _default_state():
+    return {
+        "version": 0,
+        "current": {"ring": settings.VIEWING_SHARD_RING, "moved": []},
+        "pending": None,
+        "phase": None,
+    }
+
+
+def load_state(r=None):
+    """The shard map document stored in Redis, or the default one."""
+    raw = (r or database.get_redis()).get(MAP_KEY)
+    return json.loads(raw) if raw is not None else _default_state()
+
+
+def _maps():
+    """``(current, pending)`` ShardMaps, reloaded at most every VIEWING_SHARD_MAP_POLL seconds."""
+    now = time.monotonic()
+    if _state["current"] is not None and now - _state["fetched_at"] < settings.VIEWING_SHARD_MAP_POLL:
+        return _state["current"], _state["pending"]
+    with _state_lock:
+        if _state["current"] is None or now - _state["fetched_at"] >= settings.VIEWING_SHARD_MAP_POLL:
+            try:
+                state = load_state()
+            except redis.RedisError:
+                # Keep routing with the last known map rather than failing requests
+                state = None if _state["current"] is not None else _default_state()
+            if state is not None and (state["version"] != _state["version"] or _state["current"] is None):
+                _state.update(
+                    version=state["version"],
+                    current=ShardMap.from_dict(state["current"]),
+                    pending=ShardMap.from_dict(state["pending"]) if state["pending"] else None,
+                )
+            _state["fetched_at"] = now
+    return _state["current"], _state["pending"]
+
+
+def owner(user_id):
+    """The shard that serves ``user_id``'s viewing data."""
+    if not settings.VIEWING_SHARDS:
+        return MAIN
+    return _maps()[0].owner(user_id)
+
+
+def write_shards(user_id):
+    """Shards a write for ``user_id`` goes to: the owner, plus the next owner during a move."""
+    if not settings.VIEWING_SHARDS:
+        return [MAIN]
+    current, pending = _maps()
+    shards = [current.owner(user_id)]
+    if pending is not None and pending.owner(user_id) != shards[0]:
+        shards.append(pending.owner(user_id))
+    return shards
+
+
+def group_for_write(items, user_id_of):
+    """``{shard: [item, ...]}`` with each item under every shard it must be written to."""
+    if not settings.VIEWING_SHARDS:
+        return {MAIN: list(items)}
+    groups = {}
+    for item in items:
+        for shard in write_shards(user_id_of(item)):
+            groups.setdefault(shard, []).append(item)
+    return groups
+
+
+def shard_names():
+    """Every shard that may hold viewing data, ``main`` first."""
+    return [MAIN] + [shard for shard in settings.VIEWING_SHARDS if shard != MAIN]
+
+
+def owned_rows(shard, rows, user_id_of=itemgetter(0)):
+    """The ``rows`` read from ``shard`` whose user it currently owns."""
+    if not settings.VIEWING_SHARDS:
+        return rows
+    current = _maps()[0]
+    owners = {}
+    kept = []
+    for row in rows:
+        user_id = user_id_of(row)
+        shard_of_user = owners.get(user_id)
+        if shard_of_user is None:
+            shard_of_user = owners[user_id] = current.owner(user_id)
+        if shard_of_user == shard:
+            kept.append(row)
+    return kept
+
+
+def _check_shard(shard):
+    if shard != MAIN and shard not in settings.VIEWING_SHARDS:
+        raise ValueError(f"unknown viewing shard {shard!r}; configure it in VIEWING_SHARDS")
+
+
+def mysql_connection(shard):
+    """A pooled MySQL connection to ``shard``; close() returns it."""
+    if shard == MAIN:
+        return database.get_mysql_connection()
+    pool = _mysql_pools.get(shard)
+    if pool is None:
+        _check_shard(shard)
+        with _pool_lock:
+            pool = _mysql_pools.get(shard)
+            if pool is None:
+                host, _, port = settings.VIEWING_SHARDS[shard]["mysql"].partition(":")
+                pool = _mysql_pools[shard] = database.create_mysql_pool(
+                    host, int(port or settings.MYSQL_PORT), settings.VIEWING_SHARD_POOL_SIZE
+                )
+    return pool.acquire()
+
+
+def mongo_db(shard):
+    """The analytics database on ``shard``."""
+    if shard == MAIN:
+        return database.get_mongo_client()[settings.MONGO_DATABASE]
+    client = _mongo_clients.get(shard)
+    if client is None:
+        _check_shard(shard)
+        with _pool_lock:
+            client = _mongo_clients.get(shard)
+            if client is None:
+                client = _mongo_clients[shard] = database.create_mongo_client(settings.VIEWING_SHARDS[shard]["mongo"])
+    return client[settings.MONGO_DATABASE]
+
+
+def close_pools():
+    with _pool_lock:
+        for pool in _mysql_pools.values():
+            pool.close()
+        _mysql_pools.clear()
+        for client in _mongo_clients.values():
+            client.close()
+        _mongo_clients.clear()
+
+
+def check_health():
+    """Ping every non-main shard; returns {"mysql_shard:s1": True, ...}."""
+    health = {}
+    for shard in shard_names()[1:]:
+        try:
+            conn = mysql_connection(shard)
+            try:
+                conn.ping(reconnect=False)
+            finally:
+                conn.close()
+            health[f"mysql_shard:{shard}"] = True
+        except Exception:
+            health[f"mysql_shard:{shard}"] = False
+        try:
+            mongo_db(shard).client.admin.command("ping")
+            health[f"mongodb_shard:{shard}"] = True
+        except Exception:
+            health[f"mongodb_shard:{shard}"] = False
+    return health
+
+
+def shard_stats():
+    if not settings.VIEWING_SHARDS:
+        return {"enabled": False}
+    current, pending = _maps()
+    return {
+        "enabled": True,
+        "map_version": _state["version"],
+        "ring": current.ring,
+        "moved_ranges": len(current.moved),
+        "migrating": pending is not None,
+        "mysql_pools": {shard: pool.stats() for shard, pool in _mysql_pools.items()},
+    }
+
+
+# Online resharding
+
+def _save_state(r, state, **changes):
+    state = dict(state, version=state["version"] + 1, **changes)
+    r.set(MAP_KEY, json.dumps(state))
+    return state
+
+
+def _wait_for_workers():
+    """Until every worker has reloaded the map (and finished requests routed with the old one)."""
+    time.sleep(2 * settings.VIEWING_SHARD_MAP_POLL + 1)
+
+
+def _scan_mysql(shard, user_range):
+    first, last = user_range or (0, 2 ** 31 - 1)
+    position = (first, -1)
+    while True:
+        conn = mysql_connection(shard)
+        cursor = conn.cursor()
+        try:
+            cursor.execute(SCAN_PROGRESS, (position[0], position[1], last, settings.VIEWING_SHARD_COPY_BATCH))
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+            conn.close()
+        if not rows:
+            return
+        yield rows
+        position = rows[-1][:2]
+
+
+def _scan_mongo(shard, collection, user_range):
+    query = {"user_id": {"$gte": user_range[0], "$lte": user_range[1]}} if user_range else {}
+    batch = []
+    for document in mongo_db(shard)[collection].find(query).batch_size(settings.VIEWING_SHARD_COPY_BATCH):
+        batch.append(document)
+        if len(batch) >= settings.VIEWING_SHARD_COPY_BATCH:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _copy_progress_rows(target, rows):
+    conn = mysql_connection(target)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            UPSERT_PROGRESS.format(rows=", ".join(["(%s, %s, %s, %s, %s, %s, %s)"] * len(rows))),
+            [value for row in rows for value in row]
+        )
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def _copy_viewing_logs(target, documents):
+    try:
+        mongo_db(target).viewing_logs.insert_many(documents, ordered=False, bypass_document_validation=True)
+    except BulkWriteError as exc:
+        # Documents dual-written since the move started are already there, with the same _id
+        if exc.details["writeConcernErrors"] or any(e["code"] != 11000 for e in exc.details["writeErrors"]):
+            raise
+
+
+def _copy_mongo_progress(target, documents):
+    mongo_db(target).viewing_progress.bulk_write([
+        UpdateOne(
+            {key: document[key] for key in ("user_id", "series_id", "episode_id")},
+            {"$setOnInsert": {key: value for key, value in document.items() if key != "_id"}},
+            upsert=True
+        )
+        for document in documents
+    ], ordered=False)
+
+
+MONGO_COPIES = {"viewing_logs": _copy_viewing_logs, "viewing_progress": _copy_mongo_progress}
+
+
+def _leaving(shard, rows, old, new, user_id_of):
+    """``{target: rows}`` for the ``rows`` on ``shard`` whose user moves from it to another shard."""
+    moving = {}
+    for row in rows:
+        user_id = user_id_of(row)
+        if old.owner(user_id) == shard:
+            target = new.owner(user_id)
+            if target != shard:
+                moving.setdefault(target, []).append(row)
+    return moving
+
+
+def _lock_held(r, token):
+    if r.get(LOCK_KEY) != token:
+        raise RuntimeError("lost the resharding lock")
+    r.expire(LOCK_KEY, LOCK_TTL)
+
+
+def copy_moving(r, token, old, new, user_range):
+    """Copy the users whose owner changes from ``old`` to ``new`` to their new shard."""
+    copied = {"mysql": 0, "viewing_logs": 0, "viewing_progress": 0}
+    for shard in sorted(old.shards()):
+        for rows in _scan_mysql(shard, user_range):
+            _lock_held(r, token)
+            for target, moving in _leaving(shard, rows, old, new, itemgetter(0)).items():
+                _copy_progress_rows(target, moving)
+                copied["mysql"] += len(moving)
+        for collection, copy in MONGO_COPIES.items():
+            for documents in _scan_mongo(shard, collection, user_range):
+                _lock_held(r, token)
+                for target, moving in _leaving(shard, documents, old, new, itemgetter("user_id")).items():
+                    copy(target, moving)
+                    copied[collection] += len(moving)
+        logger.info("Copied from %s: %s", shard, copied)
+    return copied
+
+
+def delete_moved(r, token, old, new, user_range):
+    """Delete the rows copied by ``copy_moving`` from the shards that no longer own them."""
+    deleted = {"mysql": 0, "viewing_logs": 0, "viewing_progress": 0}
+    for shard in sorted(old.shards()):
+        for rows in _scan_mysql(shard, user_range):
+            _lock_held(r, token)
+            moved = [row[:2] for moving in _leaving(shard, rows, old, new, itemgetter(0)).values() for row in moving]
+            if not moved:
+                continue
+            conn = mysql_connection(shard)
+            cursor = conn.cursor()
+            try:
+                cursor.execute(
+                    "DELETE FROM viewing_progress WHERE (user_id, episode_id) IN (%s)"
+                    % ", ".join(["(%s, %s)"] * len(moved)),
+                    [value for key in moved for value in key]
+                )
+                conn.commit()
+            finally:
+                cursor.close()
+                conn.close()
+            deleted["mysql"] += len(moved)
+        for collection in MONGO_COPIES:
+            for documents in _scan_mongo(shard, collection, user_range):
+                _lock_held(r, token)
+                ids = [d["_id"] for moving in _leaving(shard, documents, old, new, itemgetter("user_id")).values()
+                       for d in moving]
+                if ids:
+                    deleted[collection] += mongo_db(shard)[collection].delete_many({"_id": {"$in": ids}}).deleted_count
+        logger.info("Deleted from %s: %s", shard, deleted)
+    return deleted
+
+
+def _advance(r, token, state):
+    """Drive the migration in ``state`` to the end, starting at its saved phase."""
+    report = {}
+    user_range = state.get("range")
+    if state["phase"] == "copying":
+        _wait_for_workers()
+        old, new = ShardMap.from_dict(state["current"]), ShardMap.from_dict(state["pending"])
+        report["copied"] = copy_moving(r, token, old, new, user_range)
+        _lock_held(r, token)
+        state = _save_state(r, state, current=state["pending"], pending=state["current"], phase="cutover")
+        logger.info("Cut over to map version %s", state["version"])
+    if state["phase"] == "cutover":
+        _wait_for_workers()
+        _lock_held(r, token)
+        state = _save_state(r, state, pending=None, previous=state["pending"], phase="cleanup")
+    if state["phase"] == "cleanup":
+        _wait_for_workers()
+        old, new = ShardMap.from_dict(state["previous"]), ShardMap.from_dict(state["current"])
+        report["deleted"] = delete_moved(r, token, old, new, user_range)
+        _lock_held(r, token)
+        state = _save_state(r, state, previous=None, range=None, phase=None)
+    report["version"] = state["version"]
+    return report
+
+
+def migrate(change=None, user_range=None):
+    """Move to the map ``change(current)`` online; with no change, finish an interrupted move.
+
+    ``user_range`` limits the scans to the users in ``(first, last)``; a ring
+    change scans every shard in full.
+    """
+    r = database.get_redis()
+    token = uuid.uuid4().hex
+    if not r.set(LOCK_KEY, token, nx=True, ex=LOCK_TTL):
+        raise RuntimeError("another resharding run holds the lock")
+    try:
+        state = load_state(r)
+        if change is not None:
+            if state["phase"] is not None:
+                raise RuntimeError(f"a move is still in its {state['phase']} phase; run resume first")
+            target = change(ShardMap.from_dict(state["current"]))
+            for shard in target.shards():
+                _check_shard(shard)
+            state = _save_state(r, state, pending=target.to_dict(), phase="copying", range=user_range)
+            logger.info("Dual writes to map version %s", state["version"])
+        elif state["phase"] is None:
+            return {"version": state["version"]}
+        return _advance(r, token, state)
+    finally:
+        if r.get(LOCK_KEY) == token:
+            r.delete(LOCK_KEY)
+
+
+def move(first, last, shard):
+    """Move users ``first``..``last`` to ``shard``."""
+    def change(current):
+        # Older ranges inside the new one can never match again
+        kept = [entry for entry in current.moved if not first <= entry[0] <= entry[1] <= last]
+        return ShardMap(current.ring, [(first, last, shard)] + kept)
+    return migrate(change, (first, last))
+
+
+def set_ring(shards):
+    """Replace the hash ring; users in moved ranges stay where they are."""
+    return migrate(lambda current: ShardMap(shards, current.moved))
+
+
+def status():
+    state = load_state()
+    current = ShardMap.from_dict(state["current"])
+    return {
+        "configured": shard_names(),
+        "version": state["version"],
+        "phase": state["phase"],
+        "ring": current.ring,
+        "moved": current.moved,
+        "pending": state["pending"],
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = sys.argv[1:]
+    if args == ["status"]:
+        print(json.dumps(status(), indent=2))
+    elif len(args) == 2 and args[0] == "owner":
+        print(ShardMap.from_dict(load_state()["current"]).owner(int(args[1])))
+    elif len(args) == 4 and args[0] == "move":
+        print(json.dumps(move(int(args[1]), int(args[2]), args[3]), indent=2))
+    elif len(args) >= 2 and args[0] == "ring":
+        print(json.dumps(set_ring(args[1:]), indent=2))
+    elif args == ["resume"]:
+        print(json.dumps(migrate(), indent=2))
+    else:
+        print("usage: python -m app.core.sharding status|owner USER_ID|move FIRST LAST SHARD|ring SHARD...|resume")
@@ -0,0 +1,333 @@
+"""Cache-aside across in-process LRU, Redis and the MySQL ``content_cache`` table.
+
+A ``TieredCache`` looks a key up in each tier in turn and loads it from the
+source only if all of them miss:
+
+    in-process LRU -> Redis ``cache:{namespace}:{key}`` -> MySQL ``content_cache`` -> loader
+
+What a miss finds is written back to the tiers above it, with whatever TTL
+the entry has left. Each key carries its own TTL, given to ``get``/``set`` or
+falling back to the cache's default. The in-process tier keeps an entry for
+at most ``local_ttl``, so other workers see an ``invalidate`` within that long.
+
+* Coalescing: concurrent misses for the same key in one process wait for a
+  single lookup of the lower tiers instead of each querying them.
+* Negative caching: a loader returning ``None`` is remembered for
+  ``negative_ttl`` in memory and Redis, so a missing key does not hit the
+  source on every request.
+* ``access_count``/``last_accessed`` in ``content_cache`` are counted in
+  memory and written in one batched ``UPDATE`` per maintenance cycle rather
+  than on every read.
+* The maintenance thread (``start_maintenance``) flushes those counts, then
+  deletes expired rows and, above ``CONTENT_CACHE_MAX_ROWS``, the least
+  recently accessed ones, a few thousand rows per statement.
+
+Values must be JSON-serializable. Redis and MySQL errors are treated as
+misses, so a cache outage degrades to loading from the source.
+"""
+import json
+import logging
+import threading
+from collections import Counter
+import mysql.connector
+import redis
+from .cache import LRUCache
+from .config import settings
+from .database import PoolTimeoutError, get_mysql_connection, get_redis
+
+logger = logging.getLogger(__name__)
+
+REDIS_KEY = "cache:{}"
+_MISSING = object()
+_NEGATIVE = {"__cache_negative__": True}
+_DB_ERRORS = (mysql.connector.Error, PoolTimeoutError)
+
+_caches = []
+_stop = threading.Event()
+_thread = None
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TieredCache:
+    def __init__(self, namespace, loader=None, ttl=None, local_ttl=None, local_size=None, negative_ttl=None):
+        self.namespace = namespace
+        self.loader = loader
+        self.ttl = settings.CONTENT_CACHE_TTL if ttl is None else ttl
+        self.local_ttl = settings.CONTENT_CACHE_LOCAL_TTL if local_ttl is None else local_ttl
+        self.negative_ttl = settings.CONTENT_CACHE_NEGATIVE_TTL if negative_ttl is None else negative_ttl
+        self._local = LRUCache(maxsize=local_size or settings.CONTENT_CACHE_LOCAL_SIZE, ttl=self.local_ttl)
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self._accesses = Counter()
+        self._accesses_lock = threading.Lock()
+        self._counters = Counter()
+        _caches.append(self)
+
+    def _key(self, key):
+        return f"{self.namespace}:{key}"
+
+    def get(self, key, loader=None, ttl=None):
+        """Return the cached value for ``key``, loading it on a full miss.
+
+        ``loader(key)`` (or the cache's default loader) returns the value, or
+        ``None`` if there is none; ``ttl`` overrides the default for this key.
+        """
+        value = self._local.get(key, _MISSING)
+        if value is _MISSING:
+            value = self._coalesced(key, loader or self.loader, self.ttl if ttl is None else ttl)
+        elif value is not _NEGATIVE:
+            self._count_access(key)
+        return None if value is _NEGATIVE else value
+
+    def set(self, key, value, ttl=None):
+        """Write ``value`` through every tier."""
+        ttl = self.ttl if ttl is None else ttl
+        payload = json.dumps(value, default=str)
+        self._write_mysql(key, payload, ttl)
+        self._write_redis(key, payload, ttl)
+        self._local.set(key, value, ttl=min(ttl, self.local_ttl))
+
+    def invalidate(self, key):
+        self._local.delete(key)
+        try:
+            get_redis().delete(REDIS_KEY.format(self._key(key)))
+        except redis.RedisError:
+            pass
+        try:
+            with get_mysql_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("DELETE FROM content_cache WHERE cache_key = %s", (self._key(key),))
+                conn.commit()
+                cursor.close()
+        except _DB_ERRORS:
+            logger.warning("Could not delete %s from content_cache", self._key(key), exc_info=True)
+
+    def _coalesced(self, key, loader, ttl):
+        with self._inflight_lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _Call()
+        if not leader:
+            self._counters["coalesced"] += 1
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+        try:
+            call.value = self._lookup(key, loader, ttl)
+            return call.value
+        except Exception as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+            call.done.set()
+
+    def _lookup(self, key, loader, ttl):
+        r = get_redis()
+        try:
+            payload = r.get(REDIS_KEY.format(self._key(key)))
+            remaining = r.ttl(REDIS_KEY.format(self._key(key))) if payload is not None else None
+        except redis.RedisError:
+            payload = None
+        if payload is not None:
+            self._counters["redis_hits"] += 1
+            value = json.loads(payload)
+            if value == _NEGATIVE:
+                value = _NEGATIVE
+            else:
+                self._count_access(key)
+            self._local.set(key, value, ttl=min(max(remaining, 1), self.local_ttl))
+            return value
+        self._counters["redis_misses"] += 1
+
+        row = self._read_mysql(key)
+        if row is not None:
+            self._counters["mysql_hits"] += 1
+            payload, remaining = row
+            self._count_access(key)
+            self._write_redis(key, payload, remaining)
+            value = json.loads(payload)
+            self._local.set(key, value, ttl=min(remaining, self.local_ttl))
+            return value
+        self._counters["mysql_misses"] += 1
+
+        self._counters["loads"] += 1
+        value = loader(key)
+        if value is None:
+            self._counters["negative_stores"] += 1
+            self._write_redis(key, json.dumps(_NEGATIVE), self.negative_ttl)
+            self._local.set(key, _NEGATIVE, ttl=min(self.negative_ttl, self.local_ttl))
+            return _NEGATIVE
+        self.set(key, value, ttl)
+        return value
+
+    def _read_mysql(self, key):
+        try:
+            with get_mysql_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT content_data, TIMESTAMPDIFF(SECOND, NOW(), expires_at)
+                    FROM content_cache WHERE cache_key = %s AND expires_at > NOW()
+                """, (self._key(key),))
+                row = cursor.fetchone()
+                cursor.close()
+        except _DB_ERRORS:
+            logger.warning("content_cache read failed for %s", self._key(key), exc_info=True)
+            return None
+        if row is None:
+            return None
+        return row[0], max(int(row[1]), 1)
+
+    def _write_mysql(self, key, payload, ttl):
+        try:
+            with get_mysql_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    INSERT INTO content_cache (cache_key, content_data, created_at, expires_at, last_accessed, access_count)
+                    VALUES (%s, %s, NOW(), NOW() + INTERVAL %s SECOND, NOW(), 0)
+                    ON DUPLICATE KEY UPDATE
+                        content_data = VALUES(content_data),
+                        created_at = NOW(),
+                        expires_at = VALUES(expires_at)
+                """, (self._key(key), payload, ttl))
+                conn.commit()
+                cursor.close()
+        except _DB_ERRORS:
+            logger.warning("content_cache write failed for %s", self._key(key), exc_info=True)
+
+    def _write_redis(self, key, payload, ttl):
+        try:
+            get_redis().setex(REDIS_KEY.format(self._key(key)), ttl, payload)
+        except redis.RedisError:
+            pass
+
+    def _count_access(self, key):
+        with self._accesses_lock:
+            self._accesses[self._key(key)] += 1
+
+    def flush_access_counts(self):
+        """Apply the buffered read counts to ``content_cache`` in one UPDATE per batch."""
+        with self._accesses_lock:
+            accesses, self._accesses = self._accesses, Counter()
+        items = list(accesses.items())
+        if not items:
+            return 0
+        conn = get_mysql_connection()
+        cursor = conn.cursor()
+        try:
+            batch_size = settings.CONTENT_CACHE_SWEEP_BATCH
+            for start in range(0, len(items), batch_size):
+                chunk = items[start:start + batch_size]
+                cursor.execute(
+                    "UPDATE content_cache SET access_count = access_count + CASE cache_key %s END, "
+                    "last_accessed = NOW() WHERE cache_key IN (%s)" % (
+                        " ".join(["WHEN %s THEN %s"] * len(chunk)),
+                        ", ".join(["%s"] * len(chunk)),
+                    ),
+                    [value for item in chunk for value in item] + [key for key, _ in chunk]
+                )
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+        return len(items)
+
+    def stats(self):
+        counters = self._counters
+        local = self._local.stats()
+        redis_lookups = counters["redis_hits"] + counters["redis_misses"]
+        mysql_lookups = counters["mysql_hits"] + counters["mysql_misses"]
+        return {
+            "local": local,
+            "redis": {
+                "hits": counters["redis_hits"],
+                "misses": counters["redis_misses"],
+                "hit_ratio": round(counters["redis_hits"] / redis_lookups, 4) if redis_lookups else 0.0,
+            },
+            "mysql": {
+                "hits": counters["mysql_hits"],
+                "misses": counters["mysql_misses"],
+                "hit_ratio": round(counters["mysql_hits"] / mysql_lookups, 4) if mysql_lookups else 0.0,
+            },
+            "loads": counters["loads"],
+            "negative_stores": counters["negative_stores"],
+            "coalesced": counters["coalesced"],
+            "pending_access_counts": len(self._accesses),
+        }
+
+
+def sweep():
+    """Delete expired rows, then the least recently accessed ones above the row cap."""
+    batch_size = settings.CONTENT_CACHE_SWEEP_BATCH
+    conn = get_mysql_connection()
+    cursor = conn.cursor()
+    deleted = 0
+    try:
+        while True:
+            cursor.execute("DELETE FROM content_cache WHERE expires_at <= NOW() LIMIT %s", (batch_size,))
+            conn.commit()
+            deleted += cursor.rowcount
+            if cursor.rowcount < batch_size:
+                break
+        cursor.execute("SELECT COUNT(*) FROM content_cache")
+        excess = cursor.fetchone()[0] - settings.CONTENT_CACHE_MAX_ROWS
+        while excess > 0:
+            cursor.execute(
+                "DELETE FROM content_cache ORDER BY last_accessed LIMIT %s", (min(excess, batch_size),)
+            )
+            conn.commit()
+            if not cursor.rowcount:
+                break
+            deleted += cursor.rowcount
+            excess -= cursor.rowcount
+    finally:
+        cursor.close()
+        conn.close()
+    return deleted
+
+
+def _run():
+    while not _stop.wait(settings.CONTENT_CACHE_SWEEP_INTERVAL):
+        try:
+            for cache in _caches:
+                cache.flush_access_counts()
+            sweep()
+        except Exception:
+            logger.exception("content_cache maintenance failed")
+
+
+def start_maintenance():
+    global _thread
+    if _thread is not None:
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_run, name="content-cache-sweeper", daemon=True)
+    _thread.start()
+
+
+def stop_maintenance():
+    """Stop the maintenance thread and write out the pending access counts."""
+    global _thread
+    if _thread is None:
+        return
+    _stop.set()
+    _thread.join()
+    _thread = None
+    for cache in _caches:
+        try:
+            cache.flush_access_counts()
+        except Exception:
+            logger.exception("Could not flush content_cache access counts")
+
+
+def cache_stats():
+    return {cache.namespace: cache.stats() for cache in _caches}
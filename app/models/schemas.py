@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 
 # Auth Models
@@ -23,6 +23,10 @@ class Series(BaseModel):
     genre: str
     rating: str
 
+class SeriesPage(BaseModel):
+    items: List[Series]
+    next_cursor: Optional[str] = None
+
 class Episode(BaseModel):
     series_id: int
     season_number: int
@@ -31,11 +35,30 @@ class Episode(BaseModel):
     duration: int
     description: str
 
+class ViewingProgress(BaseModel):
+    progress: int  # in seconds
+    completed: bool = False
+
 # Subscription Models
 class SubscriptionCreate(BaseModel):
     plan_type: str = Field(..., regex='^(basic|standard|premium)$')
     auto_renewal: bool = True
 
+class Subscription(BaseModel):
+    id: int
+    user_id: int
+    plan_type: Optional[str] = None
+    start_date: datetime
+    end_date: datetime
+    auto_renewal: Optional[bool] = None
+
+# Performance Metrics
+class PerformanceSample(BaseModel):
+    timestamp: datetime
+    metric_type: str = Field(..., regex='^(cdn_latency|server_load|streaming_quality|error_rate)$')
+    value: float
+    details: Optional[dict] = None
+
 # MongoDB Schemas
 viewing_logs_schema = {
     "bsonType": "object",
@@ -0,0 +1,149 @@
+"""Per-user viewing rollups maintained as events arrive.
+
+``user_viewing_rollups`` holds one document per user (``_id`` = user id)::
+
+    {
+        "_id": 42,
+        "total_events": 1234,
+        "total_watch_seconds": 12340,
+        "last_event_at": <date>,
+        "series": {"7": {"episode_id": 70, "progress": 512, "last_watched": <date>}},
+        "daily": {"2024-05-01": {"events": 30, "watch_seconds": 300}},
+        "recent": [<last ANALYTICS_RECENT_EVENTS viewing_logs events>],
+    }
+
+Every batch of ``viewing_logs`` events is folded in with one ``$inc``/``$set``/
+``$push`` + ``$slice`` update per user, so ``GET /analytics/user/{id}`` is a
+single ``_id`` lookup. Heartbeats carry a position rather than a duration, so
+each one credits ``ANALYTICS_HEARTBEAT_SECONDS`` of watch time (the player's
+heartbeat interval).
+
+Existing history is folded in once with
+``python -m app.services.analytics backfill``.
+"""
+import sys
+from collections import defaultdict
+from pymongo import UpdateOne
+from ..core import sharding
+from ..core.config import settings
+from ..core.database import get_mongo_client
+from . import catalog
+
+ROLLUPS = "user_viewing_rollups"
+
+
+def _recent_event(event):
+    return {key: event[key] for key in ("episode_id", "progress", "action", "timestamp") if key in event}
+
+
+def rollup_update(events, series_of=None):
+    """One update document folding ``events`` (all for the same user) into a rollup.
+
+    ``series_of`` maps episode ids to series ids; it is looked up when omitted.
+    """
+    if series_of is None:
+        series_of = catalog.episode_series_ids([event["episode_id"] for event in events])
+    heartbeat = settings.ANALYTICS_HEARTBEAT_SECONDS
+    inc = defaultdict(int)
+    latest_per_series = {}
+    events = sorted(events, key=lambda event: event["timestamp"])
+    for event in events:
+        day = event["timestamp"].strftime("%Y-%m-%d")
+        inc["total_events"] += 1
+        inc["total_watch_seconds"] += heartbeat
+        inc[f"daily.{day}.events"] += 1
+        inc[f"daily.{day}.watch_seconds"] += heartbeat
+        series_id = series_of.get(event["episode_id"])
+        if series_id is not None:
+            latest_per_series[series_id] = event
+
+    return {
+        "$inc": dict(inc),
+        "$max": {"last_event_at": events[-1]["timestamp"]},
+        "$set": {
+            f"series.{series_id}": {
+                "episode_id": event["episode_id"],
+                "progress": event.get("progress"),
+                "last_watched": event["timestamp"],
+            }
+            for series_id, event in latest_per_series.items()
+        },
+        "$push": {
+            "recent": {
+                "$each": [_recent_event(event) for event in events[-settings.ANALYTICS_RECENT_EVENTS:]],
+                "$slice": -settings.ANALYTICS_RECENT_EVENTS,
+            }
+        },
+    }
+
+
+def apply_events(db, events):
+    """Fold viewing_logs events into their users' rollups (one update per user)."""
+    by_user = defaultdict(list)
+    for event in events:
+        by_user[event["user_id"]].append(event)
+    if not by_user:
+        return
+    # One chunked lookup for the whole batch instead of one per event
+    series_of = catalog.episode_series_ids([event["episode_id"] for event in events])
+    updates = []
+    for user_id, user_events in by_user.items():
+        update = rollup_update(user_events, series_of)
+        if not update["$set"]:
+            del update["$set"]
+        updates.append(UpdateOne({"_id": user_id}, update, upsert=True))
+    db[ROLLUPS].bulk_write(updates, ordered=False)
+
+
+def empty_rollup(user_id):
+    return {"_id": user_id, "total_events": 0, "total_watch_seconds": 0, "last_event_at": None,
+            "series": {}, "daily": {}, "recent": []}
+
+
+def get_user_rollup(user_id):
+    """The user's rollup; an empty one for a user with no viewing activity."""
+    db = get_mongo_client()[settings.MONGO_DATABASE]
+    return db[ROLLUPS].find_one({"_id": user_id}) or empty_rollup(user_id)
+
+
+def backfill(batch_size=1000):
+    """Rebuild every rollup from viewing_logs, streaming one user at a time.
+
+    The sort walks the ``(user_id, timestamp desc)`` index backwards: highest
+    user id first, each user's events oldest first. So the server needs no
+    in-memory sort, and a user's batches are folded in chronological order.
+    Each shard's logs are read in turn; rollups live on the main database.
+    Events ingested while this runs can be counted twice, so run it once
+    while telemetry ingest is paused (e.g. as part of the deploy).
+    """
+    db = get_mongo_client()[settings.MONGO_DATABASE]
+    db[ROLLUPS].delete_many({})
+    users = 0
+    for shard in sharding.shard_names():
+        cursor = sharding.mongo_db(shard).viewing_logs.find(
+            {}, {"_id": 0}
+        ).sort([("user_id", -1), ("timestamp", 1)]).batch_size(batch_size)
+
+        current_user, owned, pending = None, False, []
+        for event in cursor:
+            if event["user_id"] != current_user or len(pending) >= batch_size:
+                if pending:
+                    apply_events(db, pending)
+                if event["user_id"] != current_user:
+                    # Skip copies left on a shard the user has moved away from
+                    owned = sharding.owner(event["user_id"]) == shard
+                    if owned:
+                        users += 1
+                current_user, pending = event["user_id"], []
+            if owned:
+                pending.append(event)
+        if pending:
+            apply_events(db, pending)
+    return users
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["backfill"]:
+        print(f"Rebuilt rollups for {backfill()} users")
+    else:
+        print("usage: python -m app.services.analytics backfill")
@@ -0,0 +1,233 @@
+"""Materialized catalog snapshots with conditional (ETag) responses.
+
+Catalog views such as a series' episode list are rendered once per catalog
+revision into compact JSON and kept in Redis and in-process memory. The
+revision is a Redis counter bumped by every catalog write
+(``bump_revision``); workers re-read it at most every
+``CATALOG_REVISION_POLL`` seconds, so other workers serve the old snapshot for
+at most that long after a write.
+
+Each snapshot carries an ETag derived from its bytes, so a revision bump that
+does not change a given view keeps its ETag and clients/CDNs keep getting
+304s for it.
+"""
+import hashlib
+import json
+import threading
+import time
+import redis
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from ..core.cache import LRUCache
+from ..core.config import settings
+from ..core.database import CATALOG_SCOPE, get_mongo_client, get_mysql_connection, get_redis, mark_written
+from ..core.tiered_cache import TieredCache
+
+REVISION_KEY = "catalog:revision"
+SNAPSHOT_KEY = "catalog:snapshot:{}:{}"
+
+_snapshots = LRUCache(maxsize=settings.CATALOG_SNAPSHOT_CACHE_SIZE, ttl=settings.CATALOG_SNAPSHOT_TTL)
+_revision = {"value": None, "fetched_at": 0.0}
+_revision_lock = threading.Lock()
+_counters = {"redis_hits": 0, "builds": 0, "not_modified": 0}
+
+
+def current_revision():
+    now = time.monotonic()
+    if _revision["value"] is not None and now - _revision["fetched_at"] < settings.CATALOG_REVISION_POLL:
+        return _revision["value"]
+    with _revision_lock:
+        try:
+            value = int(get_redis().get(REVISION_KEY) or 0)
+        except redis.RedisError:
+            # Keep serving the last known revision rather than failing reads
+            value = _revision["value"] or 0
+        _revision.update(value=value, fetched_at=now)
+    return value
+
+
+def bump_revision():
+    """Invalidate every catalog snapshot; call after any series/season/episode write."""
+    # Before the new revision is visible, so its snapshots are built from the primary
+    mark_written(CATALOG_SCOPE)
+    value = get_redis().incr(REVISION_KEY)
+    with _revision_lock:
+        _revision.update(value=value, fetched_at=time.monotonic())
+    return value
+
+
+def get_snapshot(name, build):
+    """Return ``(etag, payload)`` for catalog view ``name`` at the current revision.
+
+    ``build`` is only called when neither memory nor Redis has the view.
+    """
+    revision = current_revision()
+    cached = _snapshots.get(name)
+    if cached is not None and cached[0] == revision:
+        return cached[1], cached[2]
+
+    key = SNAPSHOT_KEY.format(revision, name)
+    r = get_redis()
+    try:
+        payload = r.get(key)
+    except redis.RedisError:
+        payload = None
+    if payload is not None:
+        _counters["redis_hits"] += 1
+        payload = payload.encode()
+    else:
+        _counters["builds"] += 1
+        payload = json.dumps(jsonable_encoder(build()), separators=(",", ":")).encode()
+        try:
+            r.setex(key, settings.CATALOG_SNAPSHOT_TTL, payload)
+        except redis.RedisError:
+            pass
+
+    etag = '"%s"' % hashlib.sha1(payload).hexdigest()[:20]
+    _snapshots.set(name, (revision, etag, payload))
+    return etag, payload
+
+
+def _etag_matches(etag, if_none_match):
+    """Whether an If-None-Match header lists ``etag`` (weak comparison) or is ``*``."""
+    tags = {tag.strip() for tag in if_none_match.split(",")}
+    if "*" in tags:
+        return True
+    bare = etag[2:] if etag.startswith("W/") else etag
+    return any((tag[2:] if tag.startswith("W/") else tag) == bare for tag in tags)
+
+
+def snapshot_response(request: Request, name, build, private=False):
+    """Serve a snapshot, answering 304 when the client already has it.
+
+    ``private`` keeps shared caches from storing it (for endpoints behind auth).
+    """
+    etag, payload = get_snapshot(name, build)
+    scope = "private" if private else "public"
+    headers = {"ETag": etag, "Cache-Control": f"{scope}, max-age={settings.CATALOG_CLIENT_MAX_AGE}"}
+    if _etag_matches(etag, request.headers.get("if-none-match", "")):
+        _counters["not_modified"] += 1
+        return Response(status_code=304, headers=headers)
+    return Response(content=payload, media_type="application/json", headers=headers)
+
+
+def build_series_episodes(series_id):
+    with get_mysql_connection(read_only=True, scope=CATALOG_SCOPE) as conn:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("""
+            SELECT e.*, s.season_number
+            FROM episodes e
+            JOIN seasons s ON e.season_id = s.id
+            WHERE s.series_id = %s
+            ORDER BY s.season_number, e.episode_number
+        """, (series_id,))
+        episodes = cursor.fetchall()
+        cursor.close()
+
+    seasons = {}
+    for episode in episodes:
+        seasons.setdefault(episode["season_number"], []).append(episode)
+    return {
+        "series_id": series_id,
+        "seasons": [
+            {"season_number": number, "episodes": items}
+            for number, items in seasons.items()
+        ],
+    }
+
+
+def catalog_cache_stats():
+    return {"local": _snapshots.stats(), "revision": _revision["value"], **_counters}
+
+
+# Lookups used outside the catalog endpoints (trending, recommendations, ...)
+_episode_series = LRUCache(maxsize=settings.CATALOG_LOOKUP_CACHE_SIZE, ttl=settings.CATALOG_SNAPSHOT_TTL)
+_series_summaries = LRUCache(maxsize=settings.CATALOG_LOOKUP_CACHE_SIZE, ttl=settings.CATALOG_SNAPSHOT_TTL)
+
+
+def episode_series_id(episode_id):
+    """Series an episode belongs to, or None for an unknown episode."""
+    series_id = _episode_series.get(episode_id)
+    if series_id is not None:
+        return series_id
+    with get_mysql_connection(read_only=True, scope=CATALOG_SCOPE) as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT se.series_id FROM episodes e
+            JOIN seasons se ON e.season_id = se.id
+            WHERE e.id = %s
+        """, (episode_id,))
+        row = cursor.fetchone()
+        cursor.close()
+    if row is None:
+        return None
+    _episode_series.set(episode_id, row[0])
+    return row[0]
+
+
+def episode_series_ids(episode_ids, chunk_size=1000):
+    """``{episode_id: series_id}`` for the known episodes among ``episode_ids``."""
+    found = {}
+    missing = []
+    for episode_id in set(episode_ids):
+        series_id = _episode_series.get(episode_id)
+        if series_id is None:
+            missing.append(episode_id)
+        else:
+            found[episode_id] = series_id
+    if missing:
+        conn = get_mysql_connection(read_only=True, scope=CATALOG_SCOPE)
+        cursor = conn.cursor()
+        try:
+            for start in range(0, len(missing), chunk_size):
+                chunk = missing[start:start + chunk_size]
+                cursor.execute(
+                    "SELECT e.id, se.series_id FROM episodes e JOIN seasons se ON e.season_id = se.id "
+                    "WHERE e.id IN (%s)" % ", ".join(["%s"] * len(chunk)),
+                    chunk
+                )
+                for episode_id, series_id in cursor.fetchall():
+                    _episode_series.set(episode_id, series_id)
+                    found[episode_id] = series_id
+        finally:
+            cursor.close()
+            conn.close()
+    return found
+
+
+def series_summaries(series_ids):
+    """``{id: {"id", "title", "genre", "release_year"}}`` for the given series."""
+    found = {}
+    missing = []
+    for series_id in series_ids:
+        summary = _series_summaries.get(series_id)
+        if summary is None:
+            missing.append(series_id)
+        else:
+            found[series_id] = summary
+    if missing:
+        with get_mysql_connection(read_only=True, scope=CATALOG_SCOPE) as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(
+                "SELECT id, title, genre, release_year FROM series WHERE id IN (%s)"
+                % ", ".join(["%s"] * len(missing)),
+                missing
+            )
+            for row in cursor.fetchall():
+                _series_summaries.set(row["id"], row)
+                found[row["id"]] = row
+            cursor.close()
+    return found
+
+
+def _load_series_document(series_id):
+    db = get_mongo_client()[settings.MONGO_DATABASE]
+    return db.series.find_one({"_id": series_id}, {"_id": 0})
+
+
+_series_documents = TieredCache("series", loader=_load_series_document)
+
+
+def series_document(series_id):
+    """A series' Mongo document (without ``_id``), or None if it doesn't exist."""
+    return _series_documents.get(series_id)
@@ -0,0 +1,149 @@
+"""Per-user "continue watching" rows kept in Redis.
+
+Each user has two keys, written together by one script:
+
+* ``continue_watching:{user_id}``: a sorted set of series ids scored by
+  the time they were last watched.
+* ``continue_watching:{user_id}:positions``: a hash of series id to the
+  episode and position the user was at, as JSON.
+
+A progress update goes into the sorted set only if it is newer than what is
+there, so out-of-order heartbeats can't move a row back. The set is trimmed
+to the newest ``CONTINUE_WATCHING_SIZE`` series, and the evicted series'
+positions are removed from the hash. Both keys expire
+``CONTINUE_WATCHING_TTL`` seconds after the user's last update.
+
+The hash also holds a ``_loaded`` marker. It is set once the user's history
+has been read from MySQL ``viewing_progress`` on the user's shard (see
+``app/core/sharding.py``). Until then, the Redis rows may only cover updates
+since the keys expired (or since this was deployed), so the first read
+merges in the MySQL history. MySQL is only read on that first, cold read.
+Reads and writes both cost one round trip.
+"""
+import json
+import time
+from datetime import datetime
+from ..core.config import settings
+from ..core import sharding
+from ..core.database import get_redis
+from . import catalog
+
+RECENT_KEY = "continue_watching:{}"
+POSITIONS_KEY = "continue_watching:{}:positions"
+LOADED_FIELD = "_loaded"
+
+# KEYS: recent zset, positions hash. ARGV: series id, watched at, position
+# JSON, max series, TTL
+UPDATE = """
+local current = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if current and tonumber(current) > tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[3])
+local evicted = redis.call('ZRANGE', KEYS[1], 0, -(tonumber(ARGV[4]) + 1))
+if #evicted > 0 then
+    redis.call('ZREMRANGEBYRANK', KEYS[1], 0, -(tonumber(ARGV[4]) + 1))
+    redis.call('HDEL', KEYS[2], unpack(evicted))
+end
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+redis.call('EXPIRE', KEYS[2], ARGV[5])
+return 1
+"""
+
+_update = None
+
+
+def _script(r):
+    global _update
+    if _update is None:
+        _update = r.register_script(UPDATE)
+    return _update
+
+
+def _queue(pipe, r, user_id, series_id, episode_id, progress, at):
+    _script(r)(
+        keys=[RECENT_KEY.format(user_id), POSITIONS_KEY.format(user_id)],
+        args=[
+            series_id, at, json.dumps([episode_id, progress]),
+            settings.CONTINUE_WATCHING_SIZE, settings.CONTINUE_WATCHING_TTL,
+        ],
+        client=pipe
+    )
+
+
+def add(pipe, user_id, episode_id, progress, at=None):
+    """Queue a progress update on ``pipe``, the caller's Redis pipeline."""
+    series_id = catalog.episode_series_id(episode_id)
+    if series_id is None:
+        return
+    _queue(pipe, get_redis(), user_id, series_id, episode_id, progress, at if at is not None else time.time())
+
+
+def record(user_id, episode_id, progress, at=None):
+    pipe = get_redis().pipeline()
+    add(pipe, user_id, episode_id, progress, at)
+    pipe.execute()
+
+
+def _load(r, user_id):
+    """Merge the user's MySQL history into Redis and mark it loaded."""
+    with sharding.mysql_connection(sharding.owner(user_id)) as conn:
+        cursor = conn.cursor()
+        # Shards hold no catalog tables, so episodes are mapped to series here
+        cursor.execute("""
+            SELECT episode_id, progress, UNIX_TIMESTAMP(last_watched)
+            FROM viewing_progress
+            WHERE user_id = %s
+            ORDER BY last_watched DESC
+        """, (user_id,))
+        history = cursor.fetchall()
+        cursor.close()
+    # The latest episode per series, from the newest series down
+    series_of = catalog.episode_series_ids([episode_id for episode_id, *_ in history])
+    rows, seen = [], set()
+    for episode_id, progress, watched_at in history:
+        series_id = series_of.get(episode_id)
+        if series_id is None or series_id in seen:
+            continue
+        seen.add(series_id)
+        rows.append((series_id, episode_id, progress, watched_at))
+        if len(rows) >= settings.CONTINUE_WATCHING_SIZE:
+            break
+    pipe = r.pipeline()
+    for series_id, episode_id, progress, watched_at in rows:
+        _queue(pipe, r, user_id, series_id, episode_id, progress, float(watched_at))
+    pipe.hset(POSITIONS_KEY.format(user_id), LOADED_FIELD, 1)
+    pipe.expire(POSITIONS_KEY.format(user_id), settings.CONTINUE_WATCHING_TTL)
+    pipe.zrevrange(RECENT_KEY.format(user_id), 0, -1, withscores=True)
+    pipe.hgetall(POSITIONS_KEY.format(user_id))
+    return pipe.execute()[-2:]
+
+
+def items(user_id, limit=20):
+    """The user's most recently watched series with where they left off."""
+    r = get_redis()
+    pipe = r.pipeline()
+    pipe.zrevrange(RECENT_KEY.format(user_id), 0, -1, withscores=True)
+    pipe.hgetall(POSITIONS_KEY.format(user_id))
+    recent, positions = pipe.execute()
+    if LOADED_FIELD not in positions:
+        recent, positions = _load(r, user_id)
+
+    rows = []
+    for member, watched_at in recent[:limit]:
+        position = positions.get(member)
+        if position is None:
+            continue
+        episode_id, progress = json.loads(position)
+        rows.append((int(member), episode_id, progress, watched_at))
+    summaries = catalog.series_summaries([series_id for series_id, *_ in rows]) if rows else {}
+    return [
+        {
+            "series": summaries.get(series_id, {"id": series_id}),
+            "episode_id": episode_id,
+            "progress": progress,
+            "last_watched": datetime.fromtimestamp(watched_at),
+        }
+        for series_id, episode_id, progress, watched_at in rows
+    ]
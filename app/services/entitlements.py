@@ -0,0 +1,78 @@
+"""Cached subscription entitlement lookups.
+
+Resolves a user's active plan and expiry through a per-process LRU, then
+Redis, then MySQL. Cache TTLs never outlive the subscription's ``end_date``,
+so an expired plan drops out on its own; the subscription endpoints call
+``invalidate_entitlement`` on create/cancel. Users without an active plan are
+cached too, for ``ENTITLEMENT_NEGATIVE_TTL`` seconds.
+"""
+import json
+from datetime import datetime
+import redis
+from ..core.cache import LRUCache
+from ..core.config import settings
+from ..core.database import get_mysql_connection, get_redis, user_scope
+
+ENTITLEMENT_KEY = "entitlement:{}"
+_NONE = {"plan_type": None, "end_date": None}
+
+_local = LRUCache(maxsize=settings.ENTITLEMENT_CACHE_SIZE, ttl=settings.ENTITLEMENT_LOCAL_TTL)
+
+
+def _ttl(entitlement, limit):
+    if entitlement["end_date"] is None:
+        return min(limit, settings.ENTITLEMENT_NEGATIVE_TTL)
+    remaining = (datetime.fromisoformat(entitlement["end_date"]) - datetime.now()).total_seconds()
+    return max(1, min(limit, int(remaining)))
+
+
+def _load(user_id):
+    with get_mysql_connection(read_only=True, scope=user_scope(user_id)) as conn:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("""
+            SELECT plan_type, end_date FROM subscriptions
+            WHERE user_id = %s AND end_date > NOW()
+            ORDER BY end_date DESC LIMIT 1
+        """, (user_id,))
+        row = cursor.fetchone()
+        cursor.close()
+    if row is None:
+        return _NONE
+    return {"plan_type": row["plan_type"], "end_date": row["end_date"].isoformat()}
+
+
+def get_entitlement(user_id):
+    """Return ``{"plan_type", "end_date"}`` for the active plan, or None."""
+    entitlement = _local.get(user_id)
+    if entitlement is None:
+        r = get_redis()
+        try:
+            cached = r.get(ENTITLEMENT_KEY.format(user_id))
+        except redis.RedisError:
+            cached = None
+        if cached is not None:
+            entitlement = json.loads(cached)
+        else:
+            entitlement = _load(user_id)
+            try:
+                r.setex(ENTITLEMENT_KEY.format(user_id),
+                        _ttl(entitlement, settings.ENTITLEMENT_REDIS_TTL), json.dumps(entitlement))
+            except redis.RedisError:
+                pass
+        _local.set(user_id, entitlement, ttl=_ttl(entitlement, settings.ENTITLEMENT_LOCAL_TTL))
+
+    if entitlement["end_date"] is None or datetime.fromisoformat(entitlement["end_date"]) <= datetime.now():
+        return None
+    return entitlement
+
+
+def invalidate_entitlement(user_id):
+    _local.delete(user_id)
+    try:
+        get_redis().delete(ENTITLEMENT_KEY.format(user_id))
+    except redis.RedisError:
+        pass
+
+
+def entitlement_cache_stats():
+    return _local.stats()
@@ -0,0 +1,153 @@
+"""Ingestion and downsampled queries for performance metrics.
+
+Samples (``cdn_latency``, ``server_load``, ``streaming_quality``,
+``error_rate``) are stored in one of two modes, chosen by
+``METRICS_STORAGE``:
+
+* ``timeseries`` (default): a MongoDB time-series collection
+  ``performance_metrics_ts`` with ``metric_type`` as the meta field, so the
+  server packs samples into compressed buckets itself.
+* ``bucketed``: for servers without time-series support, up to
+  ``METRICS_BUCKET_SIZE`` samples per document in
+  ``performance_metrics_buckets``, with running min/max/sum.
+
+Both expire data after ``METRICS_RETENTION_DAYS`` (time-series
+``expireAfterSeconds`` or a TTL index). Collections and indexes are created by
+``app/core/migrations.py``. Queries aggregate on the server into fixed-width
+bins with min/max/avg/count and percentiles. The ``$percentile`` accumulator
+(approximate) needs MongoDB 7.0 and ``$dateTrunc`` 5.0; on older servers the
+bins are computed from epoch milliseconds, and each bin's values are sent back
+so the percentiles are computed here (exactly) instead.
+"""
+import numpy as np
+from pymongo import UpdateOne
+from ..core.config import settings
+from ..core.database import get_mongo_client
+
+TIMESERIES_COLLECTION = "performance_metrics_ts"
+BUCKETS_COLLECTION = "performance_metrics_buckets"
+
+_server = {"version": None}
+
+
+def _db():
+    return get_mongo_client()[settings.MONGO_DATABASE]
+
+
+def _server_version():
+    """The MongoDB server version as a tuple, e.g. ``(6, 0, 14)``; fetched once."""
+    if _server["version"] is None:
+        _server["version"] = tuple(get_mongo_client().server_info()["versionArray"][:3])
+    return _server["version"]
+
+
+def _percentile_label(p):
+    return f"p{round(p * 100, 3):g}"
+
+
+def _bucket_start(timestamp):
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def ingest(samples):
+    """Store ``[{"timestamp", "metric_type", "value", "details"?}, ...]``."""
+    if not samples:
+        return 0
+    db = _db()
+    if settings.METRICS_STORAGE == "bucketed":
+        updates = [
+            UpdateOne(
+                {
+                    "metric_type": sample["metric_type"],
+                    "start": _bucket_start(sample["timestamp"]),
+                    "count": {"$lt": settings.METRICS_BUCKET_SIZE},
+                },
+                {
+                    "$push": {"samples": {"t": sample["timestamp"], "v": sample["value"]}},
+                    "$inc": {"count": 1, "sum": sample["value"]},
+                    "$min": {"min": sample["value"], "first": sample["timestamp"]},
+                    "$max": {"max": sample["value"], "last": sample["timestamp"]},
+                },
+                upsert=True,
+            )
+            for sample in samples
+        ]
+        db[BUCKETS_COLLECTION].bulk_write(updates, ordered=False)
+    else:
+        db[TIMESERIES_COLLECTION].insert_many(
+            [{key: value for key, value in sample.items() if value is not None} for sample in samples],
+            ordered=False
+        )
+    return len(samples)
+
+
+def query(metric_type, start, end, step_seconds, percentiles=(0.5, 0.95, 0.99)):
+    """Downsample ``metric_type`` over ``[start, end)`` into ``step_seconds`` bins."""
+    if settings.METRICS_STORAGE == "bucketed":
+        collection = BUCKETS_COLLECTION
+        pipeline = [
+            {"$match": {"metric_type": metric_type, "start": {"$lt": end}, "last": {"$gte": start}}},
+            {"$unwind": "$samples"},
+            {"$project": {"timestamp": "$samples.t", "value": "$samples.v"}},
+            {"$match": {"timestamp": {"$gte": start, "$lt": end}}},
+        ]
+    else:
+        collection = TIMESERIES_COLLECTION
+        pipeline = [
+            {"$match": {"metric_type": metric_type, "timestamp": {"$gte": start, "$lt": end}}},
+        ]
+
+    version = _server_version()
+    if version >= (5, 0):
+        bin_start = {"$dateTrunc": {"date": "$timestamp", "unit": "second", "binSize": step_seconds}}
+    else:
+        millis = {"$toLong": "$timestamp"}
+        bin_start = {"$toDate": {"$subtract": [millis, {"$mod": [millis, step_seconds * 1000]}]}}
+    group = {
+        "_id": bin_start,
+        "min": {"$min": "$value"},
+        "max": {"$max": "$value"},
+        "avg": {"$avg": "$value"},
+        "count": {"$sum": 1},
+    }
+    if percentiles and version >= (7, 0):
+        group["percentiles"] = {
+            "$percentile": {"input": "$value", "p": list(percentiles), "method": "approximate"}
+        }
+    elif percentiles:
+        group["values"] = {"$push": "$value"}
+    pipeline += [{"$group": group}, {"$sort": {"_id": 1}}]
+
+    points = []
+    for row in _db()[collection].aggregate(pipeline, allowDiskUse=True):
+        point = {
+            "timestamp": row["_id"],
+            "min": row["min"],
+            "max": row["max"],
+            "avg": row["avg"],
+            "count": row["count"],
+        }
+        values = row.get("percentiles")
+        if "values" in row:
+            values = np.quantile(row["values"], percentiles).tolist()
+        for p, value in zip(percentiles, values or []):
+            point[_percentile_label(p)] = value
+        points.append(point)
+    return points
+
+
+def ensure_collections(db):
+    """Create the storage collection for the configured mode (called by migrations)."""
+    retention = settings.METRICS_RETENTION_DAYS * 86400
+    existing = set(db.list_collection_names())
+    if settings.METRICS_STORAGE == "bucketed":
+        db[BUCKETS_COLLECTION].create_index([("metric_type", 1), ("start", 1), ("count", 1)])
+        db[BUCKETS_COLLECTION].create_index("last", expireAfterSeconds=retention)
+    elif TIMESERIES_COLLECTION in existing:
+        db.command("collMod", TIMESERIES_COLLECTION, expireAfterSeconds=retention)
+    else:
+        db.create_collection(
+            TIMESERIES_COLLECTION,
+            timeseries={"timeField": "timestamp", "metaField": "metric_type", "granularity": "seconds"},
+            expireAfterSeconds=retention,
+        )
@@ -0,0 +1,230 @@
+"""Write-behind buffer for viewing-progress heartbeats.
+
+With ``VIEWING_PROGRESS_WRITE_BEHIND`` enabled, ``POST /viewing-progress``
+only touches Redis:
+
+* ``viewing_progress:pending`` is a hash of ``{user_id}:{episode_id}`` to the
+  latest position, so repeated heartbeats for the same episode collapse to
+  the last one (last-position-wins).
+* ``viewing_logs:pending`` is a list of every heartbeat for ``viewing_logs``.
+* The user's continue-watching rows are updated in the same pipeline.
+
+A background flusher drains both every ``PROGRESS_FLUSH_INTERVAL`` seconds, or
+sooner once ``PROGRESS_FLUSH_BATCH_SIZE`` heartbeats are pending. Each key is
+claimed with an atomic RENAME, written as multi-row upserts to MySQL and
+unordered ``insert_many`` to Mongo (grouped by the users' shards, see
+``app/core/sharding.py``), and deleted only after the writes succeed. A
+claimed key that fails to flush is retried on the next cycle, and claims
+left behind by a crashed worker are picked up at startup.
+
+Heartbeats for unknown episodes are refused by ``record``. If an upsert still
+hits a constraint (e.g. the episode was deleted since), its chunk is retried
+row by row and the offending rows are moved to ``viewing_progress:dead``, so
+one bad row can't hold back everyone else's progress.
+
+Durability: a heartbeat is acknowledged once it is in Redis. Heartbeats are
+lost only if Redis itself loses them (e.g. restart without AOF), so run Redis
+with ``appendonly yes`` when the buffer is enabled. Delivery to MySQL and
+Mongo is at-least-once; MySQL upserts only move ``last_watched`` forward, so a
+replayed or out-of-order batch cannot roll progress back, while a replayed
+Mongo batch can duplicate log entries and rollup counts. Shutdown runs a
+final flush.
+"""
+import json
+import logging
+import threading
+import time
+import uuid
+from datetime import datetime
+from operator import itemgetter
+import mysql.connector
+import redis
+from ..core import sharding
+from ..core.config import settings
+from ..core.database import get_mongo_client, get_redis
+from . import analytics, catalog, continue_watching
+
+logger = logging.getLogger(__name__)
+
+PENDING_PROGRESS_KEY = "viewing_progress:pending"
+PENDING_LOGS_KEY = "viewing_logs:pending"
+DEAD_PROGRESS_KEY = "viewing_progress:dead"
+
+UPSERT_PROGRESS = """
+    INSERT INTO viewing_progress (user_id, episode_id, progress, last_watched, updated_at)
+    VALUES {rows}
+    ON DUPLICATE KEY UPDATE
+        progress = IF(VALUES(last_watched) >= last_watched, VALUES(progress), progress),
+        last_watched = GREATEST(last_watched, VALUES(last_watched)),
+        updated_at = NOW()
+"""
+
+_wake = threading.Event()
+_stop = threading.Event()
+_thread = None
+_retry_keys = []
+
+
+class UnknownEpisode(ValueError):
+    pass
+
+
+def viewing_log_document(user_id, episode_id, progress, timestamp):
+    return {
+        "user_id": user_id,
+        "episode_id": episode_id,
+        "progress": progress,
+        "action": "play",
+        "device_info": {},
+        "timestamp": timestamp,
+    }
+
+
+def record(user_id, episode_id, progress):
+    """Buffer one heartbeat in Redis; wakes the flusher when the batch is full."""
+    if catalog.episode_series_id(episode_id) is None:
+        raise UnknownEpisode(episode_id)
+    now = time.time()
+    pipe = get_redis().pipeline()
+    pipe.hset(PENDING_PROGRESS_KEY, f"{user_id}:{episode_id}", json.dumps([progress, now]))
+    pipe.rpush(PENDING_LOGS_KEY, json.dumps([user_id, episode_id, progress, now]))
+    continue_watching.add(pipe, user_id, episode_id, progress, now)
+    _, pending, *_ = pipe.execute()
+    if pending >= settings.PROGRESS_FLUSH_BATCH_SIZE:
+        _wake.set()
+
+
+def _claim(r, key):
+    claimed = f"{key}:flushing:{uuid.uuid4().hex}"
+    try:
+        r.rename(key, claimed)
+    except redis.ResponseError:  # nothing pending
+        return None
+    return claimed
+
+
+def _upsert_chunk(r, cursor, chunk):
+    query = UPSERT_PROGRESS.format(rows=", ".join(["(%s, %s, %s, %s, NOW())"] * len(chunk)))
+    try:
+        cursor.execute(query, [value for row in chunk for value in row])
+        return
+    except mysql.connector.IntegrityError:
+        pass
+    # A failed statement is rolled back on its own, so the good rows can
+    # still go in the same transaction.
+    single = UPSERT_PROGRESS.format(rows="(%s, %s, %s, %s, NOW())")
+    for row in chunk:
+        try:
+            cursor.execute(single, row)
+        except mysql.connector.IntegrityError as exc:
+            logger.warning("Dropping progress %s to %s: %s", row[:2], DEAD_PROGRESS_KEY, exc)
+            user_id, episode_id, progress, watched = row
+            r.rpush(DEAD_PROGRESS_KEY, json.dumps([user_id, episode_id, progress, watched.timestamp(), str(exc)]))
+
+
+def _flush_progress(r, key):
+    rows = []
+    for field, value in r.hgetall(key).items():
+        user_id, episode_id = field.split(":")
+        progress, ts = json.loads(value)
+        rows.append((int(user_id), int(episode_id), progress, datetime.fromtimestamp(ts)))
+
+    batch_size = settings.PROGRESS_FLUSH_BATCH_SIZE
+    for shard, shard_rows in sharding.group_for_write(rows, itemgetter(0)).items():
+        conn = sharding.mysql_connection(shard)
+        cursor = conn.cursor()
+        try:
+            for start in range(0, len(shard_rows), batch_size):
+                _upsert_chunk(r, cursor, shard_rows[start:start + batch_size])
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+    return len(rows)
+
+
+def _flush_logs(r, key):
+    documents = [
+        viewing_log_document(user_id, episode_id, progress, datetime.fromtimestamp(ts))
+        for user_id, episode_id, progress, ts in map(json.loads, r.lrange(key, 0, -1))
+    ]
+    db = get_mongo_client()[settings.MONGO_DATABASE]
+    batch_size = settings.PROGRESS_FLUSH_BATCH_SIZE
+    for start in range(0, len(documents), batch_size):
+        chunk = documents[start:start + batch_size]
+        # insert_many sets each document's _id, so a user's copy on a second shard shares it
+        for shard, shard_chunk in sharding.group_for_write(chunk, itemgetter("user_id")).items():
+            sharding.mongo_db(shard).viewing_logs.insert_many(shard_chunk, ordered=False)
+        analytics.apply_events(db, chunk)
+    return len(documents)
+
+
+def _flush_key(r, key):
+    if key.startswith(PENDING_PROGRESS_KEY):
+        _flush_progress(r, key)
+    else:
+        _flush_logs(r, key)
+    r.delete(key)
+
+
+def flush():
+    """Drain everything currently buffered. Safe to call from any worker."""
+    r = get_redis()
+    keys = _retry_keys[:]
+    del _retry_keys[:]
+    for pending in (PENDING_PROGRESS_KEY, PENDING_LOGS_KEY):
+        claimed = _claim(r, pending)
+        if claimed:
+            keys.append(claimed)
+    for key in keys:
+        try:
+            _flush_key(r, key)
+        except Exception:
+            logger.exception("Flushing %s failed; will retry", key)
+            _retry_keys.append(key)
+
+
+def recover_orphans():
+    """Re-queue claims left by workers that died mid-flush."""
+    r = get_redis()
+    for pending in (PENDING_PROGRESS_KEY, PENDING_LOGS_KEY):
+        for key in r.scan_iter(f"{pending}:flushing:*"):
+            # Only adopt claims older than a few flush intervals; younger ones
+            # may still belong to a live worker.
+            if r.object("idletime", key) > settings.PROGRESS_FLUSH_INTERVAL * 5:
+                _retry_keys.append(key)
+
+
+def _run():
+    while not _stop.is_set():
+        _wake.wait(settings.PROGRESS_FLUSH_INTERVAL)
+        _wake.clear()
+        try:
+            flush()
+        except Exception:
+            logger.exception("Viewing progress flush failed")
+
+
+def start_flusher():
+    global _thread
+    if _thread is not None:
+        return
+    try:
+        recover_orphans()
+    except redis.RedisError:
+        logger.exception("Could not scan for orphaned progress batches")
+    _stop.clear()
+    _thread = threading.Thread(target=_run, name="progress-flusher", daemon=True)
+    _thread.start()
+
+
+def stop_flusher():
+    """Stop the background thread and flush whatever is still buffered."""
+    global _thread
+    if _thread is None:
+        return
+    _stop.set()
+    _wake.set()
+    _thread.join()
+    _thread = None
+    flush()
@@ -0,0 +1,322 @@
+"""Item-item recommendations precomputed into ``content_similarity``.
+
+Batch job (``python -m app.services.recommendations build``):
+
+1. Load the distinct (user, series) pairs from ``viewing_progress`` on every
+   shard into a sparse binary user x series matrix ``X``.
+2. Compute co-occurrence ``X.T @ X`` one block of ``RECOMMENDATIONS_BLOCK_SIZE``
+   series at a time, so only one block of the series x series matrix exists
+   at once. Scale each count to cosine similarity,
+   ``c_ij / sqrt(n_i * n_j)``, and drop pairs seen together by fewer than
+   ``RECOMMENDATIONS_MIN_COOCCURRENCE`` users.
+3. Keep the ``RECOMMENDATIONS_TOP_K`` best neighbours per series and replace
+   ``content_similarity`` with them in batches.
+
+Serving: every worker keeps the neighbour lists in memory. A background
+thread (``start_refresher``) loads them at startup and swaps in a new copy
+when the table has changed (checked every ``RECOMMENDATIONS_REFRESH``
+seconds); requests only read the current copy and never touch the table.
+``recommend`` scores each series as the sum of its similarity to the user's
+recently watched series, weighted down by recency rank. Series the user has
+already watched are skipped, and ``trending`` fills in when the user has no
+history. One request costs one indexed query on the user's shard (the newest
+``RECOMMENDATIONS_HISTORY * HISTORY_EPISODES_PER_SERIES`` progress rows) plus a
+vectorized merge of at most ``RECOMMENDATIONS_HISTORY * RECOMMENDATIONS_TOP_K``
+neighbours.
+"""
+import logging
+import sys
+import threading
+import time
+from itertools import islice
+import numpy as np
+import scipy.sparse as sp
+from ..core import sharding
+from ..core.config import settings
+from ..core.database import get_mysql_connection
+from . import catalog, trending
+
+logger = logging.getLogger(__name__)
+
+# Progress rows read per history series, for users who binge several episodes
+HISTORY_EPISODES_PER_SERIES = 10
+
+UPSERT_SIMILARITY = """
+    INSERT INTO content_similarity (content_id1, content_id2, similarity_score, similarity_factors, last_updated)
+    VALUES {rows}
+    ON DUPLICATE KEY UPDATE
+        similarity_score = VALUES(similarity_score),
+        similarity_factors = VALUES(similarity_factors),
+        last_updated = VALUES(last_updated)
+"""
+
+_index = {"neighbours": {}, "version": None, "checked_at": 0.0}
+_thread = None
+_stop = threading.Event()
+
+
+def build_similarity(user_ids, item_ids, top_k=None, block_size=None, min_cooccurrence=None):
+    """Top-K cosine neighbours per item from (user, item) interaction arrays.
+
+    Returns ``(items, neighbours, scores, counts)``: ``items`` is the sorted
+    array of item ids, and row ``i`` of the three ``len(items) x top_k``
+    arrays holds item ``i``'s neighbours (ids, ``-1`` padded), their
+    similarity, and the number of users who watched both.
+    """
+    top_k = top_k or settings.RECOMMENDATIONS_TOP_K
+    block_size = block_size or settings.RECOMMENDATIONS_BLOCK_SIZE
+    min_cooccurrence = min_cooccurrence or settings.RECOMMENDATIONS_MIN_COOCCURRENCE
+
+    users, user_index = np.unique(user_ids, return_inverse=True)
+    items, item_index = np.unique(item_ids, return_inverse=True)
+    x = sp.csr_matrix(
+        (np.ones(len(user_index), dtype=np.float32), (user_index, item_index)),
+        shape=(len(users), len(items)),
+    )
+    x.data[:] = 1  # duplicate pairs were summed
+    xt = x.T.tocsr()
+    viewers = np.asarray(x.sum(axis=0)).ravel()
+    norms = np.sqrt(viewers)
+
+    neighbours = np.full((len(items), top_k), -1, dtype=np.int64)
+    scores = np.zeros((len(items), top_k), dtype=np.float32)
+    counts = np.zeros((len(items), top_k), dtype=np.int32)
+    for start in range(0, len(items), block_size):
+        block = (xt[start:start + block_size] @ x).tocsr()
+        rows = np.repeat(np.arange(block.shape[0]), np.diff(block.indptr))
+        block.data[(block.indices == start + rows) | (block.data < min_cooccurrence)] = 0
+        block.eliminate_zeros()
+        rows = np.repeat(np.arange(block.shape[0]), np.diff(block.indptr))
+        similarity = block.data / (norms[start + rows] * norms[block.indices])
+        for row in range(block.shape[0]):
+            lo, hi = block.indptr[row], block.indptr[row + 1]
+            if lo == hi:
+                continue
+            row_scores = similarity[lo:hi]
+            best = np.argpartition(-row_scores, top_k - 1)[:top_k] if hi - lo > top_k else np.arange(hi - lo)
+            best = best[np.argsort(-row_scores[best], kind="stable")]
+            n = len(best)
+            neighbours[start + row, :n] = items[block.indices[lo + best]]
+            scores[start + row, :n] = row_scores[best]
+            counts[start + row, :n] = block.data[lo + best]
+    return items, neighbours, scores, counts
+
+
+def _load_interactions(batch_size=100_000):
+    """Distinct (user, series) pairs from every shard's viewing_progress."""
+    users, episodes = [], []
+    for shard in sharding.shard_names():
+        with sharding.mysql_connection(shard) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT user_id, episode_id FROM viewing_progress")
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                rows = sharding.owned_rows(shard, rows)
+                if not rows:
+                    continue
+                batch = np.array(rows, dtype=np.int64)
+                users.append(batch[:, 0])
+                episodes.append(batch[:, 1])
+            cursor.close()
+    if not users:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    users, episodes = np.concatenate(users), np.concatenate(episodes)
+    # Shards hold no catalog tables, so episodes are mapped to series here
+    known, inverse = np.unique(episodes, return_inverse=True)
+    series_of = catalog.episode_series_ids(known.tolist())
+    series = np.array([series_of.get(episode_id, -1) for episode_id in known.tolist()], dtype=np.int64)[inverse]
+    pairs = np.unique(np.stack([users, series], axis=1)[series >= 0], axis=0)
+    return pairs[:, 0], pairs[:, 1]
+
+
+def _store(items, neighbours, scores, counts, batch_size=1000):
+    """Replace content_similarity with the new neighbour lists."""
+    conn = get_mysql_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT NOW()")
+    run_started = cursor.fetchone()[0]
+    rows = (
+        (int(item), int(neighbour), float(score), '{"co_viewers": %d}' % count, run_started)
+        for item, item_neighbours, item_scores, item_counts in zip(items, neighbours, scores, counts)
+        for neighbour, score, count in zip(item_neighbours, item_scores, item_counts)
+        if neighbour >= 0
+    )
+    stored = 0
+    try:
+        while True:
+            chunk = list(islice(rows, batch_size))
+            if not chunk:
+                break
+            stored += len(chunk)
+            cursor.execute(
+                UPSERT_SIMILARITY.format(rows=", ".join(["(%s, %s, %s, %s, %s)"] * len(chunk))),
+                [value for row in chunk for value in row]
+            )
+            conn.commit()
+        while True:
+            cursor.execute(
+                "DELETE FROM content_similarity WHERE last_updated < %s LIMIT %s", (run_started, batch_size)
+            )
+            conn.commit()
+            if cursor.rowcount < batch_size:
+                break
+    finally:
+        cursor.close()
+        conn.close()
+    return stored
+
+
+def build():
+    """Recompute content_similarity from viewing_progress; returns run stats."""
+    started = time.perf_counter()
+    user_ids, series_ids = _load_interactions()
+    loaded = time.perf_counter()
+    items, neighbours, scores, counts = build_similarity(user_ids, series_ids)
+    computed = time.perf_counter()
+    stored = _store(items, neighbours, scores, counts)
+    return {
+        "interactions": len(user_ids),
+        "series": len(items),
+        "pairs_stored": stored,
+        "load_seconds": round(loaded - started, 3),
+        "compute_seconds": round(computed - loaded, 3),
+        "store_seconds": round(time.perf_counter() - computed, 3),
+    }
+
+
+def _table_version(cursor):
+    cursor.execute("SELECT COUNT(*), MAX(last_updated) FROM content_similarity")
+    return cursor.fetchone()
+
+
+def _read_index(cursor, batch_size=100_000):
+    """``{series_id: (neighbour ids, scores)}`` with both as NumPy array views."""
+    cursor.execute("""
+        SELECT content_id1, content_id2, similarity_score FROM content_similarity
+        ORDER BY content_id1, similarity_score DESC
+    """)
+    items, neighbours, scores = [], [], []
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        items.append(np.array([row[0] for row in rows], dtype=np.int64))
+        neighbours.append(np.array([row[1] for row in rows], dtype=np.int64))
+        scores.append(np.array([row[2] for row in rows], dtype=np.float32))
+    if not items:
+        return {}
+    items, neighbours, scores = np.concatenate(items), np.concatenate(neighbours), np.concatenate(scores)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(items)) + 1))
+    ends = np.concatenate((starts[1:], [len(items)]))
+    return {int(items[lo]): (neighbours[lo:hi], scores[lo:hi]) for lo, hi in zip(starts, ends)}
+
+
+def refresh_index(force=False):
+    """Reload the neighbour lists if content_similarity has changed; returns them."""
+    conn = get_mysql_connection()
+    cursor = conn.cursor()
+    try:
+        version = _table_version(cursor)
+        if force or version != _index["version"]:
+            # Built aside and swapped in, so readers see the old or the new lists
+            neighbours = _read_index(cursor)
+            _index.update(neighbours=neighbours, version=version)
+    finally:
+        cursor.close()
+        conn.close()
+    _index["checked_at"] = time.monotonic()
+    return _index["neighbours"]
+
+
+def current_index():
+    """The neighbour lists last loaded by the refresher (empty until the first load)."""
+    return _index["neighbours"]
+
+
+def _run():
+    while True:
+        try:
+            refresh_index()
+        except Exception:
+            logger.exception("Could not refresh the recommendation index")
+        if _stop.wait(settings.RECOMMENDATIONS_REFRESH):
+            return
+
+
+def start_refresher():
+    global _thread
+    if _thread is not None:
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_run, name="recommendations-refresh", daemon=True)
+    _thread.start()
+
+
+def stop_refresher():
+    global _thread
+    if _thread is None:
+        return
+    _stop.set()
+    _thread.join()
+    _thread = None
+
+
+def recent_series(user_id, limit=None):
+    """The user's most recently watched series, newest first."""
+    limit = limit or settings.RECOMMENDATIONS_HISTORY
+    with sharding.mysql_connection(sharding.owner(user_id)) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT episode_id FROM viewing_progress WHERE user_id = %s ORDER BY last_watched DESC LIMIT %s",
+            (user_id, limit * HISTORY_EPISODES_PER_SERIES)
+        )
+        episode_ids = [episode_id for episode_id, in cursor.fetchall()]
+        cursor.close()
+    series_of = catalog.episode_series_ids(episode_ids)
+    series_ids = []
+    for episode_id in episode_ids:
+        series_id = series_of.get(episode_id)
+        if series_id is not None and series_id not in series_ids:
+            series_ids.append(series_id)
+            if len(series_ids) >= limit:
+                break
+    return series_ids
+
+
+def blend(history, neighbours, limit):
+    """``[(series_id, score), ...]`` for the series most similar to ``history``."""
+    candidates, weights = [], []
+    for rank, series_id in enumerate(history):
+        entry = neighbours.get(series_id)
+        if entry is not None:
+            candidates.append(entry[0])
+            weights.append(entry[1] * settings.RECOMMENDATIONS_RECENCY_DECAY ** rank)
+    if not candidates:
+        return []
+    candidates, inverse = np.unique(np.concatenate(candidates), return_inverse=True)
+    totals = np.bincount(inverse, weights=np.concatenate(weights))
+    unseen = ~np.isin(candidates, history)
+    candidates, totals = candidates[unseen], totals[unseen]
+    best = np.argsort(-totals, kind="stable")[:limit]
+    return [(int(candidates[i]), float(totals[i])) for i in best]
+
+
+def recommend(user_id, limit=10):
+    history = recent_series(user_id)
+    ranking = blend(history, current_index(), limit)
+    if not ranking:
+        return trending.trending(limit)
+    summaries = catalog.series_summaries([series_id for series_id, _ in ranking])
+    return [
+        {**summaries.get(series_id, {"id": series_id}), "score": round(score, 4)}
+        for series_id, score in ranking
+    ]
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["build"]:
+        print(build())
+    else:
+        print("usage: python -m app.services.recommendations build")
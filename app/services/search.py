@@ -0,0 +1,579 @@
+"""Catalog search over an in-process inverted index.
+
+The documents are the app's ``series`` rows and, with
+``SEARCH_INCLUDE_PLATFORM``, the platform ``content`` rows together with all
+of their ``content_translations`` titles. Text is NFKC-normalized and
+case-folded and split into words; each document is indexed under its
+distinct words. The vocabulary is in turn indexed by character bigrams plus
+a ``^`` + first-character gram marking the start of a word. Bigrams need no
+dictionary or morphological analyzer, so Korean words with particles
+attached ("오징어게임을") and English are handled the same way.
+
+A query matches a document when every query word occurs in it. Each query
+word is first resolved against the vocabulary: its gram lists are
+intersected, rarest first, by binary search into the longer lists, and the
+few candidate words are checked since bigrams can match out of order. The
+word's documents are the union of those words' postings, and the query's
+documents the intersection over its words. Autocomplete treats the last word
+as a prefix: it only has to start a word. A one-character word always
+matches as a word start.
+
+The bulk of the corpus is a *base*: sorted NumPy postings arrays, plus
+per-document genre and year arrays, so facet counts are ``bincount``s over
+the matches. Writes don't touch the base. ``index_series`` tombstones the old
+version of a document and keeps the new one in a small *delta* that queries
+scan linearly. Once the delta passes ``SEARCH_DELTA_MAX`` documents, the base
+is rebuilt from memory in a background thread. Writes made during a rebuild
+are replayed onto the new index before it is swapped in.
+
+Every worker holds its own index, loaded and kept fresh by a refresher thread;
+requests only read the index it last published, and get a 503 until the first
+load is done. Writes in this worker apply immediately. Other workers see them
+when the catalog revision changes: the refresher re-reads the series rows
+updated since its last look (``series.updated_at``). It also reloads the whole
+index from MySQL every ``SEARCH_RELOAD_INTERVAL`` seconds, which is how
+platform content changes arrive.
+
+Documents are ranked by how their title matches: exact title, then title
+prefix, then words starting title words, then anywhere in the title, then
+other fields (translated titles, genre, description). Ties keep the base
+order of newest release year first. Only the first ``SEARCH_MAX_RANKED``
+candidates in that order are ranked, but ``total`` and the facets count
+every match.
+"""
+import logging
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from collections import Counter, namedtuple
+from itertools import islice
+import mysql.connector
+import numpy as np
+from ..core.config import settings
+from ..core.database import PoolTimeoutError, get_mysql_connection
+from . import catalog
+
+logger = logging.getLogger(__name__)
+
+WORD = re.compile(r"\w+")
+KINDS = ("series", "content")
+_EMPTY = np.zeros(0, dtype=np.int32)
+
+# ``text`` is " " + the document's words joined by spaces, so " w" in text
+# means some word starts with w; the title's words come first, up to
+# ``title_end``.
+Doc = namedtuple("Doc", "kind id title text title_end genre year")
+
+_state = {
+    "index": None,
+    "revision": None,
+    "series_seen": None,
+    "loaded_at": 0.0,
+    "journal": None,
+}
+_lock = threading.Lock()
+_thread = None
+_stop = threading.Event()
+
+
+def normalize(text):
+    return unicodedata.normalize("NFKC", text or "").casefold()
+
+
+def make_doc(kind, doc_id, title, genres=(), year=None, other_text=()):
+    title_words = WORD.findall(normalize(title))
+    words = list(title_words)
+    for text in (*genres, *other_text):
+        words.extend(WORD.findall(normalize(text)))
+    text = " " + " ".join(words)
+    title_end = len(" " + " ".join(title_words))
+    return Doc(kind, int(doc_id), title, text, title_end, genres[0] if genres else None, year)
+
+
+def _grams(word):
+    grams = {"^" + word[0]}
+    grams.update(word[i:i + 2] for i in range(len(word) - 1))
+    return grams
+
+
+def _query_terms(query, prefix_last=False):
+    """``[(word, as_prefix), ...]`` for the words in ``query``.
+
+    A prefix term must start a document word; any other must occur in one.
+    """
+    words = WORD.findall(normalize(query))
+    return [
+        (word, len(word) == 1 or (prefix_last and i == len(words) - 1))
+        for i, word in enumerate(words)
+    ]
+
+
+def _matches_text(terms, text):
+    return all((" " + word if as_prefix else word) in text for word, as_prefix in terms)
+
+
+def _postings(groups):
+    """Group ``(key, value)`` columns into sorted value arrays: ``(values, offsets)``."""
+    keys, values = np.frombuffer(groups[0], dtype=np.int32), np.frombuffer(groups[1], dtype=np.int32)
+    # Stable, so each key's values stay in the order they were added.
+    values = values[np.argsort(keys, kind="stable")]
+    offsets = np.zeros(groups[2] + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=groups[2]), out=offsets[1:])
+    return values, offsets
+
+
+def _intersect(arrays):
+    arrays = sorted(arrays, key=len)
+    found = arrays[0]
+    for other in arrays[1:]:
+        if not len(found):
+            break
+        at = np.minimum(np.searchsorted(other, found), len(other) - 1)
+        found = found[other[at] == found]
+    return found
+
+
+class _Base:
+    """Immutable postings and per-document columns for a list of documents."""
+
+    def __init__(self, docs):
+        # Newest first: this is the tie-break order of every result list.
+        docs.sort(key=lambda doc: (-(doc.year or 0), doc.kind, doc.id))
+        self.titles = [doc.title for doc in docs]
+        self.texts = [doc.text for doc in docs]
+        self.title_ends = array("i", [doc.title_end for doc in docs])
+        self.kinds = np.array([KINDS.index(doc.kind) for doc in docs], dtype=np.int8)
+        self.ids = np.array([doc.id for doc in docs], dtype=np.int64)
+        self.genres = sorted({doc.genre for doc in docs if doc.genre})
+        genre_codes = {genre: code for code, genre in enumerate(self.genres, 1)}
+        self.genre = np.array([genre_codes.get(doc.genre, 0) for doc in docs], dtype=np.int32)
+        self.year = np.array([doc.year or 0 for doc in docs], dtype=np.int32)
+
+        keys = (self.kinds.astype(np.int64) << 40) | self.ids
+        self._key_order = np.argsort(keys, kind="stable").astype(np.int32)
+        self._keys = keys[self._key_order]
+
+        word_ids = {}
+        word_column, doc_column = array("i"), array("i")
+        for number, text in enumerate(self.texts):
+            ids = {word_ids.setdefault(word, len(word_ids)) for word in text.split()}
+            word_column.extend(ids)
+            doc_column.extend([number] * len(ids))
+        self.words = list(word_ids)
+        self.postings, self._offsets = _postings((word_column, doc_column, len(word_ids)))
+
+        gram_ids = {}
+        gram_column, vocabulary_column = array("i"), array("i")
+        for word_id, word in enumerate(self.words):
+            ids = [gram_ids.setdefault(gram, len(gram_ids)) for gram in _grams(word)]
+            gram_column.extend(ids)
+            vocabulary_column.extend([word_id] * len(ids))
+        self._gram_words, offsets = _postings((gram_column, vocabulary_column, len(gram_ids)))
+        self.grams = {gram: (int(offsets[i]), int(offsets[i + 1])) for gram, i in gram_ids.items()}
+
+    def __len__(self):
+        return len(self.texts)
+
+    def position(self, kind, doc_id):
+        key = (KINDS.index(kind) << 40) | doc_id
+        i = int(np.searchsorted(self._keys, key))
+        if i < len(self._keys) and self._keys[i] == key:
+            return int(self._key_order[i])
+        return None
+
+    def doc(self, number):
+        genre = self.genres[self.genre[number] - 1] if self.genre[number] else None
+        return Doc(
+            KINDS[self.kinds[number]], int(self.ids[number]), self.titles[number], self.texts[number],
+            self.title_ends[number], genre, int(self.year[number]) or None,
+        )
+
+    def title(self, number):
+        return self.texts[number][:self.title_ends[number]]
+
+    def vocabulary(self, word, as_prefix):
+        """Ids of the indexed words that start with (``as_prefix``) or contain ``word``."""
+        grams = _grams(word) if as_prefix else _grams(word) - {"^" + word[0]}
+        lists = []
+        for gram in grams:
+            bounds = self.grams.get(gram)
+            if bounds is None:
+                return _EMPTY
+            lists.append(self._gram_words[bounds[0]:bounds[1]])
+        found = _intersect(lists)
+        # The grams are exact for one character (as a prefix) and for two
+        # (as a substring); longer words can match their bigrams out of order.
+        if len(word) > (1 if as_prefix else 2):
+            words = self.words
+            if as_prefix:
+                found = [i for i in found.tolist() if words[i].startswith(word)]
+            else:
+                found = [i for i in found.tolist() if word in words[i]]
+        return found
+
+    def matches(self, terms):
+        """Sorted document numbers containing every term."""
+        per_term = []
+        for word, as_prefix in terms:
+            word_ids = self.vocabulary(word, as_prefix)
+            if not len(word_ids):
+                return _EMPTY
+            offsets = self._offsets
+            lists = [self.postings[offsets[i]:offsets[i + 1]] for i in word_ids]
+            per_term.append(self._union(lists))
+        return _intersect(per_term)
+
+    def _union(self, lists):
+        if len(lists) == 1:
+            return lists[0]
+        merged = np.concatenate(lists)
+        if len(merged) < len(self) // 64:
+            return np.unique(merged)
+        # Large unions (short words, popular prefixes): a bitmap over the
+        # corpus is linear and cheaper than sorting.
+        seen = np.zeros(len(self), dtype=bool)
+        seen[merged] = True
+        return np.flatnonzero(seen).astype(np.int32)
+
+
+class _Index:
+    """A base plus the documents written since it was built; replaced, never mutated."""
+
+    def __init__(self, base, delta=None, removed=frozenset()):
+        self.base = base
+        self.delta = delta or {}
+        self.removed = removed
+        self.removed_array = np.array(sorted(removed), dtype=np.int32)
+
+    def current(self, kind, doc_id):
+        doc = self.delta.get((kind, doc_id))
+        if doc is not None:
+            return doc
+        number = self.base.position(kind, doc_id)
+        if number is None or number in self.removed:
+            return None
+        return self.base.doc(number)
+
+    def with_doc(self, doc):
+        if self.current(doc.kind, doc.id) == doc:
+            return self
+        number = self.base.position(doc.kind, doc.id)
+        removed = self.removed | {number} if number is not None else self.removed
+        return _Index(self.base, {**self.delta, (doc.kind, doc.id): doc}, removed)
+
+    def docs(self):
+        """Every live document, for rebuilding the base."""
+        docs = [self.base.doc(number) for number in range(len(self.base)) if number not in self.removed]
+        docs.extend(self.delta.values())
+        return docs
+
+    def find(self, terms):
+        """``(base numbers, delta docs)`` containing every term."""
+        numbers = self.base.matches(terms)
+        if len(self.removed_array) and len(numbers):
+            numbers = numbers[~np.isin(numbers, self.removed_array, assume_unique=True)]
+        return numbers, [doc for doc in self.delta.values() if _matches_text(terms, doc.text)]
+
+    def filter(self, numbers, extra, genre=None, year=None):
+        base = self.base
+        if genre is not None:
+            code = base.genres.index(genre) + 1 if genre in base.genres else -1
+            numbers = numbers[base.genre[numbers] == code]
+            extra = [doc for doc in extra if doc.genre == genre]
+        if year is not None:
+            numbers = numbers[base.year[numbers] == year]
+            extra = [doc for doc in extra if doc.year == year]
+        return numbers, extra
+
+    def facets(self, numbers, extra, genre=None, year=None):
+        """Genre and year counts; each applies the other's filter but not its own."""
+        base = self.base
+        by_year, by_year_extra = self.filter(numbers, extra, year=year)
+        counts = np.bincount(base.genre[by_year], minlength=len(base.genres) + 1)
+        genres = Counter({name: int(counts[code]) for code, name in enumerate(base.genres, 1) if counts[code]})
+        genres.update(doc.genre for doc in by_year_extra if doc.genre)
+
+        by_genre, by_genre_extra = self.filter(numbers, extra, genre=genre)
+        counts = np.bincount(base.year[by_genre])
+        years = Counter({int(value): int(counts[value]) for value in np.flatnonzero(counts) if value})
+        years.update(doc.year for doc in by_genre_extra if doc.year)
+        return {
+            "genre": dict(genres.most_common()),
+            "release_year": dict(sorted(years.items(), reverse=True)),
+        }
+
+
+def _title_rank(title, words):
+    phrase = " " + " ".join(words)
+    if title == phrase:
+        return 0
+    if title.startswith(phrase + " "):
+        return 1
+    if title.startswith(phrase):
+        return 2
+    if all(" " + word in title for word in words):
+        return 3
+    if all(word in title for word in words):
+        return 4
+    return 5
+
+
+def _ranked(index, numbers, extra, words, limit, max_rank=5):
+    """The best ``limit`` matches as ``Doc``s."""
+    base = index.base
+    scored = [
+        (_title_rank(base.title(number), words), i, number)
+        for i, number in enumerate(numbers[:settings.SEARCH_MAX_RANKED].tolist())
+    ]
+    scored.extend(
+        (_title_rank(doc.text[:doc.title_end], words), len(scored) + i, doc)
+        for i, doc in enumerate(extra)
+    )
+    scored.sort(key=lambda item: item[:2])
+    best = islice((match for rank, _, match in scored if rank <= max_rank), limit)
+    return [base.doc(match) if isinstance(match, int) else match for match in best]
+
+
+def _item(doc):
+    return {"type": doc.kind, "id": doc.id, "title": doc.title, "genre": doc.genre, "release_year": doc.year}
+
+
+def build_index(docs):
+    return _Index(_Base(docs))
+
+
+def search(query, genre=None, year=None, limit=20, index=None):
+    index = index or current_index()
+    terms = _query_terms(query)
+    if not terms:
+        return {"query": query, "total": 0, "items": [], "facets": {"genre": {}, "release_year": {}}}
+    numbers, extra = index.find(terms)
+    facets = index.facets(numbers, extra, genre, year)
+    numbers, extra = index.filter(numbers, extra, genre, year)
+    docs = _ranked(index, numbers, extra, [word for word, _ in terms], limit)
+    return {
+        "query": query,
+        "total": len(numbers) + len(extra),
+        "items": [_item(doc) for doc in docs],
+        "facets": facets,
+    }
+
+
+def autocomplete(prefix, limit=10, index=None):
+    """Distinct titles whose words start with ``prefix``'s, best matches first."""
+    index = index or current_index()
+    terms = _query_terms(prefix, prefix_last=True)
+    if not terms:
+        return []
+    numbers, extra = index.find(terms)
+    titles = []
+    # Several documents can share a title, so look a little past ``limit``.
+    for doc in _ranked(index, numbers, extra, [word for word, _ in terms], limit * 4, max_rank=3):
+        if doc.title not in titles:
+            titles.append(doc.title)
+            if len(titles) == limit:
+                break
+    return titles
+
+
+# Loading
+
+
+def _platform(name):
+    return f"{settings.PLATFORM_MYSQL_DATABASE}.{name}"
+
+
+def _series_doc(series_id, title, description, genre, release_year):
+    other = (description,) if settings.SEARCH_INDEX_DESCRIPTIONS and description else ()
+    return make_doc("series", series_id, title, (genre,) if genre else (), release_year, other)
+
+
+def _read_series(cursor, since=None, batch_size=10000):
+    """Series documents (updated at or after ``since``) and the latest ``updated_at`` seen."""
+    query = "SELECT id, title, description, genre, release_year, updated_at FROM series"
+    cursor.execute(query + (" WHERE updated_at >= %s" if since else ""), (since,) if since else ())
+    docs, seen = [], since
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        for series_id, title, description, genre, release_year, updated_at in rows:
+            docs.append(_series_doc(series_id, title, description, genre, release_year))
+            if seen is None or updated_at > seen:
+                seen = updated_at
+    return docs, seen
+
+
+def _read_content(cursor, batch_size=10000):
+    """Platform content documents, titled in every language they are translated to."""
+    cursor.execute(f"""
+        SELECT c.content_id, c.title, c.description, YEAR(c.release_date),
+            (SELECT GROUP_CONCAT(g.name ORDER BY g.name SEPARATOR '\\t')
+             FROM {_platform('content_genre')} cg JOIN {_platform('genre')} g ON g.genre_id = cg.genre_id
+             WHERE cg.content_id = c.content_id),
+            (SELECT GROUP_CONCAT(t.title SEPARATOR '\\t')
+             FROM {_platform('content_translations')} t WHERE t.content_id = c.content_id)
+        FROM {_platform('content')} c
+    """)
+    docs = []
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        for content_id, title, description, year, genres, translations in rows:
+            other = translations.split("\t") if translations else []
+            if settings.SEARCH_INDEX_DESCRIPTIONS and description:
+                other.append(description)
+            docs.append(make_doc("content", content_id, title, genres.split("\t") if genres else (), year, other))
+    return docs
+
+
+def _load():
+    """Every document from MySQL, plus the series watermark for catching up."""
+    conn = get_mysql_connection()
+    cursor = conn.cursor()
+    try:
+        # Taken before the read: with no series rows yet, catching up starts here.
+        cursor.execute("SELECT NOW()")
+        started, = cursor.fetchone()
+        docs, seen = _read_series(cursor)
+        if settings.SEARCH_INCLUDE_PLATFORM:
+            try:
+                docs.extend(_read_content(cursor))
+            except mysql.connector.Error:
+                logger.warning("Could not index platform content; searching series only", exc_info=True)
+    finally:
+        cursor.close()
+        conn.close()
+    return docs, seen or started
+
+
+def _apply(doc):
+    with _lock:
+        _state["index"] = _state["index"].with_doc(doc)
+        if _state["journal"] is not None:
+            _state["journal"].append(doc)
+        rebuild = len(_state["index"].delta) > settings.SEARCH_DELTA_MAX and _state["journal"] is None
+        if rebuild:
+            _state["journal"] = []
+    if rebuild:
+        threading.Thread(target=_rebuild, name="search-rebuild", daemon=True).start()
+
+
+def _swap(base, seen=None):
+    """Install ``base`` with the writes journaled while it was being built."""
+    with _lock:
+        index = _Index(base)
+        for doc in _state["journal"] or ():
+            index = index.with_doc(doc)
+        _state["index"] = index
+        _state["journal"] = None
+        if seen is not None:
+            _state["series_seen"] = seen
+            _state["loaded_at"] = time.monotonic()
+
+
+def _rebuild(reload=False):
+    try:
+        if reload:
+            docs, seen = _load()
+        else:
+            docs, seen = _state["index"].docs(), None
+        _swap(_Base(docs), seen)
+    except Exception:
+        logger.exception("Search index rebuild failed")
+        with _lock:
+            _state["journal"] = None
+            _state["loaded_at"] = time.monotonic()
+
+
+def _catch_up(revision):
+    """Index the series other workers changed since our last look."""
+    try:
+        conn = get_mysql_connection()
+        cursor = conn.cursor()
+        try:
+            docs, seen = _read_series(cursor, since=_state["series_seen"])
+        finally:
+            cursor.close()
+            conn.close()
+        for doc in docs:
+            _apply(doc)
+        _state.update(revision=revision, series_seen=seen)
+    except (mysql.connector.Error, PoolTimeoutError):
+        logger.warning("Could not refresh the search index", exc_info=True)
+
+
+def refresh():
+    """Load, reload or catch up the index as needed; run by the refresher thread."""
+    revision = catalog.current_revision()
+    if _state["index"] is None:
+        docs, seen = _load()
+        _state.update(index=build_index(docs), revision=revision, series_seen=seen,
+                      loaded_at=time.monotonic())
+        return
+    if time.monotonic() - _state["loaded_at"] > settings.SEARCH_RELOAD_INTERVAL:
+        with _lock:
+            reload = _state["journal"] is None
+            if reload:
+                _state["journal"] = []
+        if reload:
+            _rebuild(reload=True)
+    if revision != _state["revision"]:
+        _catch_up(revision)
+
+
+def current_index():
+    """The index last published by the refresher, or None before the first load."""
+    return _state["index"]
+
+
+def _run():
+    while True:
+        try:
+            refresh()
+        except Exception:
+            logger.exception("Could not refresh the search index")
+        if _stop.wait(settings.CATALOG_REVISION_POLL):
+            return
+
+
+def start_refresher():
+    global _thread
+    if _thread is not None:
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_run, name="search-refresh", daemon=True)
+    _thread.start()
+
+
+def stop_refresher():
+    global _thread
+    if _thread is None:
+        return
+    _stop.set()
+    _thread.join()
+    _thread = None
+
+
+def index_series(series_id, title, description, genre, release_year):
+    """Make a series write searchable in this worker right away; call after commit."""
+    if _state["index"] is not None:
+        _apply(_series_doc(series_id, title, description, genre, release_year))
+
+
+def index_stats():
+    index = _state["index"]
+    if index is None:
+        return {"documents": 0, "ready": False}
+    return {
+        "ready": True,
+        "documents": len(index.base) - len(index.removed) + len(index.delta),
+        "words": len(index.base.words),
+        "grams": len(index.base.grams),
+        "postings": len(index.base.postings),
+        "delta": len(index.delta),
+        "rebuilding": _state["journal"] is not None,
+    }
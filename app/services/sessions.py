@@ -0,0 +1,80 @@
+"""Concurrent-stream limiter built on per-session leases.
+
+Each user has a sorted set ``viewing_sessions:{user_id}`` whose members are
+session ids scored by lease expiry (ms since epoch, from the Redis clock).
+Acquiring a stream is a single Lua script that prunes expired leases
+(``ZREMRANGEBYSCORE``, O(log n + pruned)), checks the plan's limit and adds
+the new lease, so two devices racing for the last slot cannot both get it.
+Players renew their lease with ``heartbeat``; a crashed player's lease simply
+expires after ``SESSION_LEASE_SECONDS`` and frees its slot.
+"""
+import uuid
+from ..core.config import settings
+from ..core.database import get_redis
+
+SESSIONS_KEY = "viewing_sessions:{}"
+
+# KEYS: sessions zset. ARGV: session id, stream limit, lease ms
+ACQUIRE = """
+local t = redis.call('TIME')
+local now = t[1] * 1000 + math.floor(t[2] / 1000)
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), ARGV[1])
+redis.call('PEXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+
+# KEYS: sessions zset. ARGV: session id, lease ms
+HEARTBEAT = """
+local t = redis.call('TIME')
+local now = t[1] * 1000 + math.floor(t[2] / 1000)
+local expires = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if not expires or tonumber(expires) <= now then
+    redis.call('ZREM', KEYS[1], ARGV[1])
+    return 0
+end
+redis.call('ZADD', KEYS[1], 'XX', now + tonumber(ARGV[2]), ARGV[1])
+redis.call('PEXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+_scripts = {}
+
+
+def _script(r, name, source):
+    if name not in _scripts:
+        _scripts[name] = r.register_script(source)
+    return _scripts[name]
+
+
+def stream_limit(plan_type):
+    return settings.STREAM_LIMITS.get(plan_type, 0)
+
+
+def acquire(user_id, episode_id, plan_type):
+    """Start a stream; returns the session id, or None when the plan's limit is reached."""
+    session_id = f"{user_id}:{episode_id}:{uuid.uuid4().hex[:12]}"
+    r = get_redis()
+    acquired = _script(r, "acquire", ACQUIRE)(
+        keys=[SESSIONS_KEY.format(user_id)],
+        args=[session_id, stream_limit(plan_type), settings.SESSION_LEASE_SECONDS * 1000],
+        client=r
+    )
+    return session_id if acquired else None
+
+
+def heartbeat(user_id, session_id):
+    """Extend a live lease; False when it already expired and must be re-acquired."""
+    r = get_redis()
+    return bool(_script(r, "heartbeat", HEARTBEAT)(
+        keys=[SESSIONS_KEY.format(user_id)],
+        args=[session_id, settings.SESSION_LEASE_SECONDS * 1000],
+        client=r
+    ))
+
+
+def release(user_id, session_id):
+    get_redis().zrem(SESSIONS_KEY.format(user_id), session_id)
@@ -0,0 +1,404 @@
+"""Incrementally maintained replacements for the analytics views.
+
+The ``content_popularity``, ``user_engagement`` and ``subscription_metrics``
+views in ``sql/create_database.sql`` re-aggregate the whole history on every
+query. Because they join ``view_history`` and ``review`` together, each
+review is also counted once per view (and each view once per review). The
+summary tables from ``sql/migrations/002_analytics_summaries.sql`` hold the
+same metrics, counted correctly, and are kept current as data arrives:
+
+* ``review`` and ``subscription`` writes are applied by triggers, in the
+  writing transaction.
+* ``view_history`` is insert-heavy, so instead of a per-row trigger,
+  ``apply_deltas`` folds new rows in by ``view_id``. Chunks of
+  ``SUMMARY_DELTA_CHUNK`` ids are applied, together with the new
+  high-water mark, in one transaction each.
+  An id range is only applied ``SUMMARY_SETTLE_SECONDS`` after it was
+  first seen, so rows from transactions that were still open then (and
+  commit out of id order) are not skipped.
+
+View metrics count every view ever recorded, including rows the archiver has
+since moved to ``view_history_archive``.
+
+    python -m app.services.summaries delta     # one pass (run from cron)
+    python -m app.services.summaries watch     # every SUMMARY_DELTA_INTERVAL seconds
+    python -m app.services.summaries rebuild   # full recompute (initial seed / repair)
+    python -m app.services.summaries check     # compare with a full recompute
+
+Run a single delta/watch process at a time.
+"""
+import json
+import sys
+import time
+from decimal import Decimal
+from ..core.config import settings
+from ..core.database import connect_platform, get_mysql_connection
+
+WATERMARK = "view_history"
+
+
+def _table(name):
+    return f"{settings.PLATFORM_MYSQL_DATABASE}.{name}"
+
+
+# -- delta job -------------------------------------------------------------
+
+DELTA_STATEMENTS = (
+    # Views and watch time per content
+    """
+    INSERT INTO content_popularity_summary (content_id, view_count, watch_duration_total, watch_duration_count)
+    SELECT content_id, COUNT(*), IFNULL(SUM(watch_duration), 0), COUNT(watch_duration)
+    FROM view_history WHERE view_id > %(lo)s AND view_id <= %(hi)s AND content_id IS NOT NULL
+    GROUP BY content_id
+    ON DUPLICATE KEY UPDATE
+        view_count = view_count + VALUES(view_count),
+        watch_duration_total = watch_duration_total + VALUES(watch_duration_total),
+        watch_duration_count = watch_duration_count + VALUES(watch_duration_count)
+    """,
+    # Viewers not seen before for each content, counted before recording them
+    """
+    INSERT INTO content_popularity_summary (content_id, unique_viewers)
+    SELECT chunk.content_id, COUNT(*)
+    FROM (
+        SELECT DISTINCT content_id, user_id FROM view_history
+        WHERE view_id > %(lo)s AND view_id <= %(hi)s AND content_id IS NOT NULL AND user_id IS NOT NULL
+    ) chunk
+    LEFT JOIN content_viewers cv ON cv.content_id = chunk.content_id AND cv.user_id = chunk.user_id
+    WHERE cv.content_id IS NULL
+    GROUP BY chunk.content_id
+    ON DUPLICATE KEY UPDATE unique_viewers = unique_viewers + VALUES(unique_viewers)
+    """,
+    """
+    INSERT IGNORE INTO content_viewers (content_id, user_id)
+    SELECT DISTINCT content_id, user_id FROM view_history
+    WHERE view_id > %(lo)s AND view_id <= %(hi)s AND content_id IS NOT NULL AND user_id IS NOT NULL
+    """,
+    # Views and watch time per user
+    """
+    INSERT INTO user_engagement_summary (user_id, total_views, total_watch_time)
+    SELECT user_id, COUNT(*), IFNULL(SUM(watch_duration), 0)
+    FROM view_history WHERE view_id > %(lo)s AND view_id <= %(hi)s AND user_id IS NOT NULL
+    GROUP BY user_id
+    ON DUPLICATE KEY UPDATE
+        total_views = total_views + VALUES(total_views),
+        total_watch_time = total_watch_time + VALUES(total_watch_time)
+    """,
+    "UPDATE summary_watermarks SET last_id = %(hi)s WHERE name = '" + WATERMARK + "'",
+)
+
+
+def apply_deltas(conn=None, chunk_size=None):
+    """Fold settled new view_history rows into the summaries; returns rows applied."""
+    chunk_size = chunk_size or settings.SUMMARY_DELTA_CHUNK
+    own_connection = conn is None
+    conn = conn or connect_platform()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "INSERT IGNORE INTO summary_watermarks (name, last_id, observed_id) VALUES (%s, 0, 0)", (WATERMARK,)
+        )
+        cursor.execute("""
+            SELECT last_id, observed_id, observed_at <= NOW() - INTERVAL %s SECOND
+            FROM summary_watermarks WHERE name = %s
+        """, (settings.SUMMARY_SETTLE_SECONDS, WATERMARK))
+        last_id, observed_id, settled = cursor.fetchone()
+        conn.commit()
+
+        applied = 0
+        if settled:
+            lo = last_id
+            while lo < observed_id:
+                hi = min(lo + chunk_size, observed_id)
+                for statement in DELTA_STATEMENTS:
+                    cursor.execute(statement, {"lo": lo, "hi": hi})
+                conn.commit()
+                applied += hi - lo
+                lo = hi
+
+        # Whatever exists now becomes eligible once it has settled.
+        if settled or observed_id <= last_id:
+            cursor.execute("SELECT IFNULL(MAX(view_id), 0) FROM view_history")
+            current = cursor.fetchone()[0]
+            cursor.execute(
+                "UPDATE summary_watermarks SET observed_id = GREATEST(%s, last_id), observed_at = NOW() "
+                "WHERE name = %s",
+                (current, WATERMARK)
+            )
+            conn.commit()
+        return applied
+    finally:
+        cursor.close()
+        if own_connection:
+            conn.close()
+
+
+def watch():
+    while True:
+        started = time.monotonic()
+        applied = apply_deltas()
+        if applied:
+            print(f"Applied {applied} view ids", flush=True)
+        time.sleep(max(0.0, settings.SUMMARY_DELTA_INTERVAL - (time.monotonic() - started)))
+
+
+# -- full recompute --------------------------------------------------------
+
+def _history(upto):
+    """All views up to ``upto``, whether still in view_history or archived."""
+    return f"""
+        (SELECT view_id, content_id, user_id, watch_duration FROM view_history WHERE view_id <= {int(upto)}
+         UNION ALL
+         SELECT view_id, content_id, user_id, watch_duration FROM view_history_archive WHERE view_id <= {int(upto)})
+    """
+
+
+def recompute(cursor, upto):
+    """Fresh values for every summary row, as ``{table: {key: tuple}}``."""
+    content = {}
+    cursor.execute(f"""
+        SELECT content_id, COUNT(DISTINCT user_id), COUNT(*), IFNULL(SUM(watch_duration), 0), COUNT(watch_duration)
+        FROM {_history(upto)} h WHERE content_id IS NOT NULL GROUP BY content_id
+    """)
+    for content_id, viewers, views, duration_total, duration_count in cursor.fetchall():
+        content[content_id] = [viewers, views, duration_total, duration_count, 0, 0, 0]
+    cursor.execute("""
+        SELECT content_id, COUNT(*), IFNULL(SUM(rating), 0), COUNT(rating)
+        FROM review WHERE content_id IS NOT NULL GROUP BY content_id
+    """)
+    for content_id, reviews, rating_total, rating_count in cursor.fetchall():
+        content.setdefault(content_id, [0, 0, 0, 0, 0, 0, 0])[4:] = [reviews, rating_total, rating_count]
+
+    users = {}
+    cursor.execute(f"""
+        SELECT user_id, COUNT(*), IFNULL(SUM(watch_duration), 0)
+        FROM {_history(upto)} h WHERE user_id IS NOT NULL GROUP BY user_id
+    """)
+    for user_id, views, watch_time in cursor.fetchall():
+        users[user_id] = [views, watch_time, 0]
+    cursor.execute("SELECT user_id, COUNT(*) FROM review WHERE user_id IS NOT NULL GROUP BY user_id")
+    for user_id, reviews in cursor.fetchall():
+        users.setdefault(user_id, [0, 0, 0])[2] = reviews
+
+    plans = {}
+    cursor.execute("""
+        SELECT IFNULL(plan_name, ''), COUNT(*), COUNT(CASE WHEN is_active = 1 THEN 1 END),
+               IFNULL(SUM(CASE WHEN is_active = 1 THEN price END), 0),
+               COUNT(CASE WHEN is_active = 1 THEN price END)
+        FROM subscription GROUP BY IFNULL(plan_name, '')
+    """)
+    for plan_name, *values in cursor.fetchall():
+        plans[plan_name] = values
+
+    return {
+        "content_popularity_summary": {key: tuple(values) for key, values in content.items()},
+        "user_engagement_summary": {key: tuple(values) for key, values in users.items()},
+        "subscription_metrics_summary": {key: tuple(values) for key, values in plans.items()},
+    }
+
+
+SUMMARY_COLUMNS = {
+    "content_popularity_summary": ("content_id", (
+        "unique_viewers", "view_count", "watch_duration_total", "watch_duration_count",
+        "review_count", "rating_total", "rating_count",
+    )),
+    "user_engagement_summary": ("user_id", ("total_views", "total_watch_time", "review_count")),
+    "subscription_metrics_summary": ("plan_name", (
+        "total_subscriptions", "active_subscriptions", "active_price_total", "active_price_count",
+    )),
+}
+
+
+def _stored(cursor, table):
+    key, columns = SUMMARY_COLUMNS[table]
+    cursor.execute(f"SELECT {key}, {', '.join(columns)} FROM {table}")
+    return {row[0]: tuple(row[1:]) for row in cursor.fetchall()}
+
+
+def _normalize(values):
+    return tuple(int(value) if isinstance(value, Decimal) and value == int(value) else value for value in values)
+
+
+def check(limit=20):
+    """Compare every summary row against a full recompute.
+
+    Views are compared up to the applied high-water mark only, since newer
+    rows are expected to be pending. Returns the number of mismatched rows
+    per table and up to ``limit`` examples of each.
+    """
+    conn = connect_platform()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT")
+        cursor.execute("SELECT IFNULL(MAX(last_id), 0) FROM summary_watermarks WHERE name = %s", (WATERMARK,))
+        upto = cursor.fetchone()[0]
+        expected = recompute(cursor, upto)
+        report = {"checked_up_to_view_id": upto, "tables": {}}
+        for table, fresh in expected.items():
+            stored = _stored(cursor, table)
+            empty = (0,) * len(SUMMARY_COLUMNS[table][1])
+            mismatches = []
+            for key in fresh.keys() | stored.keys():
+                want = _normalize(fresh.get(key, empty))
+                have = _normalize(stored.get(key, empty))
+                if want != have:
+                    mismatches.append({"key": key, "expected": want, "stored": have})
+            report["tables"][table] = {
+                "rows": len(fresh),
+                "mismatched": len(mismatches),
+                "examples": mismatches[:limit],
+            }
+        conn.rollback()
+        return report
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def rebuild():
+    """Recompute every summary from scratch (initial seed, or repair after ``check``).
+
+    Run it while reviews and subscriptions are quiet: trigger updates that
+    land between the recompute and the swap are lost until the next rebuild.
+    """
+    conn = connect_platform()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT IFNULL(MAX(view_id), 0) FROM view_history")
+        upto = cursor.fetchone()[0]
+        expected = recompute(cursor, upto)
+        for table, rows in expected.items():
+            key, columns = SUMMARY_COLUMNS[table]
+            cursor.execute(f"DELETE FROM {table}")
+            items = list(rows.items())
+            for start in range(0, len(items), 1000):
+                chunk = items[start:start + 1000]
+                cursor.execute(
+                    f"INSERT INTO {table} ({key}, {', '.join(columns)}) VALUES "
+                    + ", ".join(["(" + ", ".join(["%s"] * (len(columns) + 1)) + ")"] * len(chunk)),
+                    [value for item_key, values in chunk for value in (item_key, *values)]
+                )
+        cursor.execute("DELETE FROM content_viewers")
+        cursor.execute(f"""
+            INSERT INTO content_viewers (content_id, user_id)
+            SELECT DISTINCT content_id, user_id FROM {_history(upto)} h
+            WHERE content_id IS NOT NULL AND user_id IS NOT NULL
+        """)
+        cursor.execute("""
+            INSERT INTO summary_watermarks (name, last_id, observed_id, observed_at) VALUES (%s, %s, %s, NOW())
+            ON DUPLICATE KEY UPDATE last_id = VALUES(last_id), observed_id = VALUES(observed_id), observed_at = NOW()
+        """, (WATERMARK, upto, upto))
+        conn.commit()
+        return {table: len(rows) for table, rows in expected.items()}
+    finally:
+        cursor.close()
+        conn.close()
+
+
+# -- reads (API) -----------------------------------------------------------
+
+def _popularity_row(row):
+    return {
+        "content_id": row["content_id"],
+        "title": row["title"],
+        "unique_viewers": row["unique_viewers"],
+        "view_count": row["view_count"],
+        "avg_watch_duration": (
+            row["watch_duration_total"] / row["watch_duration_count"] if row["watch_duration_count"] else None
+        ),
+        "review_count": row["review_count"],
+        "avg_rating": row["rating_total"] / row["rating_count"] if row["rating_count"] else None,
+    }
+
+
+POPULARITY_SELECT = """
+    SELECT s.*, c.title FROM {summary} s JOIN {content} c ON c.content_id = s.content_id
+"""
+
+
+def content_popularity(limit, after=None):
+    """Most-watched content first (by unique viewers), keyset-paginated."""
+    with get_mysql_connection(read_only=True) as conn:
+        cursor = conn.cursor(dictionary=True)
+        query = POPULARITY_SELECT.format(summary=_table("content_popularity_summary"), content=_table("content"))
+        params = []
+        if after is not None:
+            query += " WHERE (s.unique_viewers, s.content_id) < (%s, %s)"
+            params += [after["unique_viewers"], after["content_id"]]
+        query += " ORDER BY s.unique_viewers DESC, s.content_id DESC LIMIT %s"
+        cursor.execute(query, params + [limit + 1])
+        rows = [_popularity_row(row) for row in cursor.fetchall()]
+        cursor.close()
+    return rows
+
+
+def content_popularity_for(content_id):
+    with get_mysql_connection(read_only=True) as conn:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(
+            POPULARITY_SELECT.format(summary=_table("content_popularity_summary"), content=_table("content"))
+            + " WHERE s.content_id = %s",
+            (content_id,)
+        )
+        row = cursor.fetchone()
+        if row is None:
+            # Content nobody has watched or reviewed yet has no summary row.
+            cursor.execute(f"SELECT content_id, title FROM {_table('content')} WHERE content_id = %s", (content_id,))
+            row = cursor.fetchone()
+            if row is not None:
+                row.update(unique_viewers=0, view_count=0, watch_duration_total=0, watch_duration_count=0,
+                           review_count=0, rating_total=0, rating_count=0)
+        cursor.close()
+    return _popularity_row(row) if row else None
+
+
+def user_engagement(user_id):
+    with get_mysql_connection(read_only=True) as conn:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(f"""
+            SELECT u.user_id, u.username, DATEDIFF(NOW(), u.created_at) AS days_since_signup,
+                   IFNULL(s.total_views, 0) AS total_views,
+                   IFNULL(s.total_watch_time, 0) AS total_watch_time,
+                   IFNULL(s.review_count, 0) AS review_count
+            FROM {_table('user')} u
+            LEFT JOIN {_table('user_engagement_summary')} s ON s.user_id = u.user_id
+            WHERE u.user_id = %s
+        """, (user_id,))
+        row = cursor.fetchone()
+        cursor.close()
+    return row
+
+
+def subscription_metrics():
+    with get_mysql_connection(read_only=True) as conn:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(f"SELECT * FROM {_table('subscription_metrics_summary')} ORDER BY plan_name")
+        rows = [
+            {
+                "plan_name": row["plan_name"] or None,
+                "total_subscriptions": row["total_subscriptions"],
+                "active_subscriptions": row["active_subscriptions"],
+                "avg_active_price": (
+                    row["active_price_total"] / row["active_price_count"] if row["active_price_count"] else None
+                ),
+            }
+            for row in cursor.fetchall()
+        ]
+        cursor.close()
+    return rows
+
+
+if __name__ == "__main__":
+    command = sys.argv[1:]
+    if command == ["delta"]:
+        print(f"Applied {apply_deltas()} view ids")
+    elif command == ["watch"]:
+        watch()
+    elif command == ["rebuild"]:
+        print(json.dumps(rebuild()))
+    elif command == ["check"]:
+        report = check()
+        print(json.dumps(report, indent=2, default=str))
+        sys.exit(1 if any(table["mismatched"] for table in report["tables"].values()) else 0)
+    else:
+        print("usage: python -m app.services.summaries delta|watch|rebuild|check")
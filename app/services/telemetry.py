@@ -0,0 +1,287 @@
+"""Bulk ingestion of player telemetry into ``viewing_logs`` and ``user_behaviors``.
+
+``POST /api/telemetry/{collection}`` accepts either
+
+* ``application/x-ndjson``: one JSON event per line, or
+* ``application/msgpack``: a stream of msgpack maps (one event each) or
+  arrays of maps (a batch each).
+
+The body is parsed while it streams in, so at most ``TELEMETRY_CHUNK_SIZE``
+events are held at a time, plus one partial NDJSON line (at most
+``TELEMETRY_MAX_EVENT_BYTES``; longer lines are rejected) or msgpack object
+(at most ``TELEMETRY_MSGPACK_BUFFER_BYTES``). Each chunk is validated
+against the collection's ``$jsonSchema`` (compiled once into plain Python
+checks, see ``_compile``) and written with one unordered ``insert_many`` on
+the threadpool. Documents that fail validation or the insert are reported by
+their 0-based position in the request body; the rest are stored.
+
+Timestamps are ISO 8601 strings or epoch seconds in JSON, and either of those
+or the msgpack timestamp extension in msgpack. ``user_id`` defaults to the
+caller and must match it when given.
+"""
+from datetime import datetime, timezone
+import json
+import msgpack
+from bson.errors import InvalidDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from starlette.concurrency import run_in_threadpool
+from ..core import sharding
+from ..core.config import settings
+from ..core.database import get_mongo_client
+from ..models.schemas import user_behaviors_schema, viewing_logs_schema
+from . import analytics
+
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+
+
+class InvalidEvent(ValueError):
+    pass
+
+
+class LineTooLong:
+    """Placeholder yielded for an NDJSON line over the size limit."""
+
+
+def _to_datetime(value):
+    if isinstance(value, datetime):
+        pass
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        try:
+            value = datetime.fromtimestamp(value, timezone.utc)
+        except (OverflowError, OSError, ValueError):  # out of range, or NaN
+            raise InvalidEvent("timestamp out of range")
+    elif isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            raise InvalidEvent("not an ISO 8601 timestamp")
+    else:
+        raise InvalidEvent("expected a timestamp")
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _check_int(value):
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise InvalidEvent("expected an integer")
+    if not -2**31 <= value < 2**31:
+        raise InvalidEvent("integer out of range")
+    return value
+
+
+def _check_double(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise InvalidEvent("expected a number")
+    return float(value)
+
+
+def _check_type(python_type, name):
+    def check(value):
+        if not isinstance(value, python_type):
+            raise InvalidEvent(f"expected {name}")
+        return value
+    return check
+
+
+BSON_TYPES = {
+    "int": _check_int,
+    "double": _check_double,
+    "date": _to_datetime,
+    "object": _check_type(dict, "an object"),
+    "string": _check_type(str, "a string"),
+}
+
+
+def _compile(schema):
+    """Turn a ``$jsonSchema`` validator into ``(required, {field: check})``."""
+    checks = {}
+    for field, rule in schema["properties"].items():
+        if "enum" in rule:
+            allowed = frozenset(rule["enum"])
+
+            def check(value, allowed=allowed):
+                if not isinstance(value, str) or value not in allowed:
+                    raise InvalidEvent(f"must be one of {sorted(allowed)}")
+                return value
+        else:
+            check = BSON_TYPES[rule["bsonType"]]
+        checks[field] = check
+    return tuple(schema["required"]), checks
+
+
+COLLECTIONS = {
+    "viewing_logs": _compile(viewing_logs_schema),
+    "user_behaviors": _compile(user_behaviors_schema),
+}
+
+
+def validate(collection, event, user_id):
+    """Return the document to insert for ``event`` or raise ``InvalidEvent``."""
+    if not isinstance(event, dict):
+        raise InvalidEvent("event must be an object")
+    event.setdefault("user_id", user_id)
+    if event["user_id"] != user_id:
+        raise InvalidEvent("user_id does not match the authenticated user")
+    required, checks = COLLECTIONS[collection]
+    for field in required:
+        if field not in event:
+            raise InvalidEvent(f"{field}: field required")
+    for field, check in checks.items():
+        if field in event:
+            try:
+                event[field] = check(event[field])
+            except InvalidEvent as exc:
+                raise InvalidEvent(f"{field}: {exc}")
+    return event
+
+
+class IngestResult:
+    def __init__(self):
+        self.received = 0
+        self.inserted = 0
+        self.rejected = 0
+        self.errors = []
+        self.aborted = None
+
+    def reject(self, index, error):
+        self.rejected += 1
+        if len(self.errors) < settings.TELEMETRY_MAX_ERRORS:
+            self.errors.append({"index": index, "error": error})
+
+    def as_dict(self):
+        return {
+            "received": self.received,
+            "inserted": self.inserted,
+            "rejected": self.rejected,
+            "errors": self.errors,
+            "errors_truncated": self.rejected > len(self.errors),
+            "aborted": self.aborted,
+        }
+
+
+def _insert_each(target, documents, positions, failed, result):
+    for i, document in enumerate(documents):
+        try:
+            target.insert_one(document, bypass_document_validation=True)
+        except DuplicateKeyError:
+            pass  # already stored by the batch that failed
+        except InvalidDocument as exc:
+            failed.add(i)
+            result.reject(positions[i], f"not storable: {exc}")
+
+
+def _write_chunk(collection, items, first_index, user_id, result):
+    documents, positions = [], []
+    for offset, item in enumerate(items):
+        index = first_index + offset
+        try:
+            if item is LineTooLong:
+                raise InvalidEvent(f"event exceeds {settings.TELEMETRY_MAX_EVENT_BYTES} bytes")
+            if isinstance(item, bytes):
+                try:
+                    item = json.loads(item)
+                except ValueError as exc:
+                    raise InvalidEvent(f"invalid JSON: {exc}")
+            documents.append(validate(collection, item, user_id))
+            positions.append(index)
+        except InvalidEvent as exc:
+            result.reject(index, str(exc))
+    if not documents:
+        return
+
+    db = get_mongo_client()[settings.MONGO_DATABASE]
+    # Every event belongs to the caller, so a viewing_logs chunk goes to one shard
+    # (plus the next one while the user is being moved, see app/core/sharding.py)
+    shards = sharding.write_shards(user_id) if collection == "viewing_logs" else [sharding.MAIN]
+    target = sharding.mongo_db(shards[0])[collection]
+    failed = set()
+    try:
+        # Already checked against the same $jsonSchema above.
+        target.insert_many(documents, ordered=False, bypass_document_validation=True)
+    except BulkWriteError as exc:
+        for error in exc.details["writeErrors"]:
+            failed.add(error["index"])
+            result.reject(positions[error["index"]], error["errmsg"])
+    except InvalidDocument:
+        # Not encodable as BSON (e.g. msgpack maps with non-string keys); find the culprits
+        _insert_each(target, documents, positions, failed, result)
+    stored = [document for i, document in enumerate(documents) if i not in failed]
+    result.inserted += len(stored)
+    for shard in shards[1:]:
+        if stored:
+            # Same _ids as on the owner, so the move's copy step skips them
+            sharding.mongo_db(shard)[collection].insert_many(stored, ordered=False, bypass_document_validation=True)
+    if collection == "viewing_logs" and stored:
+        analytics.apply_events(db, stored)
+
+
+async def ndjson_items(stream):
+    """Yield each non-empty line of an NDJSON body as raw bytes."""
+    limit = settings.TELEMETRY_MAX_EVENT_BYTES
+    buffer, skipping = b"", False
+    async for chunk in stream:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if skipping:
+                skipping = False
+            elif len(line) > limit:
+                yield LineTooLong
+            elif line.strip():
+                yield line
+        if len(buffer) > limit:
+            if not skipping:
+                yield LineTooLong
+            buffer, skipping = b"", True
+    if buffer.strip() and not skipping:
+        yield buffer
+
+
+async def msgpack_items(stream):
+    """Yield events from a stream of msgpack maps or arrays of maps.
+
+    A malformed body, or one top-level object larger than
+    ``TELEMETRY_MSGPACK_BUFFER_BYTES``, raises ``msgpack.UnpackException``;
+    unlike a bad NDJSON line it cannot be skipped.
+    """
+    unpacker = msgpack.Unpacker(raw=False, timestamp=3, max_buffer_size=settings.TELEMETRY_MSGPACK_BUFFER_BYTES)
+    async for chunk in stream:
+        unpacker.feed(chunk)
+        for obj in unpacker:
+            if isinstance(obj, list):
+                for event in obj:
+                    yield event
+            else:
+                yield obj
+
+
+async def ingest(collection, items, user_id):
+    """Validate and store ``items`` chunk by chunk; returns an ``IngestResult``.
+
+    If the body turns out to be malformed part-way through, the events before
+    that point are still stored and ``result.aborted`` says why the rest were
+    not.
+    """
+    result = IngestResult()
+    chunk = []
+    items = items.__aiter__()
+    while True:
+        # Only reading the body is guarded; a failure storing a chunk is not a malformed body
+        try:
+            item = await items.__anext__()
+        except StopAsyncIteration:
+            break
+        except (msgpack.UnpackException, ValueError) as exc:
+            result.aborted = f"malformed body after event {result.received + len(chunk)}: {exc!r}"
+            break
+        chunk.append(item)
+        if len(chunk) >= settings.TELEMETRY_CHUNK_SIZE:
+            await run_in_threadpool(_write_chunk, collection, chunk, result.received, user_id, result)
+            result.received += len(chunk)
+            chunk = []
+    if chunk:
+        await run_in_threadpool(_write_chunk, collection, chunk, result.received, user_id, result)
+        result.received += len(chunk)
+    return result
@@ -0,0 +1,157 @@
+"""Incrementally maintained trending ranking.
+
+Every viewing heartbeat counts the (user, series) pair once per hour into an
+hourly sorted set ``trending:bucket:{hour}``; a per-hour ``SET NX`` marker
+keeps a user's repeated heartbeats from inflating a series. The ranking for
+the last ``TRENDING_WINDOW_HOURS`` is a ``ZUNIONSTORE`` over those buckets,
+each weighted by ``TRENDING_DECAY ** age_in_hours``, cached in
+``trending:current`` for ``TRENDING_CACHE_TTL`` seconds.
+
+Only one worker rebuilds ``trending:current`` at a time (Redis ``SET NX``
+lock, plus a local lock for threads in the same process); the others keep
+serving the previous ranking or wait briefly for the new one.
+
+After deploying onto an existing database, seed the buckets once from
+``viewing_progress`` (on every shard) with
+``python -m app.services.trending backfill``.
+"""
+import sys
+import threading
+import time
+from collections import Counter
+import redis
+from ..core import sharding
+from ..core.config import settings
+from ..core.database import get_redis
+from . import catalog
+
+BUCKET_KEY = "trending:bucket:{}"
+SEEN_KEY = "trending:seen:{}:{}:{}"
+CURRENT_KEY = "trending:current"
+REBUILD_LOCK_KEY = "trending:rebuild:lock"
+
+# KEYS: seen marker, hourly bucket. ARGV: series id, marker TTL, bucket TTL
+RECORD_VIEW = """
+if redis.call('SET', KEYS[1], 1, 'NX', 'EX', ARGV[2]) then
+    redis.call('ZINCRBY', KEYS[2], 1, ARGV[1])
+    redis.call('EXPIRE', KEYS[2], ARGV[3])
+    return 1
+end
+return 0
+"""
+
+_record_view = None
+_rebuild_lock = threading.Lock()
+
+
+def _hour(at=None):
+    return int((at if at is not None else time.time()) // 3600)
+
+
+def record_view(user_id, episode_id, at=None):
+    """Count a viewing event towards its series' trending score."""
+    global _record_view
+    series_id = catalog.episode_series_id(episode_id)
+    if series_id is None:
+        return
+    hour = _hour(at)
+    r = get_redis()
+    if _record_view is None:
+        _record_view = r.register_script(RECORD_VIEW)
+    _record_view(
+        keys=[SEEN_KEY.format(hour, user_id, series_id), BUCKET_KEY.format(hour)],
+        args=[series_id, 3600, (settings.TRENDING_WINDOW_HOURS + 1) * 3600],
+        client=r
+    )
+
+
+def _rebuild(r):
+    now = _hour()
+    weights = {
+        BUCKET_KEY.format(now - age): settings.TRENDING_DECAY ** age
+        for age in range(settings.TRENDING_WINDOW_HOURS)
+    }
+    staging = f"{CURRENT_KEY}:staging"
+    pipe = r.pipeline()
+    pipe.zunionstore(staging, weights)
+    pipe.expire(staging, settings.TRENDING_CACHE_TTL)
+    pipe.execute()
+    # RENAME fails when every bucket was empty and nothing was stored
+    try:
+        r.rename(staging, CURRENT_KEY)
+    except redis.ResponseError:
+        r.delete(CURRENT_KEY)
+
+
+def top(limit=10):
+    """``[(series_id, score), ...]`` for the current window, best first."""
+    r = get_redis()
+    ranking = r.zrevrange(CURRENT_KEY, 0, limit - 1, withscores=True)
+    if ranking:
+        return [(int(member), score) for member, score in ranking]
+
+    # Single-flight: one rebuild per process, and one across processes
+    with _rebuild_lock:
+        ranking = r.zrevrange(CURRENT_KEY, 0, limit - 1, withscores=True)
+        if not ranking and r.set(REBUILD_LOCK_KEY, 1, nx=True, ex=10):
+            try:
+                _rebuild(r)
+            finally:
+                r.delete(REBUILD_LOCK_KEY)
+            ranking = r.zrevrange(CURRENT_KEY, 0, limit - 1, withscores=True)
+        elif not ranking:
+            for _ in range(20):
+                time.sleep(0.05)
+                ranking = r.zrevrange(CURRENT_KEY, 0, limit - 1, withscores=True)
+                if ranking:
+                    break
+    return [(int(member), score) for member, score in ranking]
+
+
+def trending(limit=10):
+    """Top series with their cached catalog metadata."""
+    ranking = top(limit)
+    summaries = catalog.series_summaries([series_id for series_id, _ in ranking])
+    return [
+        {**summaries.get(series_id, {"id": series_id}), "score": round(score, 3)}
+        for series_id, score in ranking
+    ]
+
+
+def backfill(hours=None):
+    """Seed the hourly buckets from every shard's viewing_progress (one-time, after deploy)."""
+    hours = hours or settings.TRENDING_WINDOW_HOURS
+    views = []
+    for shard in sharding.shard_names():
+        with sharding.mysql_connection(shard) as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT user_id, episode_id, FLOOR(UNIX_TIMESTAMP(last_watched) / 3600) AS hour
+                FROM viewing_progress
+                WHERE last_watched >= DATE_SUB(NOW(), INTERVAL %s HOUR)
+            """, (hours,))
+            views.extend(sharding.owned_rows(shard, cursor.fetchall()))
+            cursor.close()
+
+    # Distinct viewers per (series, hour), as record_view counts them
+    series_of = catalog.episode_series_ids([episode_id for _, episode_id, _ in views])
+    viewed = {
+        (series_of[episode_id], int(hour), user_id)
+        for user_id, episode_id, hour in views if episode_id in series_of
+    }
+    viewers = Counter((series_id, hour) for series_id, hour, _ in viewed)
+
+    pipe = get_redis().pipeline()
+    for (series_id, hour), count in viewers.items():
+        pipe.zincrby(BUCKET_KEY.format(hour), count, series_id)
+        pipe.expire(BUCKET_KEY.format(hour), (settings.TRENDING_WINDOW_HOURS + 1) * 3600)
+    pipe.delete(CURRENT_KEY)
+    pipe.execute()
+    return len(viewers)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["backfill"]:
+        print(f"Seeded {backfill()} series/hour buckets")
+    else:
+        print("usage: python -m app.services.trending backfill")
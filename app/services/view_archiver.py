@@ -0,0 +1,334 @@
+"""Online archiving of old ``view_history`` rows (replaces ``archive_old_views()``).
+
+``archive_old_views()`` in ``sql/create_database.sql`` moves a year of history
+with one ``INSERT ... SELECT`` and one ``DELETE``: a single transaction that
+locks the range, grows the undo log and reaches replicas as one huge event.
+This job moves the same rows in small transactions instead. It works in one of
+two modes, picked by whether ``view_history`` is partitioned:
+
+* Chunked (plain table): walks rows older than the cutoff in
+  ``(watch_date, view_id)`` order, ``ARCHIVE_CHUNK_SIZE`` at a time. Each chunk
+  is copied to ``view_history_archive``, deleted, and its position saved in
+  ``archive_checkpoint``, all in one transaction. A killed run resumes where
+  it stopped, with the same cutoff.
+* Partitioned (``sql/view_history_partitioned.sql``): keeps
+  ``ARCHIVE_FUTURE_PARTITIONS`` monthly partitions ahead of today. Each month
+  older than the cutoff is swapped out with ``EXCHANGE PARTITION`` and
+  dropped; both are metadata-only changes. The swapped-out rows are then
+  copied to the archive in chunks from the staging table, away from the live
+  table. A run that died mid-copy finishes the staging table first.
+
+Between chunks the job sleeps ``ARCHIVE_CHUNK_PAUSE`` seconds. When
+``ARCHIVE_REPLICA_HOST`` is set, it also waits while that replica is more than
+``ARCHIVE_MAX_REPLICA_LAG`` seconds behind.
+
+    python -m app.services.view_archiver run
+    python -m app.services.view_archiver status
+"""
+import json
+import logging
+import sys
+import time
+from datetime import datetime, timedelta
+import mysql.connector
+from ..core.config import settings
+from ..core.database import connect_platform
+
+logger = logging.getLogger(__name__)
+
+JOB = "view_history"
+STAGING_TABLE = "view_history_exchange"
+COLUMNS = "view_id, user_id, content_id, watch_date, watch_duration, watch_progress, device_info"
+FIRST_POSITION = (datetime(1000, 1, 1), 0)  # below any DATETIME value
+
+COPY_ROWS = f"""
+    INSERT INTO view_history_archive ({COLUMNS}, archived_at)
+    SELECT {COLUMNS}, NOW() FROM {{table}} WHERE view_id IN ({{ids}})
+    ON DUPLICATE KEY UPDATE view_id = view_history_archive.view_id
+"""
+
+
+class Throttle:
+    """Sleep between chunks, and hold off while the replica is lagging."""
+
+    def __init__(self, pause=None, max_lag=None, replica_host=None):
+        self.pause = settings.ARCHIVE_CHUNK_PAUSE if pause is None else pause
+        self.max_lag = settings.ARCHIVE_MAX_REPLICA_LAG if max_lag is None else max_lag
+        self.replica_host = settings.ARCHIVE_REPLICA_HOST if replica_host is None else replica_host
+        self._replica = None
+        self.waited_for_lag = 0.0
+
+    def replica_lag(self):
+        if not self.replica_host:
+            return None
+        if self._replica is None:
+            self._replica = connect_platform(self.replica_host)
+        cursor = self._replica.cursor(dictionary=True)
+        try:
+            cursor.execute("SHOW REPLICA STATUS")
+        except mysql.connector.Error:  # MySQL < 8.0.22
+            cursor.execute("SHOW SLAVE STATUS")
+        status = cursor.fetchone() or {}
+        cursor.close()
+        lag = status.get("Seconds_Behind_Source", status.get("Seconds_Behind_Master"))
+        return float("inf") if lag is None else lag
+
+    def wait(self):
+        time.sleep(self.pause)
+        started = time.perf_counter()
+        while True:
+            lag = self.replica_lag()
+            if lag is None or lag <= self.max_lag:
+                break
+            logger.info("Replica %s is %ss behind; pausing archiver", self.replica_host, lag)
+            time.sleep(1)
+        self.waited_for_lag += time.perf_counter() - started
+
+    def close(self):
+        if self._replica is not None:
+            self._replica.close()
+            self._replica = None
+
+
+class Stats:
+    def __init__(self, mode):
+        self.mode = mode
+        self.rows = 0
+        self.chunk_seconds = []
+        self.partitions_added = []
+        self.partitions_dropped = []
+        self.started = time.perf_counter()
+
+    def as_dict(self, throttle):
+        elapsed = time.perf_counter() - self.started
+        durations = sorted(self.chunk_seconds)
+        return {
+            "mode": self.mode,
+            "rows": self.rows,
+            "chunks": len(durations),
+            "seconds": round(elapsed, 3),
+            "rows_per_second": round(self.rows / elapsed, 1) if elapsed else None,
+            "max_chunk_seconds": round(durations[-1], 4) if durations else None,
+            "seconds_waiting_for_replica": round(throttle.waited_for_lag, 3),
+            "partitions_added": self.partitions_added,
+            "partitions_dropped": self.partitions_dropped,
+        }
+
+
+def _load_checkpoint(cursor):
+    cursor.execute(
+        "SELECT cutoff, last_watch_date, last_view_id, rows_moved FROM archive_checkpoint WHERE job = %s",
+        (JOB,)
+    )
+    return cursor.fetchone()
+
+
+def archive_chunked(conn, throttle, stats, chunk_size=None):
+    """Move rows older than the cutoff chunk by chunk, resuming from the checkpoint."""
+    chunk_size = chunk_size or settings.ARCHIVE_CHUNK_SIZE
+    cursor = conn.cursor()
+    checkpoint = _load_checkpoint(cursor)
+    if checkpoint is None:
+        cutoff = datetime.now().replace(microsecond=0) - timedelta(days=settings.ARCHIVE_RETENTION_DAYS)
+        position, moved = FIRST_POSITION, 0
+        cursor.execute(
+            "INSERT INTO archive_checkpoint (job, cutoff, last_watch_date, last_view_id, rows_moved) "
+            "VALUES (%s, %s, %s, %s, 0)",
+            (JOB, cutoff, *position)
+        )
+        conn.commit()
+    else:
+        cutoff, last_date, last_id, moved = checkpoint
+        position = (last_date, last_id)
+        logger.info("Resuming view_history archive at %s (cutoff %s)", position, cutoff)
+
+    while True:
+        started = time.perf_counter()
+        cursor.execute(
+            "SELECT view_id, watch_date FROM view_history "
+            "WHERE watch_date < %s AND (watch_date, view_id) > (%s, %s) "
+            "ORDER BY watch_date, view_id LIMIT %s FOR UPDATE",
+            (cutoff, *position, chunk_size)
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            conn.rollback()
+            break
+        ids = ", ".join(str(view_id) for view_id, _ in rows)
+        cursor.execute(COPY_ROWS.format(table="view_history", ids=ids))
+        cursor.execute(f"DELETE FROM view_history WHERE view_id IN ({ids})")
+        position = (rows[-1][1], rows[-1][0])
+        moved += len(rows)
+        cursor.execute(
+            "UPDATE archive_checkpoint SET last_watch_date = %s, last_view_id = %s, rows_moved = %s "
+            "WHERE job = %s",
+            (*position, moved, JOB)
+        )
+        conn.commit()
+        stats.rows += len(rows)
+        stats.chunk_seconds.append(time.perf_counter() - started)
+        throttle.wait()
+
+    # Finished: the next run starts over with a fresh cutoff.
+    cursor.execute("DELETE FROM archive_checkpoint WHERE job = %s", (JOB,))
+    conn.commit()
+    cursor.close()
+
+
+def _partitions(cursor):
+    """``[(name, upper_bound or None for MAXVALUE), ...]`` in partition order."""
+    cursor.execute(
+        "SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'view_history' AND PARTITION_NAME IS NOT NULL "
+        "ORDER BY PARTITION_ORDINAL_POSITION"
+    )
+    partitions = []
+    for name, description in cursor.fetchall():
+        bound = None if description == "MAXVALUE" else datetime.fromisoformat(description.strip("'"))
+        partitions.append((name, bound))
+    return partitions
+
+
+def _next_month(day):
+    return (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def ensure_future_partitions(cursor, months=None):
+    """Split the MAXVALUE partition so the next ``months`` months have their own.
+
+    All missing months are added with a single ``REORGANIZE PARTITION``. That is
+    only a metadata change while the MAXVALUE partition is empty; if it holds
+    rows, splitting it would copy them, so it is left alone and an error logged.
+    Returns the names of the partitions added.
+    """
+    months = settings.ARCHIVE_FUTURE_PARTITIONS if months is None else months
+    partitions = _partitions(cursor)
+    target = datetime.now()
+    for _ in range(months + 1):
+        target = _next_month(target)
+    bounds = [bound for _, bound in partitions if bound is not None]
+    start = bounds[-1] if bounds else _next_month(datetime.now())
+    future = partitions[-1][0]
+    if start >= target:
+        return []
+
+    cursor.execute(f"SELECT 1 FROM view_history PARTITION ({future}) LIMIT 1")
+    if cursor.fetchall():
+        logger.error(
+            "Partition %s holds rows; not splitting it (that would copy them). Reorganize it "
+            "into monthly partitions by hand, through %s at least.", future, f"{target:%Y-%m}"
+        )
+        return []
+
+    added = []
+    while start < target:
+        end = _next_month(start)
+        added.append(f"PARTITION p{start:%Y%m} VALUES LESS THAN ('{end:%Y-%m-%d}')")
+        start = end
+    cursor.execute(
+        f"ALTER TABLE view_history REORGANIZE PARTITION {future} INTO ("
+        f"{', '.join(added)}, PARTITION {future} VALUES LESS THAN (MAXVALUE))"
+    )
+    return [definition.split()[1] for definition in added]
+
+
+def _copy_staging(conn, throttle, stats, chunk_size):
+    """Copy the exchanged-out partition into the archive, then drop it."""
+    cursor = conn.cursor()
+    last_id = 0
+    while True:
+        started = time.perf_counter()
+        cursor.execute(
+            f"SELECT view_id FROM {STAGING_TABLE} WHERE view_id > %s ORDER BY view_id LIMIT %s",
+            (last_id, chunk_size)
+        )
+        ids = [view_id for view_id, in cursor.fetchall()]
+        if not ids:
+            break
+        cursor.execute(COPY_ROWS.format(table=STAGING_TABLE, ids=", ".join(map(str, ids))))
+        conn.commit()
+        last_id = ids[-1]
+        stats.rows += len(ids)
+        stats.chunk_seconds.append(time.perf_counter() - started)
+        throttle.wait()
+    cursor.execute(f"DROP TABLE {STAGING_TABLE}")
+    cursor.close()
+
+
+def archive_partitions(conn, throttle, stats, chunk_size=None):
+    chunk_size = chunk_size or settings.ARCHIVE_CHUNK_SIZE
+    cursor = conn.cursor()
+    cursor.execute("SHOW TABLES LIKE %s", (STAGING_TABLE,))
+    if cursor.fetchone():
+        logger.info("Finishing copy of a previously exchanged partition")
+        _copy_staging(conn, throttle, stats, chunk_size)
+
+    stats.partitions_added.extend(ensure_future_partitions(cursor))
+    cutoff = datetime.now() - timedelta(days=settings.ARCHIVE_RETENTION_DAYS)
+    partitions = _partitions(cursor)
+    for name, bound in partitions[:-1]:  # the last one is the MAXVALUE partition
+        if bound is None or bound > cutoff:
+            break
+        cursor.execute(f"CREATE TABLE {STAGING_TABLE} LIKE view_history")
+        cursor.execute(f"ALTER TABLE {STAGING_TABLE} REMOVE PARTITIONING")
+        cursor.execute(f"ALTER TABLE view_history EXCHANGE PARTITION {name} WITH TABLE {STAGING_TABLE}")
+        cursor.execute(f"ALTER TABLE view_history DROP PARTITION {name}")
+        stats.partitions_dropped.append(name)
+        _copy_staging(conn, throttle, stats, chunk_size)
+    cursor.close()
+
+
+def is_partitioned(conn):
+    cursor = conn.cursor()
+    partitioned = bool(_partitions(cursor))
+    cursor.close()
+    return partitioned
+
+
+def run(chunk_size=None, throttle=None):
+    """Archive everything older than ``ARCHIVE_RETENTION_DAYS``; returns run stats."""
+    conn = connect_platform()
+    throttle = throttle or Throttle()
+    try:
+        if is_partitioned(conn):
+            stats = Stats("partitions")
+            archive_partitions(conn, throttle, stats, chunk_size)
+        else:
+            stats = Stats("chunked")
+            archive_chunked(conn, throttle, stats, chunk_size)
+        return stats.as_dict(throttle)
+    finally:
+        throttle.close()
+        conn.close()
+
+
+def status():
+    conn = connect_platform()
+    cursor = conn.cursor()
+    try:
+        if is_partitioned(conn):
+            return {"mode": "partitions", "partitions": [name for name, _ in _partitions(cursor)]}
+        checkpoint = _load_checkpoint(cursor)
+        if checkpoint is None:
+            return {"mode": "chunked", "in_progress": False}
+        cutoff, last_date, last_id, moved = checkpoint
+        return {
+            "mode": "chunked",
+            "in_progress": True,
+            "cutoff": cutoff.isoformat(),
+            "position": [last_date.isoformat(), last_id],
+            "rows_moved": moved,
+        }
+    finally:
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if sys.argv[1:] == ["run"]:
+        print(json.dumps(run(), indent=2))
+    elif sys.argv[1:] == ["status"]:
+        print(json.dumps(status(), indent=2))
+    else:
+        print("usage: python -m app.services.view_archiver run|status")
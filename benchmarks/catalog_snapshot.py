@@ -0,0 +1,69 @@
+"""Response time and MySQL QPS for catalog reads under a read-heavy mix.
+
+Runs three passes against a running API and samples MySQL's ``Questions``
+counter around each one:
+
+* ``cold``: the first request per series builds the snapshot
+* ``warm``: snapshots are served from memory/Redis
+* ``conditional``: clients send ``If-None-Match`` and receive 304s
+
+    python benchmarks/catalog_snapshot.py --base-url http://localhost:8000 --series 1 2 3
+
+Run it against the commit before the snapshot layer (``cold`` only) to get
+the baseline. MySQL connection settings come from the usual MYSQL_* env vars.
+"""
+import argparse
+import json
+import os
+
+import mysql.connector
+import requests
+
+from loadtest import run
+
+
+def mysql_questions():
+    conn = mysql.connector.connect(
+        host=os.getenv("MYSQL_HOST", "localhost"),
+        port=int(os.getenv("MYSQL_PORT", 3307)),
+        user=os.getenv("MYSQL_USER", "streaming_user"),
+        password=os.getenv("MYSQL_PASSWORD", "userpassword"),
+    )
+    cursor = conn.cursor()
+    cursor.execute("SHOW GLOBAL STATUS LIKE 'Questions'")
+    value = int(cursor.fetchone()[1])
+    cursor.close()
+    conn.close()
+    return value
+
+
+def measured(label, url, args, headers=None):
+    before = mysql_questions()
+    result = run(url, args.concurrency, args.requests, headers)
+    # Minus the two status queries issued by this script
+    queries = mysql_questions() - before - 2
+    result.update(label=label, mysql_queries=queries, mysql_qps=round(queries / result["seconds"], 1))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--series", type=int, nargs="+", default=[1])
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    results = []
+    for series_id in args.series:
+        url = f"{args.base_url}/series/{series_id}/episodes"
+        results.append(measured(f"series {series_id} cold", url, args))
+        results.append(measured(f"series {series_id} warm", url, args))
+        etag = requests.get(url, timeout=30).headers.get("ETag")
+        if etag:
+            results.append(measured(f"series {series_id} conditional", url, args, {"If-None-Match": etag}))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
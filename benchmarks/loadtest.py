@@ -0,0 +1,91 @@
+"""Concurrent-request load test against a running API worker.
+
+Run the API with a single worker, then point this script at it:
+
+    uvicorn app.main:app --workers 1
+    python benchmarks/loadtest.py --url http://localhost:8000/trending --concurrency 64 --requests 2000
+
+Run it once on the commit before a change and once after to compare
+throughput per worker. A slow endpoint can be mixed in with ``--slow-url``
+to check that it no longer stalls the others.
+"""
+import argparse
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run(url, concurrency, total, headers=None, slow_url=None):
+    local = threading.local()
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def session():
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        return local.session
+
+    def one(i):
+        nonlocal errors
+        target = slow_url if slow_url and i % concurrency == 0 else url
+        started = time.perf_counter()
+        try:
+            ok = session().get(target, headers=headers, timeout=30).status_code < 500
+        except requests.RequestException:
+            ok = False
+        elapsed = time.perf_counter() - started
+        with lock:
+            if target == url:
+                latencies.append(elapsed)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    wall = time.perf_counter() - started
+
+    return {
+        "url": url,
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "seconds": round(wall, 3),
+        "throughput_rps": round(total / wall, 1),
+        "latency_ms": {
+            "mean": round(statistics.mean(latencies) * 1000, 2) if latencies else 0.0,
+            "p50": round(percentile(latencies, 50) * 1000, 2),
+            "p95": round(percentile(latencies, 95) * 1000, 2),
+            "p99": round(percentile(latencies, 99) * 1000, 2),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", required=True)
+    parser.add_argument("--slow-url", help="endpoint interleaved once per batch to simulate a slow query")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--token", help="bearer token for authenticated endpoints")
+    args = parser.parse_args()
+
+    headers = {"Authorization": f"Bearer {args.token}"} if args.token else None
+    print(json.dumps(run(args.url, args.concurrency, args.requests, headers, args.slow_url), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Login throughput, and latency of an unrelated endpoint during a login burst.
+
+Registers one user (or reuses it), measures ``--other-url`` on its own, then
+again while ``--login-concurrency`` clients log in as fast as they can.
+Logins rejected with 429 by the password-hashing pool are counted separately
+from failures.
+
+    uvicorn app.main:app --workers 1
+    python -m benchmarks.logins --base-url http://localhost:8000 --logins 500
+
+Compare runs with different PASSWORD_HASH_WORKERS / PASSWORD_HASH_QUEUE /
+PASSWORD_BCRYPT_ROUNDS on the server.
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.loadtest import percentile, run
+
+
+def register(base_url, username, password):
+    response = requests.post(f"{base_url}/register", json={
+        "username": username, "email": f"{username}@example.com", "password": password,
+    }, timeout=30)
+    if response.status_code not in (200, 400):  # 400: already registered
+        response.raise_for_status()
+
+
+def login_burst(base_url, username, password, concurrency, total):
+    local = threading.local()
+    statuses = Counter()
+    latencies = []
+    lock = threading.Lock()
+
+    def one(_):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            status = local.session.post(
+                f"{base_url}/login", params={"username": username, "password": password}, timeout=60
+            ).status_code
+        except requests.RequestException:
+            status = "error"
+        elapsed = time.perf_counter() - started
+        with lock:
+            statuses[status] += 1
+            if status == 200:
+                latencies.append(elapsed)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    wall = time.perf_counter() - started
+    return {
+        "requests": total,
+        "seconds": round(wall, 3),
+        "logins_per_second": round(statuses[200] / wall, 1),
+        "statuses": {str(status): count for status, count in statuses.items()},
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 2),
+            "p95": round(percentile(latencies, 95) * 1000, 2),
+            "p99": round(percentile(latencies, 99) * 1000, 2),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--other-url", help="endpoint measured during the burst (default: {base-url}/trending)")
+    parser.add_argument("--logins", type=int, default=500)
+    parser.add_argument("--login-concurrency", type=int, default=64)
+    parser.add_argument("--other-requests", type=int, default=2000)
+    parser.add_argument("--other-concurrency", type=int, default=8)
+    parser.add_argument("--username", default=f"bench_{uuid.uuid4().hex[:8]}")
+    parser.add_argument("--password", default="benchmark-password")
+    args = parser.parse_args()
+    other_url = args.other_url or f"{args.base_url}/trending"
+
+    register(args.base_url, args.username, args.password)
+    baseline = run(other_url, args.other_concurrency, args.other_requests)
+
+    burst = {}
+    thread = threading.Thread(target=lambda: burst.update(login_burst(
+        args.base_url, args.username, args.password, args.login_concurrency, args.logins
+    )))
+    thread.start()
+    during = run(other_url, args.other_concurrency, args.other_requests)
+    thread.join()
+
+    print(json.dumps({
+        "login": burst,
+        "other_endpoint": {
+            "url": other_url,
+            "baseline_latency_ms": baseline["latency_ms"],
+            "during_burst_latency_ms": during["latency_ms"],
+            "during_burst_errors": during["errors"],
+        },
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+"""Throughput and p50/p95/p99 per endpoint under realistic request mixes.
+
+Drives a running API seeded with ``benchmarks.seed`` (it reads the seed
+manifest for user names, episode ids and title words). Each mix is a
+weighted set of operations:
+
+* ``playback``: heartbeat-heavy viewing. Progress updates and viewing
+  session heartbeats, with session starts/ends and the occasional
+  continue-watching or episode list.
+* ``browse``: catalog pages (MySQL and Mongo), episode lists, search,
+  autocomplete, continue watching and recommendations.
+* ``login_burst``: password logins only.
+* ``trending``: the trending list, with some catalog pages.
+* ``mixed``: all of the above at roughly production proportions.
+
+Before the timed phase, ``--concurrency`` seeded users log in. During it,
+each client thread acts as one of those users. Operations are drawn from
+a generator seeded with ``--seed`` and the thread number, so two runs send
+the same requests in the same per-thread order. The output is JSON with
+throughput and latency per mix and per endpoint (route template), plus the
+commit it ran against. With ``--compare`` it also reports the change in
+p50/p95/p99 and throughput from an earlier output, and exits with status 1
+if any endpoint's p95 grew by more than ``--max-regression`` percent.
+
+    uvicorn app.main:app --workers 1
+    python -m benchmarks.seed --users 10000 --series 500 --truncate
+    python -m benchmarks.mixes --mix playback browse trending --output before.json
+    # ...change, restart the API...
+    python -m benchmarks.mixes --mix playback browse trending --compare before.json
+"""
+import argparse
+import json
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from app.core.pagination import encode_cursor
+from benchmarks.loadtest import percentile
+
+MIXES = {
+    "playback": {"progress": 45, "session_heartbeat": 40, "session_cycle": 5, "continue_watching": 5,
+                 "episodes": 5},
+    "browse": {"series_page": 20, "series_filtered": 10, "api_series_page": 10, "episodes": 20, "search": 15,
+               "autocomplete": 10, "continue_watching": 5, "recommendations": 10},
+    "login_burst": {"login": 100},
+    "trending": {"trending": 80, "series_page": 20},
+    "mixed": {"progress": 30, "session_heartbeat": 25, "session_cycle": 2, "series_page": 8, "episodes": 8,
+              "search": 6, "autocomplete": 4, "continue_watching": 5, "recommendations": 4, "trending": 6,
+              "login": 2},
+}
+
+
+class Client:
+    """One simulated user: their token, their viewing session and a seeded RNG."""
+
+    def __init__(self, base_url, manifest, user_id, token, seed):
+        self.base_url = base_url
+        self.manifest = manifest
+        self.user_id = user_id
+        self.token = token
+        self.rng = random.Random(seed)
+        self.http = requests.Session()
+        self.session_id = None
+        self.episode_id = self.pick_episode()
+        self.progress = 0
+
+    def pick_episode(self):
+        first, last = self.manifest["episodes"]
+        return self.rng.randint(first, last)
+
+    def pick_series(self):
+        first, last = self.manifest["series"]
+        return self.rng.randint(first, last)
+
+    def auth(self):
+        return {"Authorization": f"Bearer {self.token}"}
+
+    def call(self, name, method, path, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self.http.request(method, self.base_url + path, timeout=30, **kwargs)
+            status = response.status_code
+        except requests.RequestException:
+            response, status = None, "error"
+        return name, status, time.perf_counter() - started, response
+
+    # Operations: each returns one or more (endpoint, status, seconds, response)
+    def progress_op(self):
+        self.progress += 10
+        if self.rng.random() < 0.02:
+            self.episode_id, self.progress = self.pick_episode(), 0
+        return [self.call("POST /viewing-progress", "POST", "/viewing-progress", headers=self.auth(),
+                          params={"episode_id": self.episode_id, "progress": self.progress})]
+
+    def start_session(self):
+        result = self.call("POST /viewing-session/start", "POST", "/viewing-session/start",
+                           params={"user_id": self.user_id, "episode_id": self.episode_id})
+        response = result[3]
+        if response is not None and response.status_code == 200:
+            self.session_id = response.json()["session_id"]
+        return result
+
+    def session_heartbeat_op(self):
+        if self.session_id is None:
+            return [self.start_session()]
+        result = self.call("POST /viewing-session/heartbeat", "POST", "/viewing-session/heartbeat",
+                           params={"user_id": self.user_id, "session_id": self.session_id})
+        if result[1] == 410:
+            self.session_id = None
+        return [result]
+
+    def session_cycle_op(self):
+        results = []
+        if self.session_id is not None:
+            results.append(self.call("POST /viewing-session/end", "POST", "/viewing-session/end",
+                                     params={"user_id": self.user_id, "session_id": self.session_id}))
+            self.session_id = None
+        self.episode_id, self.progress = self.pick_episode(), 0
+        results.append(self.start_session())
+        return results
+
+    def continue_watching_op(self):
+        return [self.call("GET /users/me/continue-watching", "GET", "/users/me/continue-watching",
+                          headers=self.auth())]
+
+    def episodes_op(self):
+        return [self.call("GET /series/{series_id}/episodes", "GET", f"/series/{self.pick_series()}/episodes")]
+
+    def series_page_op(self):
+        params = {"limit": 20}
+        # The first page is by far the most requested
+        if self.rng.random() >= 0.7:
+            params["cursor"] = encode_cursor({"id": self.pick_series()})
+        return [self.call("GET /series", "GET", "/series", headers=self.auth(), params=params)]
+
+    def series_filtered_op(self):
+        return [self.call("GET /series", "GET", "/series", headers=self.auth(),
+                          params={"limit": 20, "genre": self.rng.choice(self.manifest["genres"])})]
+
+    def api_series_page_op(self):
+        return [self.call("GET /api/series", "GET", "/api/series",
+                          params={"limit": 20, "genre": self.rng.choice(self.manifest["genres"])})]
+
+    def search_op(self):
+        words = self.rng.sample(self.manifest["words"], self.rng.choice((1, 1, 2)))
+        return [self.call("GET /api/search", "GET", "/api/search", params={"q": " ".join(words)})]
+
+    def autocomplete_op(self):
+        word = self.rng.choice(self.manifest["words"])
+        return [self.call("GET /api/search/autocomplete", "GET", "/api/search/autocomplete",
+                          params={"q": word[:self.rng.randint(1, len(word))]})]
+
+    def recommendations_op(self):
+        return [self.call("GET /recommendations", "GET", "/recommendations", headers=self.auth())]
+
+    def trending_op(self):
+        return [self.call("GET /trending", "GET", "/trending")]
+
+    def login_op(self):
+        first, last = self.manifest["users"]["ids"]
+        username = self.manifest["users"]["username"].format(id=self.rng.randint(first, last))
+        return [self.call("POST /login", "POST", "/login",
+                          params={"username": username, "password": self.manifest["users"]["password"]})]
+
+
+def login(base_url, username, password):
+    response = requests.post(f"{base_url}/login", params={"username": username, "password": password},
+                             timeout=60)
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+def clients(base_url, manifest, count, seed):
+    first, last = manifest["users"]["ids"]
+    user_ids = random.Random(seed).sample(range(first, last + 1), min(count, last - first + 1))
+    username = manifest["users"]["username"]
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        tokens = list(pool.map(
+            lambda user_id: login(base_url, username.format(id=user_id), manifest["users"]["password"]), user_ids
+        ))
+    return [
+        Client(base_url, manifest, user_id, token, seed * 1000 + n)
+        for n, (user_id, token) in enumerate(zip(user_ids, tokens))
+    ]
+
+
+def summarize(latencies, statuses, seconds):
+    requests_made = sum(statuses.values())
+    return {
+        "requests": requests_made,
+        "errors": sum(count for status, count in statuses.items() if status == "error" or status >= 500),
+        "statuses": {str(status): count for status, count in sorted(statuses.items(), key=str)},
+        "throughput_rps": round(requests_made / seconds, 1) if seconds else 0.0,
+        "latency_ms": {
+            "mean": round(statistics.mean(latencies) * 1000, 2) if latencies else 0.0,
+            "p50": round(percentile(latencies, 50) * 1000, 2),
+            "p95": round(percentile(latencies, 95) * 1000, 2),
+            "p99": round(percentile(latencies, 99) * 1000, 2),
+        },
+    }
+
+
+def run_mix(mix, client_pool, total):
+    operations = list(MIXES[mix])
+    weights = list(MIXES[mix].values())
+    latencies = defaultdict(list)
+    statuses = defaultdict(Counter)
+    lock = threading.Lock()
+    per_client = max(1, total // len(client_pool))
+
+    def drive(client):
+        local_latencies = defaultdict(list)
+        local_statuses = defaultdict(Counter)
+        for _ in range(per_client):
+            operation = client.rng.choices(operations, weights)[0]
+            for name, status, seconds, _ in getattr(client, f"{operation}_op")():
+                local_statuses[name][status] += 1
+                if status != "error" and status < 500:
+                    local_latencies[name].append(seconds)
+        with lock:
+            for name, values in local_latencies.items():
+                latencies[name].extend(values)
+            for name, counts in local_statuses.items():
+                statuses[name].update(counts)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(client_pool)) as pool:
+        list(pool.map(drive, client_pool))
+    wall = time.perf_counter() - started
+
+    endpoints = {name: summarize(latencies[name], statuses[name], wall) for name in sorted(statuses)}
+    overall = summarize(
+        [value for values in latencies.values() for value in values],
+        sum(statuses.values(), Counter()), wall
+    )
+    overall["seconds"] = round(wall, 3)
+    return {"overall": overall, "endpoints": endpoints}
+
+
+def compare(results, baseline, max_regression):
+    """Per-endpoint change against an earlier run; returns (report, regressed)."""
+    report, regressed = {}, []
+    for mix, result in results.items():
+        before_mix = baseline.get("mixes", {}).get(mix)
+        if before_mix is None:
+            continue
+        for name, after in result["endpoints"].items():
+            before = before_mix["endpoints"].get(name)
+            if before is None:
+                continue
+            change = {
+                f"{key}_pct": round((after["latency_ms"][key] / before["latency_ms"][key] - 1) * 100, 1)
+                for key in ("p50", "p95", "p99") if before["latency_ms"][key]
+            }
+            if before["throughput_rps"]:
+                change["throughput_pct"] = round((after["throughput_rps"] / before["throughput_rps"] - 1) * 100, 1)
+            report.setdefault(mix, {})[name] = change
+            if change.get("p95_pct", 0) > max_regression:
+                regressed.append(f"{mix} {name}")
+    return report, regressed
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--manifest", default="benchmarks/seed_manifest.json")
+    parser.add_argument("--mix", nargs="+", choices=sorted(MIXES), default=["playback", "browse", "trending"])
+    parser.add_argument("--requests", type=int, default=5000, help="operations per mix")
+    parser.add_argument("--concurrency", type=int, default=32, help="client threads, one logged-in user each")
+    parser.add_argument("--warmup", type=int, default=200, help="untimed operations per mix")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="also write the JSON result to this file")
+    parser.add_argument("--compare", help="earlier JSON result to compare against")
+    parser.add_argument("--max-regression", type=float, default=20.0, help="allowed p95 growth, percent")
+    args = parser.parse_args()
+
+    with open(args.manifest) as f:
+        manifest = json.load(f)
+    client_pool = clients(args.base_url, manifest, args.concurrency, args.seed)
+
+    results = {}
+    for mix in args.mix:
+        if args.warmup:
+            run_mix(mix, client_pool, args.warmup)
+        results[mix] = run_mix(mix, client_pool, args.requests)
+
+    output = {
+        "commit": git_commit(),
+        "base_url": args.base_url,
+        "seed": args.seed,
+        "concurrency": len(client_pool),
+        "requests_per_mix": args.requests,
+        "dataset": manifest.get("counts"),
+        "mixes": results,
+    }
+    regressed = []
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        output["compared_to"] = baseline.get("commit")
+        output["change"], regressed = compare(results, baseline, args.max_regression)
+        output["regressed"] = regressed
+    text = json.dumps(output, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+    if regressed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
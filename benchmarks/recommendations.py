@@ -0,0 +1,88 @@
+"""Build time and memory of the item-item similarity job on synthetic data.
+
+Generates ``--users`` x ``--titles`` viewing data in memory: each user watches
+a Poisson(``--mean-titles``) number of titles, drawn with Zipf-like popularity.
+It then runs the same ``build_similarity`` as
+``python -m app.services.recommendations build``, without touching MySQL, and
+times ``blend`` lookups against the resulting index.
+
+    python -m benchmarks.recommendations --users 1000000 --titles 100000
+
+The default is the full 1M x 100k size; use smaller values for a quick run.
+"""
+import argparse
+import json
+import resource
+import time
+
+import numpy as np
+
+from app.core.config import settings
+from app.services import recommendations
+
+
+def synthetic_interactions(users, titles, mean_titles, zipf, seed):
+    rng = np.random.default_rng(seed)
+    per_user = np.minimum(rng.poisson(mean_titles, users), titles)
+    user_ids = np.repeat(np.arange(users, dtype=np.int64), per_user)
+    popularity = 1.0 / np.arange(1, titles + 1) ** zipf
+    title_ids = rng.choice(titles, size=len(user_ids), p=popularity / popularity.sum())
+    return user_ids, title_ids.astype(np.int64)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--titles", type=int, default=100_000)
+    parser.add_argument("--mean-titles", type=float, default=20)
+    parser.add_argument("--zipf", type=float, default=0.8)
+    parser.add_argument("--top-k", type=int, default=settings.RECOMMENDATIONS_TOP_K)
+    parser.add_argument("--block-size", type=int, default=settings.RECOMMENDATIONS_BLOCK_SIZE)
+    parser.add_argument("--lookups", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    user_ids, title_ids = synthetic_interactions(args.users, args.titles, args.mean_titles, args.zipf, args.seed)
+    generated = time.perf_counter()
+    items, neighbours, scores, _ = recommendations.build_similarity(
+        user_ids, title_ids, top_k=args.top_k, block_size=args.block_size
+    )
+    built = time.perf_counter()
+
+    index = {}
+    for row, item in enumerate(items):
+        valid = neighbours[row] >= 0
+        index[int(item)] = (neighbours[row][valid], scores[row][valid])
+    rng = np.random.default_rng(args.seed + 1)
+    latencies = []
+    for user in rng.integers(0, args.users, args.lookups):
+        lo, hi = np.searchsorted(user_ids, [user, user + 1])
+        history = [int(title) for title in title_ids[lo:hi][:settings.RECOMMENDATIONS_HISTORY]]
+        lookup_started = time.perf_counter()
+        recommendations.blend(history, index, 10)
+        latencies.append(time.perf_counter() - lookup_started)
+
+    print(json.dumps({
+        "users": args.users,
+        "titles": args.titles,
+        "interactions": int(len(user_ids)),
+        "generate_seconds": round(generated - started, 2),
+        "build_seconds": round(built - generated, 2),
+        "pairs": int((neighbours >= 0).sum()),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "blend_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 3),
+            "p95": round(percentile(latencies, 95) * 1000, 3),
+            "p99": round(percentile(latencies, 99) * 1000, 3),
+        },
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
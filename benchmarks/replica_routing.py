@@ -0,0 +1,116 @@
+"""Read-your-writes and replica offload of the MySQL read routing.
+
+Against a primary and at least one replica (``docker-compose --profile
+replica up -d``), each of ``--threads`` threads repeatedly:
+
+1. writes a ``content_cache`` row on the primary and calls ``mark_written``
+   for its own scope, the way the subscription endpoints do;
+2. immediately reads the row back through
+   ``get_mysql_connection(read_only=True, scope=...)``; it must always see
+   its own write;
+3. reads it once more with no scope, where a replica may legitimately still
+   be behind;
+4. does ``--reads`` unscoped read-only lookups, which count towards the
+   replica share.
+
+It reports stale scoped reads (must be 0), stale unscoped reads, how reads
+were routed and the checkout+query latency of routed reads.
+
+    MYSQL_HOST=localhost MYSQL_PORT=3307 MYSQL_REPLICA_HOSTS=localhost:3308 REDIS_HOST=localhost \\
+        python -m benchmarks.replica_routing --writes 2000
+"""
+import argparse
+import json
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from app.core import database
+from benchmarks.loadtest import percentile
+
+
+def read_value(key, **route):
+    conn = database.get_mysql_connection(read_only=True, **route)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT content_data FROM content_cache WHERE cache_key = %s", (key,))
+        row = cursor.fetchone()
+        cursor.close()
+    finally:
+        conn.close()
+    return row[0] if row else None
+
+
+def worker(thread, writes, reads):
+    counts = Counter()
+    latencies = []
+    scope = f"benchmark:{thread}"
+    key = f"benchmark:replica_routing:{uuid.uuid4().hex}"
+    for n in range(writes):
+        value = json.dumps(n)
+        conn = database.get_mysql_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO content_cache (cache_key, content_data, expires_at) VALUES (%s, %s, NOW() + INTERVAL 1 HOUR) "
+            "ON DUPLICATE KEY UPDATE content_data = VALUES(content_data)",
+            (key, value)
+        )
+        conn.commit()
+        cursor.close()
+        conn.close()
+        database.mark_written(scope)
+
+        counts["scoped_reads"] += 1
+        if json.loads(read_value(key, scope=scope) or "null") != n:
+            counts["stale_scoped_reads"] += 1
+        counts["unscoped_reads"] += 1
+        if json.loads(read_value(key) or "null") != n:
+            counts["stale_unscoped_reads"] += 1
+        for _ in range(reads):
+            started = time.perf_counter()
+            read_value(key)
+            latencies.append(time.perf_counter() - started)
+
+    conn = database.get_mysql_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM content_cache WHERE cache_key = %s", (key,))
+    conn.commit()
+    cursor.close()
+    conn.close()
+    return counts, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writes", type=int, default=2000, help="per thread")
+    parser.add_argument("--reads", type=int, default=5, help="unscoped reads per write")
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    database.init_pools()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        results = list(pool.map(lambda thread: worker(thread, args.writes, args.reads), range(args.threads)))
+    wall = time.perf_counter() - started
+
+    counts = sum((result[0] for result in results), Counter())
+    latencies = [value for result in results for value in result[1]]
+    stats = database.pool_stats()
+    print(json.dumps({
+        "seconds": round(wall, 3),
+        "checks": dict(counts),
+        "routing": stats.get("mysql_routing"),
+        "replicas": {address: {"lag": replica["lag"], "reads": replica["reads"]}
+                     for address, replica in stats.get("mysql_replicas", {}).items()},
+        "read_latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 3),
+            "p95": round(percentile(latencies, 95) * 1000, 3),
+            "p99": round(percentile(latencies, 99) * 1000, 3),
+        },
+    }, indent=2))
+    database.close_pools()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""Build time, memory and query latency of the catalog search index.
+
+Generates ``--titles`` synthetic titles, ``--korean`` of them Korean (words
+made of Hangul syllables) and the rest English, with Zipf-distributed words
+and a genre and release year each. It builds the same index the API serves
+from, without touching MySQL, and times these query mixes against it:
+
+* ``word``: one whole title word, drawn by word popularity
+* ``two_words``: two words from the same title
+* ``partial``: a 3-character substring from the middle of a word
+* ``one_char``: a single character (matches word starts)
+* ``filtered``: ``word`` restricted to a genre and a year
+* ``autocomplete``: the first 1-4 characters of a title's words, as typed
+
+It then times ``--writes`` single-series writes going through the delta.
+
+    python -m benchmarks.search --titles 500000
+"""
+import argparse
+import json
+import resource
+import time
+
+import numpy as np
+
+from app.services import search
+
+GENRES = ["드라마", "예능", "Action", "Comedy", "Documentary", "Thriller", "Romance", "Animation", "SF", "Horror"]
+LETTERS = "abcdefghijklmnopqrstuvwxyz"
+
+
+def vocabulary(rng, size, korean):
+    words = set()
+    while len(words) < size:
+        length = int(rng.integers(2, 5) if korean else rng.integers(3, 10))
+        if korean:
+            words.add("".join(chr(0xAC00 + int(code)) for code in rng.integers(0, 11172 // 8, length) * 8))
+        else:
+            words.add("".join(LETTERS[int(i)] for i in rng.integers(0, len(LETTERS), length)))
+    return sorted(words)
+
+
+def corpus(titles, korean, vocab_size, zipf, seed):
+    rng = np.random.default_rng(seed)
+    vocabularies = [vocabulary(rng, vocab_size, False), vocabulary(rng, vocab_size, True)]
+    popularity = 1.0 / np.arange(1, vocab_size + 1) ** zipf
+    popularity /= popularity.sum()
+    lengths = rng.integers(1, 5, titles)
+    picks = rng.choice(vocab_size, size=int(lengths.sum()), p=popularity).tolist()
+    genres = rng.integers(0, len(GENRES), titles).tolist()
+    years = rng.integers(1980, 2025, titles).tolist()
+    docs, at = [], 0
+    for doc_id, length in enumerate(lengths.tolist(), 1):
+        words = vocabularies[doc_id <= korean]
+        title = " ".join(words[i] for i in picks[at:at + length]).title()
+        at += length
+        docs.append(search.make_doc("series", doc_id, title, (GENRES[genres[doc_id - 1]],), years[doc_id - 1]))
+    return docs
+
+
+def queries(docs, count, seed):
+    rng = np.random.default_rng(seed)
+    mixes = {name: [] for name in ("word", "two_words", "partial", "one_char", "filtered", "autocomplete")}
+    for i in rng.integers(0, len(docs), count):
+        doc = docs[int(i)]
+        words = doc.text[:doc.title_end].split()
+        word = words[int(rng.integers(0, len(words)))]
+        mixes["word"].append((word, None, None))
+        mixes["two_words"].append((" ".join(words[:2]), None, None))
+        start = int(rng.integers(0, max(1, len(word) - 2)))
+        mixes["partial"].append((word[start:start + 3], None, None))
+        mixes["one_char"].append((word[0], None, None))
+        mixes["filtered"].append((word, doc.genre, doc.year))
+        typed = int(rng.integers(1, 5))
+        mixes["autocomplete"].append(" ".join(words[:-1] + [words[-1][:typed]]))
+    return mixes
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def summarize(latencies):
+    return {
+        "p50": round(percentile(latencies, 50) * 1000, 3),
+        "p95": round(percentile(latencies, 95) * 1000, 3),
+        "p99": round(percentile(latencies, 99) * 1000, 3),
+        "max": round(max(latencies) * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--titles", type=int, default=500_000)
+    parser.add_argument("--korean", type=int, default=None, help="Korean titles (default: 40%%)")
+    parser.add_argument("--vocabulary", type=int, default=50_000, help="distinct words per language")
+    parser.add_argument("--zipf", type=float, default=1.0)
+    parser.add_argument("--queries", type=int, default=2000, help="per mix")
+    parser.add_argument("--writes", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    korean = int(args.titles * 0.4) if args.korean is None else args.korean
+
+    started = time.perf_counter()
+    docs = corpus(args.titles, korean, args.vocabulary, args.zipf, args.seed)
+    generated = time.perf_counter()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    index = search.build_index(list(docs))
+    built = time.perf_counter()
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    results = {}
+    for name, mix in queries(docs, args.queries, args.seed + 1).items():
+        latencies, totals = [], []
+        for query in mix:
+            query_started = time.perf_counter()
+            if name == "autocomplete":
+                search.autocomplete(query, index=index)
+            else:
+                totals.append(search.search(*query, index=index)["total"])
+            latencies.append(time.perf_counter() - query_started)
+        results[name] = summarize(latencies)
+        if totals:
+            results[name]["median_matches"] = int(np.median(totals))
+
+    latencies = []
+    for doc_id in range(args.writes):
+        doc = search.make_doc("series", args.titles + doc_id + 1, f"Benchmark Title {doc_id}", ("SF",), 2024)
+        write_started = time.perf_counter()
+        index = index.with_doc(doc)
+        latencies.append(time.perf_counter() - write_started)
+    results["write"] = summarize(latencies)
+    query_started = time.perf_counter()
+    search.search("benchmark", index=index)
+    results["write"]["query_after_writes_ms"] = round((time.perf_counter() - query_started) * 1000, 3)
+
+    print(json.dumps({
+        "titles": args.titles,
+        "korean_titles": korean,
+        "generate_seconds": round(generated - started, 2),
+        "build_seconds": round(built - generated, 2),
+        "words": len(index.base.words),
+        "grams": len(index.base.grams),
+        "postings": int(len(index.base.postings)),
+        "build_rss_mb": round((rss_after - rss_before) / 1024, 1),
+        "peak_rss_mb": round(rss_after / 1024, 1),
+        "latency_ms": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""Seed MySQL, Mongo and Redis with synthetic users, catalog and viewing history.
+
+Writes to the databases the API is configured for (the usual MYSQL_*,
+MONGO_URI and REDIS_* env vars, i.e. the ``docker-compose.yml`` services on
+top of ``db/mysql/schema.sql``):
+
+* ``--users`` users (``{prefix}{n}``, all with password ``--password``), each
+  with an active subscription on a random plan
+* ``--series`` series with 1-3 seasons of 6-16 episodes each, in MySQL and
+  the Mongo ``series`` collection
+* viewing history: Poisson(``--history``) episodes per user, drawn with
+  Zipf-like series popularity, into ``viewing_progress``, plus
+  ``--logs-per-episode`` ``viewing_logs`` heartbeats per watched episode,
+  each on the user's viewing shard when ``VIEWING_SHARDS`` is set
+* the derived state the API expects: user rollups (``analytics backfill``),
+  trending buckets (``trending backfill``) and a new catalog revision
+
+Rows get ids after the current maximum, so seeding an existing database adds
+to it. ``--truncate`` empties the tables, collections and Redis database
+first; only use it on a dedicated benchmark instance. The same ``--seed``
+always produces the same data. A manifest describing what was seeded (id
+ranges, usernames, title words) is written to ``--manifest`` for
+``benchmarks.mixes``.
+
+    docker-compose up -d mysql mongodb redis
+    python -m benchmarks.seed --users 10000 --series 500 --truncate
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+from operator import itemgetter
+
+import numpy as np
+
+from app.core import sharding
+from app.core.config import settings
+from app.core.database import get_mongo_client, get_mysql_connection, get_redis
+from app.core.security import pwd_context
+from app.services import analytics, catalog, progress_buffer, trending
+
+WORDS = [
+    "사랑", "비밀", "전쟁", "바다", "도시", "형사", "왕국", "학교", "가족", "여름",
+    "Night", "Empire", "Shadow", "Crown", "River", "Signal", "Winter", "Code", "Run", "Blue",
+]
+GENRES = ["드라마", "예능", "Action", "Comedy", "Documentary", "Thriller", "Romance", "Animation"]
+RATINGS = ["ALL", "12", "15", "19"]
+PLANS = ["basic", "standard", "premium"]
+TABLES = ["viewing_progress", "subscriptions", "reviews", "content_similarity", "content_cache", "episodes",
+          "seasons", "series", "users"]
+
+
+def next_id(cursor, table):
+    cursor.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {table}")
+    return int(cursor.fetchone()[0])
+
+
+def insert(conn, cursor, statement, rows, batch):
+    for start in range(0, len(rows), batch):
+        cursor.executemany(statement, rows[start:start + batch])
+        conn.commit()
+
+
+def truncate(conn, cursor):
+    cursor.execute("SET FOREIGN_KEY_CHECKS = 0")
+    for table in TABLES:
+        cursor.execute(f"TRUNCATE TABLE {table}")
+    cursor.execute("SET FOREIGN_KEY_CHECKS = 1")
+    conn.commit()
+    db = get_mongo_client()[settings.MONGO_DATABASE]
+    db.viewing_logs.delete_many({})
+    db.series.delete_many({})
+    db[analytics.ROLLUPS].delete_many({})
+    for shard in sharding.shard_names()[1:]:
+        shard_conn = sharding.mysql_connection(shard)
+        shard_cursor = shard_conn.cursor()
+        shard_cursor.execute("TRUNCATE TABLE viewing_progress")
+        shard_cursor.close()
+        shard_conn.close()
+        sharding.mongo_db(shard).viewing_logs.delete_many({})
+    # Also drops the shard map, so users are back on VIEWING_SHARD_RING
+    get_redis().flushdb()
+
+
+def seed_catalog(conn, cursor, rng, series_count, batch):
+    first_series = next_id(cursor, "series")
+    first_season = next_id(cursor, "seasons")
+    first_episode = next_id(cursor, "episodes")
+    series, seasons, episodes = [], [], []
+    season_id, episode_id = first_season, first_episode
+    episode_series, episode_durations = [], []
+    for series_id in range(first_series, first_series + series_count):
+        words = rng.choice(len(WORDS), int(rng.integers(1, 4)), replace=False)
+        year = int(rng.integers(1990, 2025))
+        series.append((
+            series_id, " ".join(WORDS[int(i)] for i in words), f"Synthetic series {series_id}",
+            year, GENRES[int(rng.integers(0, len(GENRES)))], RATINGS[int(rng.integers(0, len(RATINGS)))],
+        ))
+        for number in range(1, int(rng.integers(1, 4)) + 1):
+            released = datetime(year, 1, 1) + timedelta(days=365 * (number - 1))
+            seasons.append((season_id, series_id, number, f"Season {number}", released.date()))
+            for episode in range(1, int(rng.integers(6, 17)) + 1):
+                duration = int(rng.integers(20, 70)) * 60
+                episodes.append((
+                    episode_id, season_id, episode, f"Episode {episode}", None, duration,
+                    (released + timedelta(weeks=episode - 1)).date(),
+                ))
+                episode_series.append(series_id)
+                episode_durations.append(duration)
+                episode_id += 1
+            season_id += 1
+
+    insert(conn, cursor, "INSERT INTO series (id, title, description, release_year, genre, rating) "
+                         "VALUES (%s, %s, %s, %s, %s, %s)", series, batch)
+    insert(conn, cursor, "INSERT INTO seasons (id, series_id, season_number, title, release_date) "
+                         "VALUES (%s, %s, %s, %s, %s)", seasons, batch)
+    insert(conn, cursor, "INSERT INTO episodes (id, season_id, episode_number, title, description, duration, "
+                         "release_date) VALUES (%s, %s, %s, %s, %s, %s, %s)", episodes, batch)
+    # The /api/series routes read the catalog from Mongo
+    fields = ("_id", "title", "description", "release_year", "genre", "rating")
+    get_mongo_client()[settings.MONGO_DATABASE].series.insert_many([dict(zip(fields, row)) for row in series])
+    return {
+        "series": [first_series, first_series + series_count - 1],
+        "episodes": [first_episode, episode_id - 1],
+    }, np.array(episode_series), np.array(episode_durations)
+
+
+def seed_users(conn, cursor, rng, count, prefix, password, batch):
+    first = next_id(cursor, "users")
+    password_hash = pwd_context.hash(password)
+    now = datetime.now()
+    users, subscriptions = [], []
+    for user_id in range(first, first + count):
+        username = f"{prefix}{user_id}"
+        users.append((user_id, username, f"{username}@example.com", password_hash))
+        started = now - timedelta(days=int(rng.integers(0, 300)))
+        subscriptions.append((user_id, PLANS[int(rng.integers(0, len(PLANS)))], started, now + timedelta(days=365)))
+    insert(conn, cursor, "INSERT INTO users (id, username, email, password_hash) VALUES (%s, %s, %s, %s)",
+           users, batch)
+    insert(conn, cursor, "INSERT INTO subscriptions (user_id, plan_type, start_date, end_date) "
+                         "VALUES (%s, %s, %s, %s)", subscriptions, batch)
+    return [first, first + count - 1]
+
+
+def seed_history(conn, cursor, rng, user_ids, episode_ids, episode_series, durations, history, zipf,
+                 logs_per_episode, batch):
+    """viewing_progress rows and viewing_logs heartbeats, popular series first."""
+    series_ids = np.unique(episode_series)
+    popularity = 1.0 / np.arange(1, len(series_ids) + 1) ** zipf
+    popularity = popularity[rng.permutation(len(series_ids))]
+    weights = popularity[np.searchsorted(series_ids, episode_series)]
+    weights /= weights.sum()
+    now = datetime.now()
+    progress_rows, logs, total_rows, total_logs = [], [], 0, 0
+
+    def flush():
+        # Each user's history goes to their viewing shard (app/core/sharding.py)
+        for shard, rows in sharding.group_for_write(progress_rows, itemgetter(0)).items():
+            shard_conn = conn if shard == sharding.MAIN else sharding.mysql_connection(shard)
+            shard_cursor = shard_conn.cursor()
+            insert(shard_conn, shard_cursor, "INSERT INTO viewing_progress (user_id, episode_id, progress, completed, "
+                                             "last_watched) VALUES (%s, %s, %s, %s, %s)", rows, batch)
+            shard_cursor.close()
+            if shard_conn is not conn:
+                shard_conn.close()
+        for shard, documents in sharding.group_for_write(logs, itemgetter("user_id")).items():
+            if documents:
+                sharding.mongo_db(shard).viewing_logs.insert_many(documents, ordered=False)
+        del progress_rows[:], logs[:]
+
+    for user_id in range(user_ids[0], user_ids[1] + 1):
+        watched = min(int(rng.poisson(history)), len(episode_series))
+        if not watched:
+            continue
+        picks = rng.choice(len(episode_series), watched, replace=False, p=weights)
+        for index in picks.tolist():
+            duration = int(durations[index])
+            progress = int(rng.integers(60, duration + 1))
+            last_watched = now - timedelta(seconds=int(rng.integers(0, 7 * 86400)))
+            episode_id = episode_ids[0] + index
+            progress_rows.append((user_id, episode_id, progress, progress >= duration - 60, last_watched))
+            for beat in range(logs_per_episode):
+                logs.append(progress_buffer.viewing_log_document(
+                    user_id, episode_id, progress * (beat + 1) // logs_per_episode,
+                    last_watched - timedelta(minutes=logs_per_episode - beat - 1)
+                ))
+        if len(progress_rows) >= batch:
+            total_rows += len(progress_rows)
+            total_logs += len(logs)
+            flush()
+    total_rows += len(progress_rows)
+    total_logs += len(logs)
+    flush()
+    return total_rows, total_logs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--series", type=int, default=500)
+    parser.add_argument("--history", type=float, default=20, help="mean episodes watched per user")
+    parser.add_argument("--zipf", type=float, default=1.0, help="skew of series popularity")
+    parser.add_argument("--logs-per-episode", type=int, default=3)
+    parser.add_argument("--prefix", default="bench_")
+    parser.add_argument("--password", default="benchmark-password")
+    parser.add_argument("--batch", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--truncate", action="store_true", help="empty MySQL tables, Mongo logs and Redis first")
+    parser.add_argument("--manifest", default="benchmarks/seed_manifest.json")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    conn = get_mysql_connection()
+    cursor = conn.cursor()
+    timings = {}
+    started = time.perf_counter()
+    if args.truncate:
+        truncate(conn, cursor)
+    ranges, episode_series, durations = seed_catalog(conn, cursor, rng, args.series, args.batch)
+    timings["catalog"] = time.perf_counter() - started
+    ranges["users"] = seed_users(conn, cursor, rng, args.users, args.prefix, args.password, args.batch)
+    timings["users"] = time.perf_counter() - started - sum(timings.values())
+    progress_rows, log_documents = seed_history(
+        conn, cursor, rng, ranges["users"], ranges["episodes"], episode_series, durations,
+        args.history, args.zipf, args.logs_per_episode, args.batch
+    )
+    timings["history"] = time.perf_counter() - started - sum(timings.values())
+    cursor.close()
+    conn.close()
+
+    rollups = analytics.backfill()
+    buckets = trending.backfill()
+    catalog.bump_revision()
+    timings["derived"] = time.perf_counter() - started - sum(timings.values())
+
+    manifest = {
+        "seed": args.seed,
+        "users": {"ids": ranges["users"], "username": args.prefix + "{id}", "password": args.password},
+        "series": ranges["series"],
+        "episodes": ranges["episodes"],
+        "words": WORDS,
+        "genres": GENRES,
+        "counts": {
+            "viewing_progress": progress_rows,
+            "viewing_logs": log_documents,
+            "user_rollups": rollups,
+            "trending_buckets": buckets,
+        },
+        "seconds": {name: round(value, 2) for name, value in timings.items()},
+    }
+    with open(args.manifest, "w") as out:
+        json.dump(manifest, out, indent=2, ensure_ascii=False)
+    print(json.dumps(manifest, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Acquire latency of the concurrent-stream limiter under racing starts.
+
+Fires ``--starts`` concurrent session starts spread over ``--users`` users
+straight at Redis (REDIS_HOST/REDIS_PORT env vars), then checks that no user
+ended up with more live leases than their plan allows.
+
+    python -m benchmarks.session_leases --starts 5000 --users 500 --threads 64
+"""
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.core.database import get_redis
+from app.services import sessions
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--starts", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--threads", type=int, default=64)
+    parser.add_argument("--plan", default="standard")
+    args = parser.parse_args()
+
+    r = get_redis()
+    base = 10_000_000  # keep clear of real user ids
+    for user_id in range(base, base + args.users):
+        r.delete(sessions.SESSIONS_KEY.format(user_id))
+
+    def start(i):
+        started = time.perf_counter()
+        session_id = sessions.acquire(base + i % args.users, 1, args.plan)
+        return time.perf_counter() - started, session_id is not None
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        results = list(pool.map(start, range(args.starts)))
+    wall = time.perf_counter() - started
+
+    limit = sessions.stream_limit(args.plan)
+    over_limit = sum(
+        1 for user_id in range(base, base + args.users)
+        if r.zcard(sessions.SESSIONS_KEY.format(user_id)) > limit
+    )
+    latencies = [latency for latency, _ in results]
+    print(json.dumps({
+        "starts": args.starts,
+        "users": args.users,
+        "threads": args.threads,
+        "acquired": sum(1 for _, ok in results if ok),
+        "expected_acquired": min(args.starts, args.users * limit),
+        "users_over_limit": over_limit,
+        "acquires_per_second": round(args.starts / wall, 1),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 3),
+            "p95": round(percentile(latencies, 95) * 1000, 3),
+            "p99": round(percentile(latencies, 99) * 1000, 3),
+        },
+    }, indent=2))
+
+    for user_id in range(base, base + args.users):
+        r.delete(sessions.SESSIONS_KEY.format(user_id))
+
+
+if __name__ == "__main__":
+    main()
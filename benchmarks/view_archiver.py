@@ -0,0 +1,121 @@
+"""Throughput and replication-lag impact of view_history archiving.
+
+Seeds ``--rows`` view_history rows older than the retention cutoff (for an
+existing ``--user-id``/``--content-id``), then archives them either with the
+chunked archiver or, with ``--baseline``, with the old ``archive_old_views()``
+procedure. While it runs, a sampler polls the replica (ARCHIVE_REPLICA_HOST)
+every ``--sample-interval`` seconds and reports the peak and mean lag it saw.
+
+    python -m benchmarks.view_archiver --rows 500000 --user-id 1 --content-id 1
+    python -m benchmarks.view_archiver --rows 500000 --user-id 1 --content-id 1 --baseline
+
+Run it against a database with no other archivable rows so both variants move
+the same data. MySQL settings come from the usual MYSQL_* env vars and
+PLATFORM_MYSQL_DATABASE.
+"""
+import argparse
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+
+from app.core.config import settings
+from app.core.database import connect_platform
+from app.services import view_archiver
+
+
+def seed(rows, user_id, content_id, batch=5000):
+    conn = connect_platform()
+    cursor = conn.cursor()
+    oldest = datetime.now() - timedelta(days=settings.ARCHIVE_RETENTION_DAYS + 60)
+    for start in range(0, rows, batch):
+        values = [
+            (user_id, content_id, oldest + timedelta(seconds=i), 1200, 50.0, '{"type": "benchmark"}')
+            for i in range(start, min(rows, start + batch))
+        ]
+        cursor.executemany(
+            "INSERT INTO view_history (user_id, content_id, watch_date, watch_duration, watch_progress, device_info) "
+            "VALUES (%s, %s, %s, %s, %s, %s)",
+            values
+        )
+        conn.commit()
+    cursor.close()
+    conn.close()
+
+
+class LagSampler(threading.Thread):
+    def __init__(self, interval):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.samples = []
+        self.done = threading.Event()
+        self.throttle = view_archiver.Throttle()
+
+    def run(self):
+        while not self.done.is_set():
+            lag = self.throttle.replica_lag()
+            if lag is not None:
+                self.samples.append(lag)
+            self.done.wait(self.interval)
+        self.throttle.close()
+
+    def summary(self):
+        if not self.samples:
+            return None
+        return {"max": max(self.samples), "mean": round(sum(self.samples) / len(self.samples), 2)}
+
+
+def baseline():
+    conn = connect_platform()
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM view_history WHERE watch_date < DATE_SUB(NOW(), INTERVAL 1 YEAR)")
+    rows = cursor.fetchone()[0]
+    started = time.perf_counter()
+    cursor.callproc("archive_old_views")
+    conn.commit()
+    elapsed = time.perf_counter() - started
+    cursor.close()
+    conn.close()
+    # The procedure is one transaction, so its only "chunk" is the whole run.
+    return {
+        "mode": "archive_old_views()",
+        "rows": rows,
+        "chunks": 1,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(rows / elapsed, 1) if elapsed else None,
+        "max_chunk_seconds": round(elapsed, 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--user-id", type=int, required=True)
+    parser.add_argument("--content-id", type=int, required=True)
+    parser.add_argument("--chunk-size", type=int, default=settings.ARCHIVE_CHUNK_SIZE)
+    parser.add_argument("--pause", type=float, default=settings.ARCHIVE_CHUNK_PAUSE)
+    parser.add_argument("--sample-interval", type=float, default=0.5)
+    parser.add_argument("--baseline", action="store_true", help="run archive_old_views() instead")
+    parser.add_argument("--skip-seed", action="store_true")
+    args = parser.parse_args()
+
+    if not args.skip_seed:
+        seed(args.rows, args.user_id, args.content_id)
+
+    sampler = LagSampler(args.sample_interval)
+    sampler.start()
+    if args.baseline:
+        result = baseline()
+    else:
+        result = view_archiver.run(args.chunk_size, view_archiver.Throttle(pause=args.pause))
+    # Let the replica catch up so the tail of the lag is captured too.
+    time.sleep(args.sample_interval * 4)
+    sampler.done.set()
+    sampler.join()
+
+    result["replica_lag_seconds"] = sampler.summary()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
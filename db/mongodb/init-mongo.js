@@ -63,3 +63,12 @@ db.createCollection("error_logs", {
         }
     }
 });
+
+// Indexes used by the API (kept in sync with app/core/migrations.py)
+db.viewing_logs.createIndex({ user_id: 1, timestamp: -1 });
+db.viewing_logs.createIndex({ episode_id: 1, timestamp: -1 });
+db.user_behaviors.createIndex({ user_id: 1, timestamp: -1 });
+db.user_behaviors.createIndex({ action_type: 1, timestamp: -1 });
+db.performance_metrics.createIndex({ metric_type: 1, timestamp: -1 });
+db.error_logs.createIndex({ timestamp: -1 });
+db.error_logs.createIndex({ severity: 1, timestamp: -1 });
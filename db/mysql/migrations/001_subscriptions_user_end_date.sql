@@ -0,0 +1,3 @@
+-- Active-subscription lookups filter on user_id and end_date
+-- (entitlement checks, create_subscription, /subscriptions/current).
+CREATE INDEX idx_subscriptions_user_end ON subscriptions (user_id, end_date);
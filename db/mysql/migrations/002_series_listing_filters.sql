@@ -0,0 +1,4 @@
+-- Keyset pagination on /series seeks on id; these let the genre and
+-- release_year filters seek the same way instead of scanning.
+CREATE INDEX idx_series_genre_id ON series (genre, id);
+CREATE INDEX idx_series_release_year_id ON series (release_year, id);
@@ -0,0 +1,13 @@
+-- MySQL tier of the tiered content cache (app/core/tiered_cache.py).
+-- The sweeper deletes by expires_at and, above CONTENT_CACHE_MAX_ROWS,
+-- by last_accessed; both need an index to avoid full scans.
+CREATE TABLE IF NOT EXISTS content_cache (
+    cache_key VARCHAR(255) PRIMARY KEY,
+    content_data JSON,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    expires_at DATETIME,
+    last_accessed DATETIME,
+    access_count INT DEFAULT 0,
+    INDEX idx_content_cache_expires (expires_at),
+    INDEX idx_content_cache_last_accessed (last_accessed)
+);
@@ -0,0 +1,12 @@
+-- Series-to-series neighbours for /recommendations. content_id1/2 are
+-- series ids; similarity_factors records the co-viewer count. The batch
+-- job replaces old rows by deleting on last_updated.
+CREATE TABLE IF NOT EXISTS content_similarity (
+    content_id1 INT NOT NULL,
+    content_id2 INT NOT NULL,
+    similarity_score FLOAT NOT NULL,
+    similarity_factors JSON,
+    last_updated DATETIME DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (content_id1, content_id2),
+    INDEX idx_content_similarity_updated (last_updated)
+);
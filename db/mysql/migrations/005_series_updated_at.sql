@@ -0,0 +1,5 @@
+-- The search index in each worker re-reads the series changed since its last
+-- look (app/services/search.py) by seeking on updated_at.
+ALTER TABLE series
+    ADD COLUMN updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    ADD INDEX idx_series_updated_at (updated_at);
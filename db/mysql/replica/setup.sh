@@ -0,0 +1,32 @@
+#!/bin/bash
+# Seeds the local replica (docker-compose --profile replica) from the primary
+# and starts replication at the dump's binlog position. Safe to re-run: does
+# nothing once the replica is configured.
+set -euo pipefail
+
+PRIMARY=(-h mysql -uroot -p"$MYSQL_ROOT_PASSWORD")
+REPLICA=(-h mysql-replica -uroot -p"$MYSQL_ROOT_PASSWORD")
+
+for target in mysql mysql-replica; do
+    until mysqladmin ping -h "$target" -uroot -p"$MYSQL_ROOT_PASSWORD" --silent; do sleep 2; done
+done
+
+if [ -n "$(mysql "${REPLICA[@]}" -N -e 'SHOW REPLICA STATUS')" ]; then
+    echo "Replica already configured"
+    exit 0
+fi
+
+databases=$(mysql "${PRIMARY[@]}" -N -e "
+    SELECT schema_name FROM information_schema.schemata
+    WHERE schema_name NOT IN ('mysql', 'sys', 'information_schema', 'performance_schema')")
+
+# --source-data=1 writes the CHANGE REPLICATION SOURCE TO ... position into the dump
+mysqldump "${PRIMARY[@]}" --single-transaction --source-data=1 --routines --triggers \
+    --databases $databases | mysql "${REPLICA[@]}"
+
+mysql "${REPLICA[@]}" -e "
+    CHANGE REPLICATION SOURCE TO SOURCE_HOST = 'mysql', SOURCE_USER = 'root',
+        SOURCE_PASSWORD = '$MYSQL_ROOT_PASSWORD', GET_SOURCE_PUBLIC_KEY = 1;
+    GRANT REPLICATION CLIENT ON *.* TO '$MYSQL_USER'@'%';
+    START REPLICA;"
+echo "Replicating: $databases"
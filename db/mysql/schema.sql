@@ -17,7 +17,8 @@ CREATE TABLE subscriptions (
     end_date TIMESTAMP NOT NULL,
     auto_renewal BOOLEAN DEFAULT TRUE,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users(id)
+    FOREIGN KEY (user_id) REFERENCES users(id),
+    INDEX idx_subscriptions_user_end (user_id, end_date)
 );
 
 -- Series table
@@ -28,7 +29,11 @@ CREATE TABLE series (
     release_year INT NOT NULL,
     genre VARCHAR(50) NOT NULL,
     rating VARCHAR(10) NOT NULL,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    INDEX idx_series_genre_id (genre, id),
+    INDEX idx_series_release_year_id (release_year, id),
+    INDEX idx_series_updated_at (updated_at)
 );
 
 -- Seasons table
@@ -84,3 +89,26 @@ CREATE TABLE viewing_progress (
     FOREIGN KEY (episode_id) REFERENCES episodes(id),
     UNIQUE KEY user_episode_progress (user_id, episode_id)
 );
+
+-- Content cache table (MySQL tier of app/core/tiered_cache.py)
+CREATE TABLE content_cache (
+    cache_key VARCHAR(255) PRIMARY KEY,
+    content_data JSON,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    expires_at DATETIME,
+    last_accessed DATETIME,
+    access_count INT DEFAULT 0,
+    INDEX idx_content_cache_expires (expires_at),
+    INDEX idx_content_cache_last_accessed (last_accessed)
+);
+
+-- Item-item similarity between series, rebuilt by app/services/recommendations.py
+CREATE TABLE content_similarity (
+    content_id1 INT NOT NULL,
+    content_id2 INT NOT NULL,
+    similarity_score FLOAT NOT NULL,
+    similarity_factors JSON,
+    last_updated DATETIME DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (content_id1, content_id2),
+    INDEX idx_content_similarity_updated (last_updated)
+);
@@ -0,0 +1,15 @@
+-- Viewing shard schema (app/core/sharding.py)
+-- A shard only holds per-user viewing data. Users and the catalog stay on the
+-- main database, so there are no foreign keys; episodes are mapped to series
+-- by the application. Otherwise the table matches db/mysql/schema.sql.
+CREATE TABLE viewing_progress (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    user_id INT NOT NULL,
+    episode_id INT NOT NULL,
+    progress INT NOT NULL, -- in seconds
+    completed BOOLEAN DEFAULT FALSE,
+    last_watched TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    UNIQUE KEY user_episode_progress (user_id, episode_id)
+);
@@ -0,0 +1,15 @@
+-- Online view_history archiving (app/services/view_archiver.py):
+-- the archiver walks old rows in (watch_date, view_id) order, and records
+-- its position so an interrupted run can resume.
+USE coupang_play;
+
+CREATE INDEX idx_view_history_watch_date ON view_history(watch_date);
+
+CREATE TABLE IF NOT EXISTS archive_checkpoint (
+    job VARCHAR(50) PRIMARY KEY,
+    cutoff DATETIME NOT NULL COMMENT '이번 실행의 아카이브 기준 시각',
+    last_watch_date DATETIME NOT NULL,
+    last_view_id INT NOT NULL,
+    rows_moved BIGINT NOT NULL DEFAULT 0,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+) COMMENT '아카이빙 작업 체크포인트';
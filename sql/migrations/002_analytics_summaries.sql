@@ -0,0 +1,128 @@
+-- Summary tables that replace the content_popularity / user_engagement /
+-- subscription_metrics views. After applying, seed them once with
+--   python -m app.services.summaries rebuild
+USE coupang_play;
+
+-- content_popularity / user_engagement / subscription_metrics 뷰의 증분 유지 요약 테이블
+-- (뷰는 매 조회마다 전체 이력을 다시 집계하고 view_history와 review를 함께 JOIN해 행이 중복 집계됨)
+-- * review, subscription 변경분은 아래 트리거가 즉시 반영
+-- * view_history는 쓰기가 많아 트리거 대신 app/services/summaries.py의 delta 작업이
+--   view_id 기준 high-water mark(summary_watermarks) 이후 행만 일괄 반영
+-- * 시청 집계는 아카이브된 행을 포함한 전체 기간 기준
+CREATE TABLE content_popularity_summary (
+    content_id INT PRIMARY KEY,
+    unique_viewers INT NOT NULL DEFAULT 0,
+    view_count BIGINT NOT NULL DEFAULT 0,
+    watch_duration_total BIGINT NOT NULL DEFAULT 0,
+    watch_duration_count BIGINT NOT NULL DEFAULT 0,
+    review_count INT NOT NULL DEFAULT 0,
+    rating_total BIGINT NOT NULL DEFAULT 0,
+    rating_count INT NOT NULL DEFAULT 0,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    INDEX idx_content_popularity_viewers (unique_viewers, content_id)
+) COMMENT '콘텐츠 인기도 요약';
+
+-- unique_viewers 증분 계산용 (콘텐츠, 사용자) 쌍
+CREATE TABLE content_viewers (
+    content_id INT NOT NULL,
+    user_id INT NOT NULL,
+    PRIMARY KEY (content_id, user_id)
+) COMMENT '콘텐츠별 시청자 목록';
+
+CREATE TABLE user_engagement_summary (
+    user_id INT PRIMARY KEY,
+    total_views BIGINT NOT NULL DEFAULT 0,
+    total_watch_time BIGINT NOT NULL DEFAULT 0,
+    review_count INT NOT NULL DEFAULT 0,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+) COMMENT '사용자 참여도 요약';
+
+CREATE TABLE subscription_metrics_summary (
+    plan_name VARCHAR(50) PRIMARY KEY COMMENT 'NULL 요금제는 빈 문자열',
+    total_subscriptions INT NOT NULL DEFAULT 0,
+    active_subscriptions INT NOT NULL DEFAULT 0,
+    active_price_total DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    active_price_count INT NOT NULL DEFAULT 0,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+) COMMENT '구독 지표 요약';
+
+-- delta 작업 진행 위치: last_id까지 반영 완료. observed_id는 직전 실행에서 본 MAX(view_id)로,
+-- 늦게 커밋되는 트랜잭션을 놓치지 않도록 SUMMARY_SETTLE_SECONDS가 지난 뒤에야 반영 대상이 됨
+CREATE TABLE summary_watermarks (
+    name VARCHAR(50) PRIMARY KEY,
+    last_id BIGINT NOT NULL DEFAULT 0,
+    observed_id BIGINT NOT NULL DEFAULT 0,
+    observed_at DATETIME,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+) COMMENT '요약 테이블 delta 작업 high-water mark';
+
+DELIMITER //
+
+CREATE PROCEDURE summary_add_review(p_content_id INT, p_user_id INT, p_rating INT, p_sign INT)
+BEGIN
+    IF p_content_id IS NOT NULL THEN
+        INSERT INTO content_popularity_summary (content_id, review_count, rating_total, rating_count)
+        VALUES (p_content_id, p_sign, p_sign * IFNULL(p_rating, 0), p_sign * (p_rating IS NOT NULL))
+        ON DUPLICATE KEY UPDATE
+            review_count = review_count + VALUES(review_count),
+            rating_total = rating_total + VALUES(rating_total),
+            rating_count = rating_count + VALUES(rating_count);
+    END IF;
+    IF p_user_id IS NOT NULL THEN
+        INSERT INTO user_engagement_summary (user_id, review_count)
+        VALUES (p_user_id, p_sign)
+        ON DUPLICATE KEY UPDATE review_count = review_count + VALUES(review_count);
+    END IF;
+END //
+
+CREATE TRIGGER review_summary_insert AFTER INSERT ON review FOR EACH ROW
+BEGIN
+    CALL summary_add_review(NEW.content_id, NEW.user_id, NEW.rating, 1);
+END //
+
+CREATE TRIGGER review_summary_update AFTER UPDATE ON review FOR EACH ROW
+BEGIN
+    CALL summary_add_review(OLD.content_id, OLD.user_id, OLD.rating, -1);
+    CALL summary_add_review(NEW.content_id, NEW.user_id, NEW.rating, 1);
+END //
+
+CREATE TRIGGER review_summary_delete AFTER DELETE ON review FOR EACH ROW
+BEGIN
+    CALL summary_add_review(OLD.content_id, OLD.user_id, OLD.rating, -1);
+END //
+
+CREATE PROCEDURE summary_add_subscription(p_plan_name VARCHAR(50), p_is_active BOOLEAN, p_price DECIMAL(10, 2), p_sign INT)
+BEGIN
+    INSERT INTO subscription_metrics_summary
+        (plan_name, total_subscriptions, active_subscriptions, active_price_total, active_price_count)
+    VALUES (
+        IFNULL(p_plan_name, ''),
+        p_sign,
+        p_sign * IFNULL(p_is_active = 1, 0),
+        p_sign * IF(p_is_active = 1, IFNULL(p_price, 0), 0),
+        p_sign * IFNULL(p_is_active = 1 AND p_price IS NOT NULL, 0)
+    )
+    ON DUPLICATE KEY UPDATE
+        total_subscriptions = total_subscriptions + VALUES(total_subscriptions),
+        active_subscriptions = active_subscriptions + VALUES(active_subscriptions),
+        active_price_total = active_price_total + VALUES(active_price_total),
+        active_price_count = active_price_count + VALUES(active_price_count);
+END //
+
+CREATE TRIGGER subscription_summary_insert AFTER INSERT ON subscription FOR EACH ROW
+BEGIN
+    CALL summary_add_subscription(NEW.plan_name, NEW.is_active, NEW.price, 1);
+END //
+
+CREATE TRIGGER subscription_summary_update AFTER UPDATE ON subscription FOR EACH ROW
+BEGIN
+    CALL summary_add_subscription(OLD.plan_name, OLD.is_active, OLD.price, -1);
+    CALL summary_add_subscription(NEW.plan_name, NEW.is_active, NEW.price, 1);
+END //
+
+CREATE TRIGGER subscription_summary_delete AFTER DELETE ON subscription FOR EACH ROW
+BEGIN
+    CALL summary_add_subscription(OLD.plan_name, OLD.is_active, OLD.price, -1);
+END //
+
+DELIMITER ;
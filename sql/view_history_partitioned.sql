@@ -0,0 +1,63 @@
+-- Optional: monthly RANGE partitioning of view_history on watch_date.
+--
+-- With this layout app/services/view_archiver.py archives a whole month
+-- with EXCHANGE PARTITION + DROP PARTITION (metadata-only) instead of
+-- deleting rows, and keeps ARCHIVE_FUTURE_PARTITIONS months of empty
+-- partitions ahead by splitting p_future.
+--
+-- MySQL partitioning requirements:
+--   * the partitioning column must be part of every unique key, so the
+--     primary key becomes (view_id, watch_date) and watch_date NOT NULL;
+--   * partitioned InnoDB tables cannot have foreign keys, so the
+--     user/content references are dropped (deletes cascade from the
+--     application instead).
+--
+-- This ALTER rebuilds the table. On a large live table run it through an
+-- online schema change tool (gh-ost / pt-online-schema-change) rather
+-- than directly. Partition names are p<YYYYMM> of the month they hold;
+-- p_start holds everything before the first month.
+USE coupang_play;
+
+ALTER TABLE view_history
+    DROP FOREIGN KEY view_history_ibfk_1,
+    DROP FOREIGN KEY view_history_ibfk_2;
+
+-- The partition list is generated from the month of the oldest row through
+-- the current month plus 3 (ARCHIVE_FUTURE_PARTITIONS' default), so p_future
+-- starts out empty and the archiver only ever splits empty partitions.
+DELIMITER //
+
+CREATE PROCEDURE partition_view_history(IN months_ahead INT)
+BEGIN
+    DECLARE month_start DATE;
+    DECLARE last_month DATE;
+    DECLARE parts TEXT;
+
+    SELECT DATE_FORMAT(COALESCE(MIN(watch_date), CURDATE()), '%Y-%m-01') INTO month_start FROM view_history;
+    SET last_month = DATE_ADD(DATE_FORMAT(CURDATE(), '%Y-%m-01'), INTERVAL months_ahead MONTH);
+    SET parts = CONCAT("PARTITION p_start VALUES LESS THAN ('", month_start, "')");
+    WHILE month_start <= last_month DO
+        SET parts = CONCAT(parts, ", PARTITION p", DATE_FORMAT(month_start, '%Y%m'),
+                           " VALUES LESS THAN ('", DATE_ADD(month_start, INTERVAL 1 MONTH), "')");
+        SET month_start = DATE_ADD(month_start, INTERVAL 1 MONTH);
+    END WHILE;
+
+    SET @ddl = CONCAT(
+        "ALTER TABLE view_history ",
+        "MODIFY watch_date DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP, ",
+        "DROP PRIMARY KEY, ADD PRIMARY KEY (view_id, watch_date) ",
+        "PARTITION BY RANGE COLUMNS (watch_date) (", parts,
+        ", PARTITION p_future VALUES LESS THAN (MAXVALUE))"
+    );
+    PREPARE stmt FROM @ddl;
+    EXECUTE stmt;
+    DEALLOCATE PREPARE stmt;
+END //
+
+DELIMITER ;
+
+CALL partition_view_history(3);
+DROP PROCEDURE partition_view_history;
+
+-- Later months are added ahead of time by the archiver:
+--   python -m app.services.view_archiver run